@@ -2,11 +2,14 @@ from aiohttp import web
 from aiohttp_wsgi import WSGIHandler
 
 from app import create_app
+from app.aio import setup_native_routes
 
 
 def make_aiohttp_app(app):
     wsgi_handler = WSGIHandler(app)
     aioapp = web.Application()
+    # native handlers for the hot endpoints, everything else goes to Flask
+    setup_native_routes(aioapp, app)
     aioapp.router.add_route("*", "/{path_info:.*}", wsgi_handler)
     return aioapp
 
@@ -1,23 +1,41 @@
 import logging
+import random
 import time
+from uuid import uuid4
 
-import redis
+import click
 from apiflask import APIFlask as Flask
 from flask import g, request
 from flask.logging import default_handler
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 from .config import CONFIG_MAP
-from .logger import get_handler
+from .jobs import JobQueue
+from .logger import configure_logger, reset_log_context, set_log_context
+from .metrics import Metrics
+from .notifications import Notifications
+from .resources import Resources, engine_options
+from .results import ResultStore
+from .slow_queries import SlowQueryLog
 
 db = SQLAlchemy()
-migrate = Migrate()
+
+
+class App(Flask):
+    """The Flask app, with a Redis client created lazily in each process."""
+
+    @property
+    def redis(self):
+        return self.resources.redis
+
+    @redis.setter
+    def redis(self, client):
+        self.resources.redis = client
 
 
 def create_app(config=None):
     # read config
-    app = Flask(__name__)
+    app = App(__name__)
 
     if config is None:
         config = CONFIG_MAP[app.config["ENV"]]
@@ -26,22 +44,38 @@ def create_app(config=None):
 
     # customize logger
     app.logger.removeHandler(default_handler)
-    app.logger.addHandler(get_handler())
-    if not app.debug:
-        app.logger.setLevel(logging.INFO)
-    else:
-        app.logger.setLevel(logging.DEBUG)
+    configure_logger(app.logger, app.config)
+    app.logger.setLevel(logging.DEBUG if app.debug else logging.INFO)
 
     # disable werkzeug logger
     werkzeug_logger = logging.getLogger("werkzeug")
     werkzeug_logger.disabled = True
 
     # add customized plugin
-    app.redis = redis.StrictRedis.from_url(config.REDIS_URL)
+    app.resources = Resources(app)
+    app.metrics = Metrics(app)
+    app.jobs = JobQueue(app, config)
+    app.results = ResultStore(app)
+    app.notifications = Notifications(app)
+    app.slow_queries = SlowQueryLog(app)
 
     # init 3rd party flask plugins
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     db.init_app(app)
-    migrate.init_app(app, db)
+    if click.get_current_context(silent=True) is not None:
+        # only the flask commands use Flask-Migrate, which imports alembic
+        from flask_migrate import Migrate
+
+        Migrate(app, db)
+
+    from app.hashes import HashStore
+    from app.lookups import ModelCache
+    from app.models import Table
+    from app.search.cache import SearchCache
+
+    app.search_cache = SearchCache(app)
+    app.hash_cache = ModelCache(app, Table, ["hash"])
+    app.hashes = HashStore(app)
 
     # import blueprints
     from app.errors import bp as errors_bp
@@ -55,19 +89,50 @@ def create_app(config=None):
     def make_shell_context():
         return {"db": db}
 
+    # setup cli commands
+    from app.cli import commands
+
+    for command in commands:
+        app.cli.add_command(command)
+
     # setup request hooks
     @app.before_request
     def before_req():
         g.start = time.time()
+        g.perf_start = time.perf_counter()
+        g.request_id = request.headers.get("X-Request-ID") or uuid4().hex
+        g.log_context = set_log_context(request_id=g.request_id)
 
     @app.after_request
     def after_req(response):
-        ms_passed = (time.time() - g.start) * 1000
-        path = f'{response.status_code} "{request.method} {request.path}"'
-        log = f"{request.remote_addr} ===> {path}  🕒 {ms_passed:.2f} ms"
-        app.logger.info(log)
+        rate = app.config["LOG_ACCESS_SAMPLE_RATE"]
+        if response.status_code >= 500 or rate >= 1 or random.random() < rate:
+            ms_passed = (time.time() - g.start) * 1000
+            path = f'{response.status_code} "{request.method} {request.path}"'
+            log = f"{request.remote_addr} ===> {path}  🕒 {ms_passed:.2f} ms"
+            app.logger.info(log)
+        response.headers["X-Request-ID"] = g.request_id
+
+        endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+        app.metrics.observe(
+            "http_request_duration_seconds",
+            time.perf_counter() - g.perf_start,
+            method=request.method,
+            endpoint=endpoint,
+        )
+        app.metrics.inc(
+            "http_requests_total",
+            method=request.method,
+            endpoint=endpoint,
+            status=response.status_code,
+        )
         return response
 
+    @app.teardown_request
+    def teardown_req(exc):
+        if "log_context" in g:
+            reset_log_context(g.pop("log_context"))
+
     return app
 
 
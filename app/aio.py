@@ -0,0 +1,390 @@
+import asyncio
+import json
+import random
+import time
+from functools import partial
+from json import dumps
+from uuid import uuid4
+
+import marshmallow
+import redis.asyncio as aioredis
+from aiohttp import WSMsgType, web
+from werkzeug.http import HTTP_STATUS_CODES
+
+from app.codecs import accepts_encoding
+from app.logger import set_log_context
+from app.notifications import (
+    FINISHED,
+    KEEPALIVE,
+    AsyncNotifications,
+    format_event,
+    status_notification,
+)
+from app.results import AsyncResultReader
+from app.retention import ResultTooLarge
+from app.serializers import ResultPageSerializer, SearchCSVSerializer
+from app.tasks import process_fulltext_search, process_search_csv
+
+__all__ = ["NativeHandlers", "NATIVE_HANDLERS", "setup_native_routes"]
+
+
+def error_response(status_code, message=None):
+    payload = {"error": HTTP_STATUS_CODES.get(status_code, "Unknown error")}
+    if message:
+        payload["message"] = message
+    return web.json_response(payload, status=status_code)
+
+
+class NativeHandlers(object):
+    """
+    Native aiohttp versions of the hot endpoints of the Flask app.
+
+    They answer like their Flask counterparts, but read Redis with an
+    asyncio connection pool instead of taking a thread of the WSGI bridge.
+    Hashes go through the hash store and the id cache of the Flask app, in
+    a thread. Searches are queued on the job queue of the Flask app, whose
+    worker pool is started with the aiohttp app.
+
+    Args:
+        flask_app (Flask): The app the handlers take their config from.
+    """
+
+    log_prefix = "[CSV Search]"
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.logger = flask_app.logger
+        self.redis = None
+        self.notifications = None
+
+    async def startup(self, aioapp):
+        config = self.flask_app.config
+        if self.redis is None:
+            pool = aioredis.ConnectionPool.from_url(
+                config["REDIS_URL"], max_connections=config["AIO_REDIS_MAX_CONNECTIONS"]
+            )
+            self.redis = aioredis.Redis(connection_pool=pool)
+        self.results = AsyncResultReader(self.redis)
+        self.notifications = AsyncNotifications(self.flask_app, self.redis)
+        await self.notifications.start()
+        self.flask_app.jobs.start()
+
+    async def cleanup(self, aioapp):
+        await self.notifications.stop()
+        await self.redis.close()
+
+    async def run_sync(self, func, *args):
+        """
+        Run a blocking call of the Flask app in the default executor.
+
+        The call runs in an app context, like in a Flask view.
+
+        Args:
+            func (callable): The function.
+            *args: Its arguments.
+
+        Returns:
+            The result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(self._in_app_context, func, *args))
+
+    def _in_app_context(self, func, *args):
+        with self.flask_app.app_context():
+            return func(*args)
+
+    def logged(self, handler):
+        metrics = self.flask_app.metrics
+
+        async def wrapper(request):
+            start = time.time()
+            # each request runs in its own task, and so its own context
+            set_log_context(request_id=request.headers.get("X-Request-ID") or uuid4().hex)
+            response = await handler(request)
+            ms_passed = (time.time() - start) * 1000
+            rate = self.flask_app.config["LOG_ACCESS_SAMPLE_RATE"]
+            if response.status >= 500 or rate >= 1 or random.random() < rate:
+                path = f'{response.status} "{request.method} {request.path}"'
+                self.logger.info(f"{request.remote} ===> {path}  🕒 {ms_passed:.2f} ms")
+
+            endpoint = request.match_info.route.resource.canonical
+            metrics.observe(
+                "http_request_duration_seconds",
+                ms_passed / 1000,
+                method=request.method,
+                endpoint=endpoint,
+            )
+            metrics.inc(
+                "http_requests_total",
+                method=request.method,
+                endpoint=endpoint,
+                status=response.status,
+            )
+            return response
+
+        return wrapper
+
+    async def enqueue(self, task, job_id, **kwargs):
+        jobs = self.flask_app.jobs
+        key = jobs.job_key(job_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping=jobs.job_fields(task, kwargs))
+        pipe.expire(key, self.flask_app.config["JOB_STATUS_TTL"])
+        pipe.lpush(jobs.queue_key, job_id)
+        await pipe.execute()
+        return job_id
+
+    async def search_csv(self, request):
+        try:
+            csv_data = SearchCSVSerializer().load(request.query)
+            transaction_id = str(uuid4())
+            if "q" in csv_data:
+                await self.enqueue(
+                    process_fulltext_search,
+                    transaction_id,
+                    q=csv_data["q"],
+                    quantity=csv_data.get("quantity", ""),
+                    transaction_id=transaction_id,
+                )
+            else:
+                await self.enqueue(
+                    process_search_csv,
+                    transaction_id,
+                    name=csv_data.get("name", ""),
+                    city=csv_data.get("city", ""),
+                    quantity=csv_data.get("quantity", ""),
+                    transaction_id=transaction_id,
+                )
+            return web.json_response(
+                {"message": "Search request received", "transaction_id": transaction_id},
+                status=202,
+            )
+        except marshmallow.exceptions.ValidationError as e:
+            self.logger.error(f"{self.log_prefix} Validation error: {e}")
+            return error_response(400, message=str(e))
+        except Exception as e:
+            self.logger.error(f"{self.log_prefix} Error: {e}")
+            return error_response(500, message=str(e))
+
+    async def get_redis_value(self, request):
+        key = request.match_info["key"]
+        try:
+            params = ResultPageSerializer().load(request.query)
+        except marshmallow.exceptions.ValidationError as e:
+            return error_response(400, message=str(e))
+
+        if not params:
+            v, truncated = await self.results.read_result(key) or ("", False)
+            body = {"result": v}
+            if truncated:
+                body["truncated"] = True
+            return web.json_response(body)
+
+        cursor = params.get("cursor", 0)
+        if params.get("format") == "ndjson":
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            async for page in self.results.iter_pages(key, cursor, params.get("page_size")):
+                await response.write(
+                    "".join(dumps(record) + "\n" for record in page).encode()
+                )
+            await response.write_eof()
+            return response
+
+        if params.get("format") == "array":
+            return await self.result_array(request, key, cursor, params.get("page_size"))
+
+        page_size = params.get("page_size", self.flask_app.config["RESULT_PAGE_SIZE"])
+        page = await self.results.read_page(key, cursor, page_size)
+        if page is None:
+            return error_response(404, message="Unknown transaction ID")
+        records, count, truncated = page
+        next_cursor = cursor + len(records)
+        body = {
+            "result": records,
+            "count": count,
+            "next_cursor": next_cursor if next_cursor < count else None,
+        }
+        if truncated:
+            body["truncated"] = True
+        return web.json_response(body)
+
+    async def result_array(self, request, key, cursor, page_size):
+        accepts = partial(accepts_encoding, request.headers.get("Accept-Encoding"))
+        stored = await self.results.read_stored_page(key, cursor, page_size, accepts)
+        if stored is not None:
+            body, content_encoding, count, next_cursor, truncated = stored
+        else:
+            page_size = page_size or self.flask_app.config["RESULT_PAGE_SIZE"]
+            page = await self.results.read_page(key, cursor, page_size)
+            if page is None:
+                return error_response(404, message="Unknown transaction ID")
+            records, count, truncated = page
+            body, content_encoding = dumps(records).encode(), None
+            next_cursor = cursor + len(records)
+
+        headers = {
+            "Content-Type": "application/json",
+            "Vary": "Accept-Encoding",
+            "X-Result-Count": str(count),
+            "X-Next-Cursor": str(next_cursor) if next_cursor < count else "",
+        }
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        if truncated:
+            headers["X-Result-Truncated"] = "1"
+        return web.Response(body=body, headers=headers)
+
+    async def set_redis_value(self, request):
+        key = request.match_info["key"]
+        data = await request.json()
+        store = self.flask_app.results
+        # encoding, accounting and eviction run on the sync client
+        write = store.write if isinstance(data, list) else store.write_value
+        try:
+            await self.run_sync(write, key, data)
+        except ResultTooLarge as e:
+            return error_response(413, message=str(e))
+        return web.json_response({"message": "Data stored successfully"})
+
+    async def job_status(self, transaction_id):
+        # the status is read with the sync client of the job queue
+        return await self.run_sync(self.flask_app.jobs.status, transaction_id)
+
+    async def search_csv_events(self, request):
+        transaction_id = request.match_info["transaction_id"]
+        if await self.job_status(transaction_id) is None:
+            return error_response(404, message="Unknown transaction ID")
+
+        config = self.flask_app.config
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            }
+        )
+        await response.prepare(request)
+        deadline = time.monotonic() + config["NOTIFY_TIMEOUT"]
+        with self.notifications.subscribe(transaction_id) as subscription:
+            status = await self.job_status(transaction_id)
+            event = None
+            while status is not None and status["status"] not in FINISHED:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    event = format_event(status_notification(transaction_id, status), "timeout")
+                    break
+                notification = await subscription.get(min(config["NOTIFY_KEEPALIVE"], remaining))
+                if notification is not None:
+                    event = format_event(notification)
+                    break
+                await response.write(KEEPALIVE.encode())
+                status = await self.job_status(transaction_id)
+        await response.write(
+            (event or format_event(status_notification(transaction_id, status))).encode()
+        )
+        await response.write_eof()
+        return response
+
+    async def search_csv_events_ws(self, request):
+        """
+        Notify a WebSocket client of the searches it waits for.
+
+        Transaction IDs are given in ``transaction_id`` query parameters and
+        in ``{"subscribe": [...]}`` messages. One ``{"transaction_id",
+        "status"}`` message is sent for each when its job finishes, right away
+        if it already has or is unknown.
+        """
+        keepalive = self.flask_app.config["NOTIFY_KEEPALIVE"]
+        ws = web.WebSocketResponse(heartbeat=keepalive)
+        await ws.prepare(request)
+        with self.notifications.subscribe() as subscription:
+            sender = asyncio.create_task(self._send_notifications(ws, subscription, keepalive))
+            try:
+                for transaction_id in request.query.getall("transaction_id", []):
+                    await self._watch(subscription, transaction_id)
+                async for message in ws:
+                    if message.type != WSMsgType.TEXT:
+                        continue
+                    try:
+                        transaction_ids = json.loads(message.data)["subscribe"]
+                        if not isinstance(transaction_ids, list):
+                            raise TypeError
+                    except (ValueError, TypeError, KeyError):
+                        subscription.notify({"error": 'Expected {"subscribe": [...]}.'})
+                        continue
+                    for transaction_id in transaction_ids:
+                        await self._watch(subscription, str(transaction_id))
+            finally:
+                sender.cancel()
+        return ws
+
+    async def _watch(self, subscription, transaction_id):
+        # subscribed before reading the status, a job finishing in between
+        # is both notified and read, and only sent once
+        subscription.add(transaction_id)
+        status = await self.job_status(transaction_id)
+        if status is None or status["status"] in FINISHED:
+            subscription.notify(status_notification(transaction_id, status))
+
+    async def _send_notifications(self, ws, subscription, keepalive):
+        while True:
+            notification = await subscription.get(keepalive)
+            if notification is None:
+                # in case a notification was missed while reconnecting
+                for transaction_id in list(subscription.transaction_ids):
+                    await self._watch(subscription, transaction_id)
+            elif "transaction_id" not in notification or subscription.discard(
+                notification["transaction_id"]
+            ):
+                await ws.send_json(notification)
+
+    async def set_hash(self, request):
+        # inserted by the store of the Flask view, which keeps the Bloom
+        # filter and the id cache up to date
+        result = await self.run_sync(self.flask_app.hashes.insert, request.match_info["hash"])
+        return web.json_response({"result": result})
+
+    async def get_hash(self, request):
+        row = await self.run_sync(self.flask_app.hash_cache.get, int(request.match_info["id"]))
+        return web.json_response({"hash": row["hash"] if row else ""})
+
+
+# the key of the handlers in the aiohttp app, typed from aiohttp 3.9
+if hasattr(web, "AppKey"):
+    NATIVE_HANDLERS = web.AppKey("native_handlers", NativeHandlers)
+else:
+    NATIVE_HANDLERS = "native_handlers"
+
+
+def setup_native_routes(aioapp, flask_app):
+    """
+    Register the native handlers on an aiohttp app.
+
+    Call it before adding the WSGI catch-all route, routes being matched in
+    the order they were added. Other methods on these paths still fall
+    through to Flask.
+
+    Args:
+        aioapp (web.Application): The aiohttp app.
+        flask_app (Flask): The Flask app.
+
+    Returns:
+        NativeHandlers: The handlers.
+    """
+    handlers = NativeHandlers(flask_app)
+    aioapp[NATIVE_HANDLERS] = handlers
+    aioapp.on_startup.append(handlers.startup)
+    aioapp.on_cleanup.append(handlers.cleanup)
+
+    logged = handlers.logged
+    aioapp.router.add_get("/search-csv", logged(handlers.search_csv))
+    aioapp.router.add_get(
+        "/search-csv/{transaction_id}/events", logged(handlers.search_csv_events)
+    )
+    aioapp.router.add_get("/search-csv/ws", logged(handlers.search_csv_events_ws))
+    aioapp.router.add_get("/redis/{key}", logged(handlers.get_redis_value))
+    aioapp.router.add_put("/redis/{key}", logged(handlers.set_redis_value))
+    aioapp.router.add_put("/db/{hash}", logged(handlers.set_hash))
+    aioapp.router.add_get(r"/db/{id:\d+}", logged(handlers.get_hash))
+    return handlers
@@ -0,0 +1,58 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+__all__ = ["commands"]
+
+
+@click.command("worker")
+@with_appcontext
+def worker():
+    """Run queued background jobs until interrupted."""
+    current_app.jobs.work()
+
+
+@click.command("load-csv")
+@click.argument("filename")
+@click.option("--chunk-size", default=5000, help="Rows inserted per transaction.")
+@click.option("--checkpoint", help="File to resume an interrupted load from.")
+@click.option("--workers", type=int, help="Parse the file in this many processes.")
+@with_appcontext
+def load_csv(filename, chunk_size, checkpoint, workers):
+    """Bulk load a CSV file into csv_data."""
+    from app.helpers import load_csv_data, load_csv_data_parallel
+
+    def progress(rows):
+        click.echo(f"{rows} rows loaded")
+
+    if workers:
+        if checkpoint:
+            raise click.UsageError("--checkpoint is not supported with --workers.")
+        load_csv_data_parallel(filename, workers, chunk_size, progress=progress)
+    else:
+        load_csv_data(filename, chunk_size, progress=progress, checkpoint=checkpoint)
+
+
+@click.command("sync-csv")
+@click.argument("filename")
+@click.option("--chunk-size", default=5000, help="Changes applied per transaction.")
+@click.option("--dry-run", is_flag=True, help="Only report the changes.")
+@with_appcontext
+def sync_csv(filename, chunk_size, dry_run):
+    """Insert, update and delete the rows of csv_data that differ from a CSV file."""
+    from app.helpers import sync_csv_data
+
+    summary = sync_csv_data(filename, chunk_size, dry_run=dry_run)
+    click.echo(", ".join(f"{count} {change}" for change, count in summary.items()))
+
+
+@click.command("rebuild-hash-filter")
+@with_appcontext
+def rebuild_hash_filter():
+    """Rebuild the Bloom filter of the hashes from the table."""
+    count = current_app.hashes.rebuild_filter()
+    click.echo(f"{count} hashes added to the filter")
+
+
+# registered on the app by create_app()
+commands = [worker, load_csv, sync_csv, rebuild_hash_filter]
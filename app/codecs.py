@@ -0,0 +1,160 @@
+import zlib
+
+__all__ = ["CODECS", "RECORD_DICTIONARY", "accepts_encoding", "get_codec"]
+
+# Preset dictionary of the "zlib-dict" codec: the keys of a record and the
+# most common values of the columns, the most frequent last, where deflate
+# finds them at the shortest distance. Stored pages depend on it, add a new
+# codec rather than changing it.
+RECORD_DICTIONARY = (
+    b'.net", ".uk", ".edu", ".gov", ".jp", ".org", ".com", '
+    b'"gender": "Polygender", "gender": "Non-binary", "gender": "Genderfluid", '
+    b'"gender": "Female", "gender": "Genderqueer", "gender": "Agender", '
+    b'"gender": "Bigender", "gender": "Male", '
+    b'{"id": 1, "user_id": 1, "first_name": "", "last_name": "", "email": "", '
+    b'"gender": "", "company": "", "city": ""}, '
+    b'{"id": 10, "user_id": 10, "first_name": "", "last_name": "", "email": "'
+)
+
+
+class Codec(object):
+    """Compression of stored result pages."""
+
+    name = None
+    # the HTTP content coding of the compressed pages, None if clients
+    # cannot decode them
+    content_encoding = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class IdentityCodec(Codec):
+    """Pages stored as encoded."""
+
+    name = "identity"
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class GzipCodec(Codec):
+    """
+    Pages compressed to gzip members, which can be sent as they are to
+    clients accepting the gzip content coding.
+    """
+
+    name = "gzip"
+    content_encoding = "gzip"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class DictionaryCodec(Codec):
+    """
+    Pages compressed by zlib with RECORD_DICTIONARY as preset dictionary.
+
+    The dictionary saves the keys and common values of the first records
+    of each page, which matters most for small pages.
+    """
+
+    name = "zlib-dict"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=RECORD_DICTIONARY
+        )
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=RECORD_DICTIONARY)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class LZ4Codec(Codec):
+    """Pages compressed to LZ4 frames, faster than zlib but larger."""
+
+    name = "lz4"
+
+    def __init__(self):
+        import lz4.frame
+
+        self._compress = lz4.frame.compress
+        self._decompress = lz4.frame.decompress
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def decompress(self, data):
+        return self._decompress(data)
+
+
+CODECS = {
+    IdentityCodec.name: IdentityCodec,
+    GzipCodec.name: GzipCodec,
+    DictionaryCodec.name: DictionaryCodec,
+    LZ4Codec.name: LZ4Codec,
+}
+
+_instances = {}
+
+
+def get_codec(name):
+    """
+    Get a result codec by name.
+
+    Args:
+        name (str): "identity", "gzip", "zlib-dict" or "lz4", which requires
+            the lz4 package.
+
+    Returns:
+        Codec: The codec.
+    """
+    codec = _instances.get(name)
+    if codec is None:
+        codec = _instances[name] = CODECS[name]()
+    return codec
+
+
+def accepts_encoding(header, coding):
+    """
+    Tell whether an Accept-Encoding header accepts a content coding.
+
+    Args:
+        header (str): The header value, None if it was not sent.
+        coding (str): The content coding, e.g. "gzip".
+
+    Returns:
+        bool: True if the coding, or "*", is listed with a non-zero quality.
+    """
+    if not header:
+        return False
+    qualities = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get(coding, qualities.get("*", 0)) > 0
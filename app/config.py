@@ -15,6 +15,81 @@ class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     REDIS_URL = os.environ.get("REDIS_URL") or "redis://localhost:6379/1"
     REDIS_ENDPOINT = "http://localhost:5000/redis/"
+    # connection pools, created in each worker process
+    REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS") or 50)
+    REDIS_POOL_TIMEOUT = 5
+    REDIS_HEALTH_CHECK_INTERVAL = 30
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or 10)
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_PRE_PING = True
+    DB_POOL_RECYCLE = 30 * 60
+    # connections of the native aiohttp handlers, per worker
+    AIO_REDIS_MAX_CONNECTIONS = int(os.environ.get("AIO_REDIS_MAX_CONNECTIONS") or 100)
+    # search results, "redis" writes them directly, "http" to REDIS_ENDPOINT
+    RESULTS_BACKEND = os.environ.get("RESULTS_BACKEND") or "redis"
+    RESULT_TTL = int(os.environ.get("RESULT_TTL") or 24 * 60 * 60)
+    RESULT_PAGE_SIZE = int(os.environ.get("RESULT_PAGE_SIZE") or 500)
+    # "compat" encodes results like json.dumps, "orjson" or "auto" (orjson if installed) faster
+    RESULT_ENCODER = os.environ.get("RESULT_ENCODER") or "compat"
+    # compression of the stored pages, "identity", "gzip", "zlib-dict" or "lz4" (needs lz4);
+    # gzip pages are sent as they are to clients accepting it, see format=array. Only enable one
+    # once no process older than the codec header runs, they can't read compressed pages
+    RESULT_CODEC = os.environ.get("RESULT_CODEC") or "identity"
+    # bytes stored per result (0 for no limit), larger ones are truncated to their first records
+    # that fit, marked in their meta hash, or rejected with RESULT_OVERSIZE = "reject"
+    RESULT_MAX_BYTES = int(os.environ.get("RESULT_MAX_BYTES") or 16 * 2**20)
+    RESULT_OVERSIZE = os.environ.get("RESULT_OVERSIZE") or "truncate"
+    # bytes of all the stored results, the least recently read are evicted beyond (0 for no limit)
+    RESULT_MEMORY_BUDGET = int(os.environ.get("RESULT_MEMORY_BUDGET") or 512 * 2**20)
+    RESULT_WRITE_RETRIES = 3
+    RESULT_WRITE_BACKOFF = 0.05
+    # search engine, "sql" filters in the database, "trigram" and "columnar" in memory
+    SEARCH_ENGINE = os.environ.get("SEARCH_ENGINE") or "sql"
+    COLUMNAR_COUNT_INTERVAL = 5
+    # results of a full-text search (q=) without a quantity
+    FULLTEXT_DEFAULT_QUANTITY = 100
+    # searches of a POST /search-csv/batch request
+    SEARCH_BATCH_MAX_SIZE = 100
+    # bulk hash insertion, and the Bloom filter of the stored hashes
+    HASH_BATCH_SIZE = 1000
+    HASH_BULK_MAX_SIZE = 10000
+    HASH_FILTER_CAPACITY = int(os.environ.get("HASH_FILTER_CAPACITY") or 1000000)
+    HASH_FILTER_ERROR_RATE = 0.001
+    # rows cached by primary key, in each process then in Redis
+    MODEL_CACHE_LOCAL_SIZE = int(os.environ.get("MODEL_CACHE_LOCAL_SIZE") or 10000)
+    MODEL_CACHE_TTL = 24 * 60 * 60
+    MODEL_CACHE_NEGATIVE_TTL = 60
+    # search results cache, a TTL of 0 disables it
+    SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL") or 300)
+    SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES") or 1000)
+    # larger results are not cached, the result store already keeps them
+    SEARCH_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRY_BYTES") or 2**20)
+    SEARCH_CACHE_MIN_BUCKET = 16
+    SEARCH_CACHE_LOCK_TIMEOUT = 30
+    SEARCH_CACHE_POLL_INTERVAL = 0.02
+    # background jobs
+    JOB_QUEUE = os.environ.get("JOB_QUEUE") or "search-csv"
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS") or 4)
+    JOB_WORKER_TYPE = os.environ.get("JOB_WORKER_TYPE") or "thread"
+    JOB_STATUS_TTL = 24 * 60 * 60
+    # completion notifications, seconds an event stream waits for its search, and between
+    # keep-alives, when the status is read again in case a notification was missed
+    NOTIFY_TIMEOUT = int(os.environ.get("NOTIFY_TIMEOUT") or 60)
+    NOTIFY_KEEPALIVE = 15
+    # logging, "text" or "json" lines written by a listener thread from a
+    # queue of LOG_QUEUE_SIZE records (0 writes them in the logging thread)
+    LOG_FORMAT = os.environ.get("LOG_FORMAT") or "text"
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE") or 10000)
+    # share of the requests getting an access line, server errors always do
+    LOG_ACCESS_SAMPLE_RATE = float(os.environ.get("LOG_ACCESS_SAMPLE_RATE") or 1)
+    # metrics, summed across workers in Redis every METRICS_FLUSH_INTERVAL seconds
+    METRICS_ENABLED = (os.environ.get("METRICS_ENABLED") or "1") == "1"
+    METRICS_FLUSH_INTERVAL = 5
+    # statements slower than this are logged with their plan (0 disables), the last
+    # SLOW_QUERY_LOG_SIZE in a Redis list
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS") or 250)
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE") or 100)
 
 
 class Development(Config):
@@ -23,6 +98,8 @@ class Development(Config):
 
 class Production(Config):
     A_SPECIAL_CONFIG = ""
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or 20)
 
 
 CONFIG_MAP = {"development": Development, "production": Production}
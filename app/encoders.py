@@ -0,0 +1,198 @@
+import json
+from json.encoder import encode_basestring_ascii
+
+__all__ = ["RECORD_COLUMNS", "ENCODERS", "get_encoder", "load_records"]
+
+# the keys of CSVData.to_dict(), in order
+RECORD_COLUMNS = (
+    "id",
+    "user_id",
+    "first_name",
+    "last_name",
+    "email",
+    "gender",
+    "company",
+    "city",
+)
+
+
+def _null(value):
+    return "null"
+
+
+_VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    type(None): _null,
+}
+
+
+def _encode_value(value):
+    encode = _VALUE_ENCODERS.get(type(value))
+    return encode(value) if encode is not None else json.dumps(value)
+
+
+class Encoder(object):
+    """Base of the result encoders."""
+
+    # the format of the encoded pages, to decode them with load_records()
+    format = "json"
+
+    def dumps(self, results):
+        """
+        Encode search results.
+
+        Args:
+            results (list): Rows in RECORD_COLUMNS order, or dictionaries.
+
+        Returns:
+            bytes: The JSON encoded records.
+        """
+        if results and isinstance(results[0], dict):
+            return self.encode_records(results)
+        return self.encode(results)
+
+
+class CompatEncoder(Encoder):
+    """
+    Encodes rows with the output of json.dumps() on their dictionaries.
+
+    Values are encoded a column at a time, with the stdlib's C string
+    escaping when a column only holds strings, and formatted into a template
+    of the record. No dictionary is built and the bytes are identical to the
+    stdlib encoder's defaults.
+    """
+
+    name = "compat"
+    template = "{" + ", ".join(f'"{column}": %s' for column in RECORD_COLUMNS) + "}"
+
+    def encode(self, rows):
+        """
+        Encode rows as a JSON array of records.
+
+        Args:
+            rows (list): Sequences of values in RECORD_COLUMNS order.
+
+        Returns:
+            bytes: The JSON encoded records.
+        """
+        columns = []
+        for column in zip(*rows):
+            kinds = set(map(type, column))
+            if kinds == {str}:
+                columns.append(map(encode_basestring_ascii, column))
+            elif kinds == {int}:
+                columns.append(map(int.__repr__, column))
+            else:
+                columns.append(map(_encode_value, column))
+        records = ", ".join(map(self.template.__mod__, zip(*columns)))
+        return f"[{records}]".encode("ascii")
+
+    def encode_records(self, records):
+        """Encode dictionaries as a JSON array."""
+        return json.dumps(records).encode("ascii")
+
+
+class OrjsonEncoder(Encoder):
+    """
+    Encodes rows with orjson.
+
+    The output is compact UTF-8 JSON, equivalent to but not byte identical
+    with the stdlib's, which separates items with a space and escapes
+    non-ASCII characters.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._dumps = orjson.dumps
+
+    def encode(self, rows):
+        """Encode rows as a JSON array of records."""
+        return self._dumps([dict(zip(RECORD_COLUMNS, row)) for row in rows])
+
+    def encode_records(self, records):
+        """Encode dictionaries as a JSON array."""
+        return self._dumps(records)
+
+
+class MsgpackEncoder(Encoder):
+    """
+    Encodes rows with msgpack.
+
+    Rows are packed as arrays after a first array of the column names, so
+    the keys are only stored once per page. Dictionaries are packed as
+    maps. The pages are not JSON, they are converted when read.
+    """
+
+    name = "msgpack"
+    format = "msgpack"
+
+    def __init__(self):
+        import msgpack
+
+        self._packb = msgpack.packb
+
+    def encode(self, rows):
+        """Encode rows as the column names followed by the rows."""
+        return self._packb([RECORD_COLUMNS, *rows])
+
+    def encode_records(self, records):
+        """Encode dictionaries as an array of maps."""
+        return self._packb(records)
+
+
+def _load_msgpack(payload):
+    import msgpack
+
+    items = msgpack.unpackb(payload)
+    if not items or isinstance(items[0], dict):
+        return items
+    columns = items[0]
+    return [dict(zip(columns, row)) for row in items[1:]]
+
+
+# decoders of the encoded pages into records, by format
+LOADERS = {"json": json.loads, "msgpack": _load_msgpack}
+
+
+def load_records(payload, format="json"):
+    """
+    Decode an encoded page.
+
+    Args:
+        payload (bytes): The page, as encoded.
+        format (str): The format of the encoder of the page.
+
+    Returns:
+        list: The records, as dictionaries.
+    """
+    return LOADERS[format](payload)
+
+
+ENCODERS = {
+    CompatEncoder.name: CompatEncoder,
+    OrjsonEncoder.name: OrjsonEncoder,
+    MsgpackEncoder.name: MsgpackEncoder,
+}
+
+
+def get_encoder(name):
+    """
+    Get a result encoder by name.
+
+    Args:
+        name (str): "compat", "orjson", "msgpack", or "auto" for orjson
+            when it is installed and compat otherwise.
+
+    Returns:
+        Encoder: The encoder.
+    """
+    if name == "auto":
+        try:
+            return OrjsonEncoder()
+        except ImportError:
+            return CompatEncoder()
+    return ENCODERS[name]()
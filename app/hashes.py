@@ -0,0 +1,209 @@
+import hashlib
+import math
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import Table
+
+__all__ = ["BloomFilter", "HashStore"]
+
+# hashes added to the filter per pipeline while rebuilding it
+REBUILD_CHUNK_SIZE = 10000
+
+
+class BloomFilter(object):
+    """
+    Bloom filter stored in a Redis bitmap.
+
+    The bit array is sized for ``capacity`` items at ``error_rate`` false
+    positives, and its size is part of the key, so a filter built with
+    other settings is never read.
+
+    Args:
+        redis (Redis): The Redis client.
+        name (str): The key prefix of the filter.
+        capacity (int): The number of items the filter is sized for.
+        error_rate (float): The false positive rate at capacity.
+    """
+
+    def __init__(self, redis, name, capacity, error_rate):
+        self.redis = redis
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.key = f"{name}:{self.size}:{self.hashes}"
+
+    def offsets(self, item):
+        # double hashing, k indexes out of one 128 bits digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add_many(self, items, key=None):
+        """Add items to the filter, in one round trip."""
+        pipe = self.redis.pipeline(transaction=False)
+        for item in items:
+            # one BITFIELD command sets all the bits of an item
+            bits = pipe.bitfield(key or self.key)
+            for offset in self.offsets(item):
+                bits.set("u1", offset, 1)
+            bits.execute()
+        pipe.execute()
+
+    def contains_many(self, items):
+        """
+        Check items against the filter, in one round trip.
+
+        Returns:
+            list: False for the items that were never added, True for those
+            that probably were.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for item in items:
+            bits = pipe.bitfield(self.key)
+            for offset in self.offsets(item):
+                bits.get("u1", offset)
+            bits.execute()
+        return [all(bits) for bits in pipe.execute()]
+
+    def rebuild(self, items):
+        """
+        Replace the filter with one holding the given items.
+
+        The new filter is built under a temporary key and renamed over the
+        current one, so checks never see a partial filter.
+
+        Args:
+            items (iterable): All the items of the new filter.
+        """
+        tmp_key = f"{self.key}:rebuild"
+        self.redis.delete(tmp_key)
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == REBUILD_CHUNK_SIZE:
+                self.add_many(chunk, tmp_key)
+                chunk = []
+        if chunk:
+            self.add_many(chunk, tmp_key)
+        if self.redis.exists(tmp_key):
+            self.redis.rename(tmp_key, self.key)
+        else:
+            self.redis.delete(self.key)
+
+
+class HashStore(object):
+    """
+    Bulk insertion of hashes into ``table``.
+
+    Hashes are inserted ``HASH_BATCH_SIZE`` at a time with INSERT ... ON
+    CONFLICT DO NOTHING, one commit per batch. A Bloom filter in Redis holds
+    the hashes already stored: the hashes it has never seen skip the
+    existence check, the others are checked with one SELECT per batch. The
+    filter only saves work, hashes stored without it, e.g. before it was
+    built, are still reported as duplicates by the database.
+    """
+
+    filter_name = "hash-filter"
+
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def filter(self):
+        config = self.app.config
+        return BloomFilter(
+            self.app.redis,
+            self.filter_name,
+            config["HASH_FILTER_CAPACITY"],
+            config["HASH_FILTER_ERROR_RATE"],
+        )
+
+    def insert(self, hash):
+        """Insert a hash, returning False if it was already stored."""
+        return self.insert_many([hash])[0]
+
+    def insert_many(self, hashes):
+        """
+        Insert hashes into ``table``.
+
+        Args:
+            hashes (list): The hashes, repeated ones are only inserted once.
+
+        Returns:
+            list: For each hash, True if it was inserted, False if it was
+            already stored or earlier in the list.
+        """
+        unique = list(dict.fromkeys(hashes))
+        bloom = self.filter
+        batch_size = self.app.config["HASH_BATCH_SIZE"]
+        inserted = {}
+        for start in range(0, len(unique), batch_size):
+            batch = unique[start : start + batch_size]
+            seen = [h for h, maybe in zip(batch, bloom.contains_many(batch)) if maybe]
+            existing = self._existing(seen) if seen else set()
+            candidates = [h for h in batch if h not in existing]
+            if candidates:
+                ids = self._insert(candidates)
+                db.session.commit()
+                self.app.hash_cache.put_many({id: {"hash": h} for h, id in ids.items()})
+                inserted.update(ids)
+            # every hash of the batch is stored now
+            seen = set(seen)
+            bloom.add_many(h for h in batch if h not in seen)
+
+        results, done = [], set()
+        for hash in hashes:
+            results.append(hash in inserted and hash not in done)
+            done.add(hash)
+        return results
+
+    def _existing(self, hashes):
+        query = select(Table.hash).where(Table.hash.in_(hashes))
+        return set(db.session.execute(query).scalars())
+
+    def _insert(self, hashes):
+        values = [{"hash": hash} for hash in hashes]
+        dialect = db.session.connection().dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(Table).values(values)
+            statement = statement.on_conflict_do_nothing(index_elements=["hash"])
+            return dict(db.session.execute(statement.returning(Table.hash, Table.id)).all())
+
+        if dialect == "sqlite":
+            statement = sqlite.insert(Table).values(values)
+            count = db.session.execute(
+                statement.on_conflict_do_nothing(index_elements=["hash"])
+            ).rowcount
+            # the insert holds the write lock until the commit, and new rows
+            # get rowids above all the existing ones, so ours are the last
+            query = (
+                select(Table.hash, Table.id)
+                .where(Table.hash.in_(hashes))
+                .order_by(Table.id.desc())
+                .limit(count)
+            )
+            return dict(db.session.execute(query).all()) if count else {}
+
+        existing = self._existing(hashes)
+        new = [hash for hash in hashes if hash not in existing]
+        if new:
+            db.session.execute(insert(Table), [{"hash": hash} for hash in new])
+        query = select(Table.hash, Table.id).where(Table.hash.in_(new))
+        return dict(db.session.execute(query).all()) if new else {}
+
+    def rebuild_filter(self):
+        """
+        Rebuild the Bloom filter from the hashes stored in ``table``.
+
+        Returns:
+            int: The number of hashes in the filter.
+        """
+        count = db.session.scalar(select(func.count()).select_from(Table))
+        hashes = db.session.execute(
+            select(Table.hash).execution_options(yield_per=REBUILD_CHUNK_SIZE)
+        ).scalars()
+        self.filter.rebuild(hashes)
+        return count
@@ -1,19 +1,518 @@
 import csv
+import hashlib
+import io
+import itertools
+import json
+import marshal
+import mmap
+import os
+from collections import deque
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
 from app import db
 from app.models import CSVData
+from app.search.cache import mark_csv_data_changed
+
+CSV_COLUMNS = ("user_id", "first_name", "last_name", "email", "gender", "company", "city")
+CHUNK_SIZE = 5000
+# bytes of the file parsed per task by load_csv_data_parallel()
+RANGE_SIZE = 16 * 2**20
+# bytes copied out of the map at a time while counting quotes
+SCAN_BLOCK_SIZE = 8 * 2**20
+# bytes decoded at a time by parse_csv_range()
+PARSE_BLOCK_SIZE = 2**20
+
+# the user_ids of the file already compared by sync_csv_data(), and not stored
+_SEEN, _NEW = object(), object()
+
+
+def parse_csv_row(row):
+    """
+    Convert a CSV record into the values of a CSVData row.
+
+    Args:
+        row (list): The fields of the record, in CSV_COLUMNS order.
+
+    Returns:
+        tuple: The typed values.
+    """
+    return (int(row[0]) if row[0] else None, *row[1:7])
+
+
+def read_csv_chunks(csv_file, chunk_size, skip=0):
+    """
+    Read a CSV file in chunks of typed rows.
+
+    Args:
+        csv_file (file): The CSV file, opened with newline=''.
+        chunk_size (int): The number of rows per chunk.
+        skip (int): The number of rows to skip at the start.
+
+    Yields:
+        list: A chunk of tuples in CSV_COLUMNS order.
+    """
+    reader = itertools.islice(csv.reader(csv_file), skip, None)
+    while True:
+        chunk = [parse_csv_row(row) for row in itertools.islice(reader, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_csv_rows(rows, hashes=None):
+    """
+    Bulk insert rows into csv_data, using COPY on Postgres.
+
+    Args:
+        rows (list): Tuples in CSV_COLUMNS order.
+        hashes (list): The row_hash() of each row, None to leave them null.
+    """
+    columns = CSV_COLUMNS
+    if hashes is not None:
+        columns = (*CSV_COLUMNS, "row_hash")
+        rows = [(*row, row_hash) for row, row_hash in zip(rows, hashes)]
+
+    if db.engine.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        text_columns = ", ".join(columns[1:])
+        columns = ", ".join(columns)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY {CSVData.__tablename__} ({columns}) FROM STDIN "
+            f"WITH (FORMAT csv, FORCE_NOT_NULL ({text_columns}))",
+            buffer,
+        )
+        mark_csv_data_changed(db.session, rewrite=False)
+    else:
+        db.session.execute(insert(CSVData.__table__), [dict(zip(columns, row)) for row in rows])
+
+
+def _read_checkpoint(checkpoint, filename):
+    try:
+        with open(checkpoint) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    return state if state.get("filename") == os.path.abspath(filename) else None
+
+
+def _write_checkpoint(checkpoint, filename, baseline):
+    tmp = f"{checkpoint}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"filename": os.path.abspath(filename), "baseline": baseline}, f)
+    os.replace(tmp, checkpoint)
+
 
-def load_csv_data(filename):
-    with open(filename, newline='') as csv_file:
-        reader = csv.reader(csv_file)
-        for row in reader:
-            csv_data = CSVData(
-                user_id=row[0],
-                first_name=row[1],
-                last_name=row[2],
-                email=row[3],
-                gender=row[4],
-                company=row[5],
-                city=row[6]
-            )
-            db.session.add(csv_data)
+def load_csv_data(filename, chunk_size=CHUNK_SIZE, progress=None, checkpoint=None):
+    """
+    Stream a CSV file into csv_data, committing every chunk.
+
+    Rows are never loaded as ORM objects, so memory is bounded by the chunk
+    size whatever the size of the file.
+
+    When a checkpoint file is given, a load interrupted after some chunks
+    were committed resumes after the last committed chunk when run again.
+    It records the number of rows in csv_data before the load, so it expects
+    no other writers to the table meanwhile.
+
+    Args:
+        filename (str): The path of the CSV file.
+        chunk_size (int): The number of rows inserted per transaction.
+        progress (callable): Called with the number of rows loaded so far
+            after every committed chunk.
+        checkpoint (str): The path of the checkpoint file.
+
+    Returns:
+        int: The number of rows loaded by this call.
+    """
+    loaded = 0
+    if checkpoint:
+        count = db.session.query(func.count(CSVData.id)).scalar()
+        state = _read_checkpoint(checkpoint, filename)
+        if state is None:
+            _write_checkpoint(checkpoint, filename, count)
+        else:
+            loaded = count - state["baseline"]
+
+    inserted = 0
+    with open(filename, newline="") as csv_file:
+        for chunk in read_csv_chunks(csv_file, chunk_size, skip=loaded):
+            insert_csv_rows(chunk)
+            db.session.commit()
+            inserted += len(chunk)
+            if progress is not None:
+                progress(loaded + inserted)
+
+    if checkpoint:
+        os.remove(checkpoint)
+    return inserted
+
+
+def row_hash(row):
+    """
+    Digest the values of a row, to tell whether it changed.
+
+    Args:
+        row (tuple): The values, in CSV_COLUMNS order.
+
+    Returns:
+        str: 16 hexadecimal digits.
+    """
+    if None in row:
+        row = ["\x00" if value is None else value for value in row]
+    data = "\x1f".join(map(str, row))
+    return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+
+def _backfill_row_hashes(chunk_size):
+    # rows loaded by load_csv_data() or another writer have no hash yet
+    table = CSVData.__table__
+    columns = [table.c[column] for column in CSV_COLUMNS]
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values(row_hash=bindparam("new_row_hash"))
+    )
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, *columns)
+            .where(table.c.row_hash.is_(None), table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        db.session.execute(
+            statement,
+            [{"row_id": id, "new_row_hash": row_hash(tuple(values))} for id, *values in rows],
+        )
+        db.session.commit()
+        last_id = rows[-1][0]
+
+
+def _stored_row_hashes(hash_missing=False):
+    # the hash of the first row of every user_id, and the ids of the others;
+    # the rows without a hash are hashed in memory with hash_missing
+    table = CSVData.__table__
+    columns = [table.c[column] for column in CSV_COLUMNS] if hash_missing else []
+    query = (
+        select(table.c.user_id, table.c.row_hash, table.c.id, *columns)
+        .where(table.c.user_id.isnot(None))
+        .order_by(table.c.id)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    hashes, duplicate_ids = {}, []
+    for user_id, stored_hash, id, *values in db.session.execute(query):
+        if user_id in hashes:
+            duplicate_ids.append(id)
+        elif stored_hash is None and hash_missing:
+            hashes[user_id] = row_hash(tuple(values))
+        else:
+            hashes[user_id] = stored_hash
+    return hashes, duplicate_ids
+
+
+def _apply_changes(inserts, updates, deletes):
+    table = CSVData.__table__
+    if deletes:
+        db.session.execute(delete(table).where(table.c.user_id.in_(deletes)))
+    if updates:
+        statement = (
+            update(table)
+            .where(table.c.user_id == bindparam("key_user_id"))
+            .values({column: bindparam(f"new_{column}") for column in CSV_COLUMNS[1:]})
+            .values(row_hash=bindparam("new_row_hash"))
+        )
+        db.session.execute(
+            statement,
+            [
+                {
+                    "key_user_id": row[0],
+                    "new_row_hash": hash,
+                    **{f"new_{column}": value for column, value in zip(CSV_COLUMNS[1:], row[1:])},
+                }
+                for row, hash in updates
+            ],
+        )
+    if inserts:
+        insert_csv_rows([row for row, _ in inserts], [hash for _, hash in inserts])
     db.session.commit()
+
+
+def _delete_duplicates(duplicate_ids, chunk_size):
+    table = CSVData.__table__
+    for start in range(0, len(duplicate_ids), chunk_size):
+        ids = duplicate_ids[start : start + chunk_size]
+        db.session.execute(delete(table).where(table.c.id.in_(ids)))
+        db.session.commit()
+
+
+def _diff_row(row, stored):
+    """
+    Compare a file row with the stored hashes, marking its user_id as seen.
+
+    Returns:
+        tuple: The change, "inserted", "updated", "unchanged" or "skipped",
+        and the hash of the row, None if skipped.
+    """
+    user_id = row[0]
+    stored_hash = stored.get(user_id, _NEW)
+    if user_id is None or stored_hash is _SEEN:
+        return "skipped", None
+    stored[user_id] = _SEEN
+    hash = row_hash(row)
+    if stored_hash is _NEW:
+        return "inserted", hash
+    if stored_hash != hash:
+        return "updated", hash
+    return "unchanged", hash
+
+
+def _read_changes(filename, chunk_size, stored, summary, progress=None):
+    """
+    Read the rows of a CSV file to insert or update, counting the changes.
+
+    Yields:
+        tuple: Lists of (row, hash) to insert and to update, ``chunk_size``
+        changes at most, emptied once the next one is asked for.
+    """
+    inserts, updates = [], []
+    changes = {"inserted": inserts, "updated": updates}
+    compared = 0
+    with open(filename, newline="") as csv_file:
+        for chunk in read_csv_chunks(csv_file, chunk_size):
+            for row in chunk:
+                change, hash = _diff_row(row, stored)
+                summary[change] += 1
+                if change in changes:
+                    changes[change].append((row, hash))
+                    if len(inserts) + len(updates) >= chunk_size:
+                        yield inserts, updates
+                        inserts.clear()
+                        updates.clear()
+            compared += len(chunk)
+            if progress is not None:
+                progress(compared)
+    if inserts or updates:
+        yield inserts, updates
+
+
+def sync_csv_data(filename, chunk_size=CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Bring csv_data in line with a CSV file, writing only the differences.
+
+    Rows are matched on user_id and compared through row_hash(), stored in
+    csv_data.row_hash: the rows of the file missing from the table are
+    inserted, the rows whose hash differs are updated, and the rows whose
+    user_id is not in the file are deleted. Changes are committed
+    ``chunk_size`` at a time, so running it again after an interruption, or
+    with the same file, only applies what is left.
+
+    The first sync of a table also hashes the rows stored without one, and
+    deletes the rows repeating a user_id, keeping the first. The file rows
+    without a user_id, and the repeated ones, are skipped. The user_id and
+    hash of every stored row are held in memory.
+
+    Args:
+        filename (str): The path of the CSV file.
+        chunk_size (int): The number of changes applied per transaction.
+        dry_run (bool): Only compute the changes.
+        progress (callable): Called with the number of file rows compared
+            so far after every chunk.
+
+    Returns:
+        dict: The number of rows inserted, updated, deleted, unchanged and
+        skipped, and of duplicate rows deleted.
+    """
+    if not dry_run:
+        _backfill_row_hashes(chunk_size)
+    stored, duplicate_ids = _stored_row_hashes(hash_missing=dry_run)
+    summary = dict.fromkeys(
+        ("inserted", "updated", "deleted", "unchanged", "skipped", "duplicates"), 0
+    )
+    summary["duplicates"] = len(duplicate_ids)
+    if not dry_run:
+        _delete_duplicates(duplicate_ids, chunk_size)
+
+    for inserts, updates in _read_changes(filename, chunk_size, stored, summary, progress):
+        if not dry_run:
+            _apply_changes(inserts, updates, [])
+
+    deletes = [user_id for user_id, stored_hash in stored.items() if stored_hash is not _SEEN]
+    summary["deleted"] = len(deletes)
+    if not dry_run:
+        for start in range(0, len(deletes), chunk_size):
+            _apply_changes([], [], deletes[start : start + chunk_size])
+    return summary
+
+
+def _count_quotes(mm, start, end):
+    return sum(
+        mm[i : min(i + SCAN_BLOCK_SIZE, end)].count(b'"')
+        for i in range(start, end, SCAN_BLOCK_SIZE)
+    )
+
+
+def split_csv_ranges(filename, range_size=RANGE_SIZE):
+    """
+    Split a CSV file into byte ranges of whole records.
+
+    Each range ends at the first newline after ``range_size`` bytes that is
+    not inside a quoted field: a newline is quoted when an odd number of
+    quotes precede it in the file, escaped quotes being doubled. The file is
+    scanned once for quotes, through a memory map.
+
+    Args:
+        filename (str): The path of the CSV file.
+        range_size (int): The approximate number of bytes per range.
+
+    Returns:
+        list: (start, end) byte offsets, covering the file.
+    """
+    ranges = []
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ranges
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start = position = quotes = 0
+            while start < size:
+                end = size
+                if start + range_size < size:
+                    quotes += _count_quotes(mm, position, start + range_size)
+                    position = start + range_size
+                    while True:
+                        newline = mm.find(b"\n", position)
+                        if newline == -1:
+                            break
+                        quotes += _count_quotes(mm, position, newline)
+                        position = newline + 1
+                        if quotes % 2 == 0:
+                            end = position
+                            break
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def parse_csv_range(filename, start, end):
+    """
+    Parse and validate the records of a byte range of a CSV file.
+
+    The range is read from a memory map of the file, about PARSE_BLOCK_SIZE
+    bytes of whole lines at a time, so it is never copied whole. Runs in
+    the worker processes of load_csv_data_parallel().
+
+    Args:
+        filename (str): The path of the CSV file.
+        start (int): The offset of the first record.
+        end (int): The offset after the last record.
+
+    Returns:
+        list: Tuples in CSV_COLUMNS order.
+
+    Raises:
+        ValueError: A record does not have a field per column, or its
+            user_id is not an integer.
+    """
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = start
+
+        def blocks():
+            nonlocal position
+            while position < end:
+                block_end = mm.find(b"\n", min(position + PARSE_BLOCK_SIZE, end) - 1, end)
+                block_end = end if block_end == -1 else block_end + 1
+                # decoded as a file opened with newline="", as csv expects
+                yield io.StringIO(mm[position:block_end].decode(), newline="")
+                position = block_end
+
+        rows = []
+        columns = len(CSV_COLUMNS)
+        for row in csv.reader(itertools.chain.from_iterable(blocks())):
+            if len(row) != columns:
+                raise ValueError(
+                    f"{filename}: record in the block ending at byte {position} has "
+                    f"{len(row)} fields, expected {columns}."
+                )
+            try:
+                rows.append(parse_csv_row(row))
+            except ValueError:
+                raise ValueError(
+                    f"{filename}: record in the block ending at byte {position} has an "
+                    f"invalid user_id {row[0]!r}."
+                ) from None
+        return rows
+
+
+def _parse_csv_range_marshaled(filename, start, end):
+    # marshal is about twice as fast as pickle for rows of str and int
+    return marshal.dumps(parse_csv_range(filename, start, end))
+
+
+def iter_csv_ranges(filename, workers=None, range_size=RANGE_SIZE):
+    """
+    Parse a CSV file in a process pool, yielding its rows in file order.
+
+    The file is split with split_csv_ranges() and the ranges are parsed by
+    parse_csv_range() in ``workers`` processes. At most two ranges per
+    worker are parsed ahead of the consumer, so memory stays bounded when
+    it is the slower side.
+
+    Args:
+        filename (str): The path of the CSV file.
+        workers (int): The number of processes, the number of CPUs if None.
+        range_size (int): The approximate number of bytes parsed per task.
+
+    Yields:
+        list: The rows of each range, tuples in CSV_COLUMNS order.
+    """
+    # imports multiprocessing, only needed by parallel loads
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    ranges = deque(split_csv_ranges(filename, range_size))
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        while ranges or pending:
+            while ranges and len(pending) < 2 * workers:
+                start, end = ranges.popleft()
+                pending.append(executor.submit(_parse_csv_range_marshaled, filename, start, end))
+            yield marshal.loads(pending.popleft().result())
+
+
+def load_csv_data_parallel(
+    filename, workers=None, chunk_size=CHUNK_SIZE, range_size=RANGE_SIZE, progress=None
+):
+    """
+    Load a CSV file into csv_data, parsing it in a process pool.
+
+    The rows come from iter_csv_ranges(), and this process alone inserts
+    them, committing every chunk, as load_csv_data() does. A record failing
+    validation stops the load, the chunks before it stay committed.
+
+    Args:
+        filename (str): The path of the CSV file.
+        workers (int): The number of processes, the number of CPUs if None.
+        chunk_size (int): The number of rows inserted per transaction.
+        range_size (int): The approximate number of bytes parsed per task.
+        progress (callable): Called with the number of rows loaded so far
+            after every committed chunk.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    inserted = 0
+    for rows in iter_csv_ranges(filename, workers, range_size):
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            insert_csv_rows(chunk)
+            db.session.commit()
+            inserted += len(chunk)
+            if progress is not None:
+                progress(inserted)
+    return inserted
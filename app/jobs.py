@@ -0,0 +1,349 @@
+import asyncio
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .logger import reset_log_context, set_log_context
+
+__all__ = ["JobQueue", "QUEUED", "RUNNING", "DONE", "FAILED"]
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# app instance of a process pool worker, created by the pool initializer
+_worker_app = None
+
+
+def _task_name(task):
+    return f"{task.__module__}:{task.__qualname__}"
+
+
+def _resolve_task(name):
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _init_process_worker(config):
+    global _worker_app
+    from app import create_app
+
+    _worker_app = create_app(config)
+
+
+def _run_in_process_worker(job_id):
+    with _worker_app.app_context():
+        _worker_app.jobs.run(job_id)
+
+
+class JobQueue(object):
+    """
+    Redis-backed job queue.
+
+    Jobs are stored as a hash under ``job:<job_id>`` holding the task, its
+    keyword arguments, the status and the timings, while the ids waiting to
+    be picked up live in the ``jobs:<queue>`` list. A worker pool is started
+    lazily in each process on the first enqueue.
+    """
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self.queue_key = f"jobs:{app.config['JOB_QUEUE']}"
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    @staticmethod
+    def job_key(job_id):
+        return f"job:{job_id}"
+
+    @staticmethod
+    def job_fields(task, kwargs, aliases=()):
+        """Build the hash of a newly queued job."""
+        fields = {
+            "task": _task_name(task),
+            "kwargs": json.dumps(kwargs),
+            "status": QUEUED,
+            "enqueued_at": time.time(),
+        }
+        if aliases:
+            # the aliases are notified when the job finishes
+            fields["aliases"] = json.dumps(list(aliases))
+        return fields
+
+    def enqueue(self, task, job_id, aliases=(), **kwargs):
+        """
+        Queue a task to be run by the worker pool.
+
+        The job, its aliases and its place in the queue are written in one
+        transaction, so the job can't be read or run half written.
+
+        Args:
+            task (callable): A module level function, sync or async.
+            job_id (str): The job ID, used to query its status.
+            aliases (list): Other IDs the status of the job can be queried
+                with, e.g. the searches of a batch job.
+            **kwargs: The arguments the task is called with.
+
+        Returns:
+            str: The job ID.
+        """
+        key = self.job_key(job_id)
+        ttl = self.app.config["JOB_STATUS_TTL"]
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=self.job_fields(task, kwargs, aliases))
+        pipe.expire(key, ttl)
+        for alias in aliases:
+            pipe.set(self.alias_key(alias), job_id, ex=ttl)
+        pipe.lpush(self.queue_key, job_id)
+        pipe.execute()
+
+        self.start()
+        return job_id
+
+    @staticmethod
+    def alias_key(alias):
+        return f"job-alias:{alias}"
+
+    def status(self, job_id):
+        """
+        Get the status and timings of a job.
+
+        Args:
+            job_id (str): The job ID, or one of its aliases.
+
+        Returns:
+            dict: The job status, or None if the job is unknown.
+        """
+        job = {
+            k.decode(): v.decode()
+            for k, v in self.redis.hgetall(self.job_key(job_id)).items()
+        }
+        if not job:
+            aliased = self.redis.get(self.alias_key(job_id))
+            status = self.status(aliased.decode()) if aliased else None
+            if status is not None:
+                status["job_id"], status["transaction_id"] = status["transaction_id"], job_id
+            return status
+
+        enqueued_at = float(job["enqueued_at"])
+        started_at = float(job["started_at"]) if "started_at" in job else None
+        finished_at = float(job["finished_at"]) if "finished_at" in job else None
+
+        status = {
+            "transaction_id": job_id,
+            "status": job["status"],
+            "enqueued_at": enqueued_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "queued_ms": None,
+            "run_ms": None,
+        }
+        if started_at is not None:
+            status["queued_ms"] = round((started_at - enqueued_at) * 1000, 2)
+        if started_at is not None and finished_at is not None:
+            status["run_ms"] = round((finished_at - started_at) * 1000, 2)
+        if "error" in job:
+            status["error"] = job["error"]
+        return status
+
+    def pop(self, timeout=0):
+        """
+        Take the next job ID off the queue.
+
+        Args:
+            timeout (int): Seconds to block waiting for a job, 0 to not block.
+
+        Returns:
+            str: The job ID, or None if the queue is empty.
+        """
+        if timeout:
+            item = self.redis.brpop(self.queue_key, timeout=timeout)
+            job_id = item[1] if item else None
+        else:
+            job_id = self.redis.rpop(self.queue_key)
+        return job_id.decode() if job_id else None
+
+    def run(self, job_id):
+        """
+        Run a job in the current process. Requires an application context.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            bool: Whether the job finished successfully.
+        """
+        token = set_log_context(transaction_id=job_id)
+        try:
+            return self._run(job_id)
+        finally:
+            reset_log_context(token)
+
+    def _run(self, job_id):
+        key = self.job_key(job_id)
+        job = self.redis.hmget(key, "task", "kwargs", "enqueued_at", "aliases")
+        if job[0] is None:
+            self.app.logger.error(f"[Jobs] Unknown job {job_id}.")
+            return False
+
+        started_at = time.time()
+        self.redis.hset(key, mapping={"status": RUNNING, "started_at": started_at})
+        metrics = self.app.metrics
+        task_name = job[0].decode()
+        transaction_ids = [job_id, *json.loads(job[3] or "[]")]
+        if job[2] is not None:
+            metrics.observe(
+                "job_queue_wait_seconds", started_at - float(job[2]), task=task_name
+            )
+        try:
+            task = _resolve_task(task_name)
+            result = task(**json.loads(job[1]))
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+        except Exception as e:
+            self.app.logger.error(f"[Jobs] Job {job_id} failed: {e}")
+            finished_at = time.time()
+            self._finish(transaction_ids, FAILED, finished_at, error=str(e))
+            metrics.observe(
+                "job_duration_seconds", finished_at - started_at, task=task_name, status=FAILED
+            )
+            return False
+
+        finished_at = time.time()
+        self._finish(transaction_ids, DONE, finished_at)
+        metrics.observe(
+            "job_duration_seconds", finished_at - started_at, task=task_name, status=DONE
+        )
+        return True
+
+    def _finish(self, transaction_ids, status, finished_at, error=None):
+        # the notification is published after the status is set, so a client
+        # reading the status once subscribed can't miss both
+        fields = {"status": status, "finished_at": finished_at}
+        if error is not None:
+            fields["error"] = error
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self.job_key(transaction_ids[0]), mapping=fields)
+        self.app.notifications.queue_publish(pipe, transaction_ids, status, error)
+        pipe.execute()
+
+    def work(self, burst=False):
+        """
+        Run queued jobs in the current thread.
+
+        Args:
+            burst (bool): Return once the queue is empty instead of blocking.
+
+        Returns:
+            int: The number of jobs run.
+        """
+        count = 0
+        while True:
+            job_id = self.pop(timeout=0 if burst else 1)
+            if job_id is None:
+                if burst:
+                    return count
+                continue
+            with self.app.app_context():
+                self.run(job_id)
+            count += 1
+
+    def start(self):
+        """
+        Start the worker pool of this process, if configured and not running.
+        """
+        if self.app.config["JOB_WORKERS"] <= 0:
+            return
+        # pools do not survive a fork, each process starts its own
+        if self._pool is not None and self._pool.pid == os.getpid():
+            return
+        with self._pool_lock:
+            if self._pool is None or self._pool.pid != os.getpid():
+                self._pool = WorkerPool(
+                    self,
+                    self.app.config["JOB_WORKERS"],
+                    self.app.config["JOB_WORKER_TYPE"],
+                )
+                self._pool.start()
+
+    def stop(self):
+        if self._pool is not None and self._pool.pid == os.getpid():
+            self._pool.stop()
+        self._pool = None
+
+
+class WorkerPool(object):
+    """
+    Pool of thread or process workers fed by a dispatcher thread.
+
+    The dispatcher only takes a job off the queue when a worker is free, so
+    jobs not yet started stay in Redis where any other process can take them.
+    """
+
+    def __init__(self, queue, size, kind="thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker type: {kind}")
+        self.queue = queue
+        self.size = size
+        self.kind = kind
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stopping = threading.Event()
+        self._executor = None
+        self._dispatcher = None
+
+    def start(self):
+        if self.kind == "process":
+            # imports multiprocessing, only thread workers are the default
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(
+                self.size,
+                initializer=_init_process_worker,
+                initargs=(self.queue.config,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(self.size, thread_name_prefix="job-worker")
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="job-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    def stop(self, wait=True):
+        self._stopping.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _run_in_thread(self, job_id):
+        with self.queue.app.app_context():
+            self.queue.run(job_id)
+
+    def _dispatch(self):
+        run = _run_in_process_worker if self.kind == "process" else self._run_in_thread
+        while not self._stopping.is_set():
+            self._slots.acquire()
+            try:
+                job_id = self.queue.pop(timeout=1)
+            except Exception as e:
+                self._slots.release()
+                self.queue.app.logger.error(f"[Jobs] Error reading the queue: {e}")
+                time.sleep(1)
+                continue
+
+            if job_id is None:
+                self._slots.release()
+                continue
+
+            future = self._executor.submit(run, job_id)
+            future.add_done_callback(lambda f: self._slots.release())
@@ -1,14 +1,63 @@
-import curses
+import atexit
+import contextvars
+import json
 import logging
 import logging.handlers
+import os
+import queue
 import sys
+import weakref
+from datetime import datetime, timezone
 
-__all__ = ["get_handler"]
+__all__ = [
+    "get_handler",
+    "configure_logger",
+    "set_log_context",
+    "reset_log_context",
+    "get_log_context",
+    "JSONFormatter",
+    "QueueLogHandler",
+]
+
+# fields added to the records logged in the current thread or task
+_context = contextvars.ContextVar("log_context", default={})
+# handlers installed by configure_logger, by logger name
+_installed = {}
+# queue handlers of the process, whose listener threads are restarted in forks
+_queue_handlers = weakref.WeakSet()
+
+
+def set_log_context(**fields):
+    """
+    Add fields, e.g. request_id, to the records logged in the current context.
+
+    Returns:
+        Token: The token to restore the previous fields with reset_log_context().
+    """
+    return _context.set({**_context.get(), **fields})
+
+
+def reset_log_context(token):
+    _context.reset(token)
+
+
+def get_log_context():
+    """Get the fields added by set_log_context() in the current context."""
+    return _context.get()
+
+
+def _import_curses():
+    try:
+        import curses
+    except ImportError:
+        return None
+    return curses
 
 
 def _stderr_supports_color():
     try:
         if hasattr(sys.stderr, "isatty") and sys.stderr.isatty():
+            curses = _import_curses()
             if curses:
                 curses.setupterm()
                 if curses.tigetnum("colors") > 0:
@@ -45,9 +94,16 @@ class LogFormatter(logging.Formatter):
 
         logging.Formatter.__init__(self, datefmt=datefmt)
         self._fmt = fmt
+        self._color = color
+        self._color_codes = colors
+        # the terminal is only looked up when the first record is formatted
+        self._colors = None
+        self._normal = ""
 
+    def _setup_colors(self):
         self._colors = {}
-        if color and _stderr_supports_color():
+        if self._color and _stderr_supports_color():
+            curses = _import_curses()
             if curses is not None:
                 # The curses module has some str/bytes confusion in
                 # python3.  Until version 3.2.3, most methods return
@@ -60,13 +116,13 @@ class LogFormatter(logging.Formatter):
                 if (3, 0) < sys.version_info < (3, 2, 3):
                     fg_color = str(fg_color, "ascii")
 
-                for levelno, code in colors.items():
+                for levelno, code in self._color_codes.items():
                     self._colors[levelno] = str(curses.tparm(fg_color, code), "ascii")
                 self._normal = str(curses.tigetstr("sgr0"), "ascii")
             else:
                 # If curses is not present (currently we'll only get here for
                 # colorama on windows), assume hard-coded ANSI color codes.
-                for levelno, code in colors.items():
+                for levelno, code in self._color_codes.items():
                     self._colors[levelno] = "\033[2;3%dm" % code
                 self._normal = "\033[0m"
         else:
@@ -80,6 +136,8 @@ class LogFormatter(logging.Formatter):
 
         record.asctime = self.formatTime(record, self.datefmt)
 
+        if self._colors is None:
+            self._setup_colors()
         if record.levelno in self._colors:
             record.color = self._colors[record.levelno]
             record.end_color = self._normal
@@ -98,7 +156,170 @@ class LogFormatter(logging.Formatter):
         return formatted.replace("\n", "\n    ")
 
 
-def get_handler():
+class JSONFormatter(logging.Formatter):
+    """Format records as JSON objects, one per line, with their context fields."""
+
+    CONTEXT_FIELDS = ("request_id", "transaction_id")
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the fields of set_log_context() onto records, in the thread logging them."""
+
+    def filter(self, record):
+        for field, value in _context.get().items():
+            setattr(record, field, value)
+        return True
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room, the records before it still get written
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to a listener thread that formats and writes them.
+
+    Logging only puts the record on a bounded queue. When the queue is full
+    the record is dropped instead of waiting, and the number of records
+    dropped is logged once there is room again.
+
+    Args:
+        target (Handler): The handler the listener thread writes records with.
+        maxsize (int): The number of records the queue holds.
+    """
+
+    def __init__(self, target, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        # approximate, counted without a lock
+        self.dropped = 0
+        self._unreported = 0
+        self._closed = False
+        self._start()
+        _queue_handlers.add(self)
+
+    def _start(self):
+        self.listener = _QueueListener(
+            self.queue, self.target, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def prepare(self, record):
+        # formatting is left to the listener, only the arguments are merged
+        # so the record does not depend on objects that may change
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self._unreported:
+                self.queue.put_nowait(self._dropped_record(record))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+    def _dropped_record(self, record):
+        return logging.LogRecord(
+            record.name,
+            logging.WARNING,
+            __file__,
+            0,
+            f"[Logging] {self._unreported} log record(s) dropped, the log queue was full.",
+            None,
+            None,
+        )
+
+    def restart(self):
+        """Start a new queue and listener, e.g. in a forked process."""
+        if self._closed:
+            return
+        self.queue = queue.Queue(self.maxsize)
+        self._start()
+
+    def close(self):
+        self._closed = True
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+def get_handler(fmt="text", queue_size=0):
+    """
+    Build the log handler writing to stderr.
+
+    Args:
+        fmt (str): "text" for colored lines, "json" for JSON objects.
+        queue_size (int): The records queued for a listener thread to write,
+            0 to write them in the thread logging them.
+
+    Returns:
+        Handler: The handler.
+    """
     handler = logging.StreamHandler()
-    handler.setFormatter(LogFormatter())
+    handler.setFormatter(JSONFormatter() if fmt == "json" else LogFormatter())
+    if queue_size:
+        handler = QueueLogHandler(handler, queue_size)
+    handler.addFilter(ContextFilter())
     return handler
+
+
+def configure_logger(logger, config):
+    """
+    Install the handler described by the LOG_* settings on a logger.
+
+    The handler installed by an earlier call, e.g. for another app of the
+    process, is closed and replaced.
+
+    Args:
+        logger (Logger): The logger.
+        config (dict): The app config.
+    """
+    previous = _installed.pop(logger.name, None)
+    if previous is not None:
+        logger.removeHandler(previous)
+        previous.close()
+    handler = get_handler(config["LOG_FORMAT"], config["LOG_QUEUE_SIZE"])
+    logger.addHandler(handler)
+    _installed[logger.name] = handler
+
+
+def _stop_listeners():
+    for handler in list(_queue_handlers):
+        handler.close()
+
+
+def _restart_listeners():
+    for handler in list(_queue_handlers):
+        handler.restart()
+
+
+atexit.register(_stop_listeners)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners)
@@ -0,0 +1,198 @@
+import json
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import inspect, select
+
+from app import db
+
+__all__ = ["ModelCache", "LRUCache"]
+
+# marks an id known to have no row
+MISSING = b""
+
+
+class LRUCache(object):
+    """Thread-safe least recently used mapping, holding at most ``size`` items."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return None
+            return self._items[key]
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class ModelCache(object):
+    """
+    Read-through cache of model rows by primary key.
+
+    Lookups go to an LRU of the process, then to Redis, then to the
+    database, filling the tiers they missed. Rows are cached as dictionaries
+    of the given columns. Ids without a row are cached in Redis only, for
+    ``MODEL_CACHE_NEGATIVE_TTL`` seconds: writes replace those entries with
+    put_many(), which the process LRU could not see from other workers.
+
+    Rows are assumed to never change once written; call invalidate() after
+    updating or deleting one. The LRUs of other processes keep the old row
+    until it is evicted.
+
+    Args:
+        app (Flask): The app.
+        model (Model): The model to look up.
+        columns (list): The names of the columns to cache.
+    """
+
+    prefix = "model-cache"
+
+    def __init__(self, app, model, columns):
+        self.app = app
+        self.model = model
+        self.columns = list(columns)
+        self.name = model.__tablename__
+        self.primary_key = inspect(model).primary_key[0]
+        self.local = LRUCache(app.config["MODEL_CACHE_LOCAL_SIZE"])
+        self.counters = dict.fromkeys(("local", "redis", "negative", "database"), 0)
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    def key(self, pk):
+        return f"{self.prefix}:{self.name}:{pk}"
+
+    def get(self, pk):
+        """
+        Get a row by primary key.
+
+        Args:
+            pk (int): The primary key.
+
+        Returns:
+            dict: The cached columns of the row, or None if there is no row.
+        """
+        return self.get_many([pk])[pk]
+
+    def get_many(self, pks):
+        """
+        Get rows by primary key, with at most one Redis and one database query.
+
+        Args:
+            pks (list): The primary keys.
+
+        Returns:
+            dict: The cached columns of each row by primary key, None for
+            the keys without a row.
+        """
+        found, tiers = {}, {}
+        missing = []
+        for pk in dict.fromkeys(pks):
+            row = self.local.get(pk)
+            if row is not None:
+                found[pk] = row
+                tiers[pk] = "local"
+            else:
+                missing.append(pk)
+
+        if missing:
+            payloads = self.redis.mget([self.key(pk) for pk in missing])
+            missing_again = []
+            for pk, payload in zip(missing, payloads):
+                if payload is None:
+                    missing_again.append(pk)
+                elif payload == MISSING:
+                    found[pk] = None
+                    tiers[pk] = "negative"
+                else:
+                    found[pk] = json.loads(payload)
+                    self.local.set(pk, found[pk])
+                    tiers[pk] = "redis"
+
+            if missing_again:
+                rows = self._load(missing_again)
+                self.put_many(rows, negative=set(missing_again) - set(rows))
+                for pk in missing_again:
+                    found[pk] = rows.get(pk)
+                    tiers[pk] = "database"
+
+        self._count(tiers.values())
+        return found
+
+    def _load(self, pks):
+        columns = [getattr(self.model, column) for column in self.columns]
+        query = select(self.primary_key, *columns).where(self.primary_key.in_(pks))
+        return {pk: dict(zip(self.columns, values)) for pk, *values in db.session.execute(query)}
+
+    def put_many(self, rows, negative=()):
+        """
+        Cache rows, e.g. just written ones, replacing their negative entries.
+
+        Args:
+            rows (dict): The cached columns of each row by primary key.
+            negative (iterable): Primary keys known to have no row.
+        """
+        config = self.app.config
+        pipe = self.redis.pipeline(transaction=False)
+        for pk, row in rows.items():
+            self.local.set(pk, row)
+            pipe.set(self.key(pk), json.dumps(row), ex=config["MODEL_CACHE_TTL"] or None)
+        for pk in negative:
+            pipe.set(self.key(pk), MISSING, ex=config["MODEL_CACHE_NEGATIVE_TTL"])
+        pipe.execute()
+
+    def invalidate(self, pks):
+        """Forget cached rows, after they were updated or deleted."""
+        for pk in pks:
+            self.local.delete(pk)
+        if pks:
+            self.redis.delete(*[self.key(pk) for pk in pks])
+
+    def _count(self, tiers):
+        with self._lock:
+            for tier in tiers:
+                self.counters[tier] += 1
+                self.app.metrics.inc("model_cache_lookups_total", cache=self.name, tier=tier)
+
+    def stats(self):
+        """
+        Get the lookup counters of this process.
+
+        Returns:
+            dict: Lookups answered by each tier, the process LRU size and
+            the hit ratios of the process LRU and of both caches.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        total = sum(stats.values())
+        stats["local_entries"] = len(self.local)
+        stats["local_hit_ratio"] = round(stats["local"] / total, 4) if total else None
+        hits = total - stats["database"]
+        stats["hit_ratio"] = round(hits / total, 4) if total else None
+        return stats
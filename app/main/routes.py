@@ -1,20 +1,28 @@
-import asyncio
+from functools import partial
 from json import dumps
 from uuid import uuid4
 
 import marshmallow
 from apiflask import APIBlueprint as Blueprint
 from apiflask.views import MethodView
-from app.serializers import SearchCSVSerializer
-from app.tasks import process_search_csv
+from flask import Response
 from flask import current_app as app
-from flask import jsonify
-from flask import request
-from sqlalchemy.exc import IntegrityError
+from flask import jsonify, request, stream_with_context
 
-from app import db
+from app.codecs import accepts_encoding
 from app.errors.handlers import error_response
-from app.models import Table
+from app.retention import ResultTooLarge
+from app.serializers import (
+    HashBatchSerializer,
+    ResultPageSerializer,
+    SearchCSVBatchSerializer,
+    SearchCSVSerializer,
+)
+from app.tasks import (
+    process_fulltext_search,
+    process_search_csv,
+    process_search_csv_batch,
+)
 
 bp = Blueprint("main", __name__)
 
@@ -35,36 +43,190 @@ def log():
 
 @bp.route("/redis/<key>", methods=["GET"])
 def get_redis_value(key):
-    v = app.redis.get(key) or b""
-    return jsonify(result=v.decode())
+    """
+    Get stored search results.
+
+    Without parameters, all the results are returned as a JSON string,
+    with ``"truncated": true`` if they were cut to RESULT_MAX_BYTES.
+    With ``cursor`` and/or ``page_size``, a page of records is returned with
+    the cursor of the next one. With ``format=ndjson``, records are streamed
+    one per line, one stored page at a time. With ``format=array``, the page
+    is the bare JSON array of the records, with the total and the next cursor
+    in the X-Result-Count and X-Next-Cursor headers: a whole stored page is
+    sent as stored, still compressed, to clients accepting its encoding.
+
+    Returns:
+        tuple: JSON or NDJSON response.
+    """
+    try:
+        params = ResultPageSerializer().load(request.args)
+    except marshmallow.exceptions.ValidationError as e:
+        return error_response(400, message=str(e))
+
+    if not params:
+        v, truncated = app.results.read_result(key) or ("", False)
+        body = {"result": v}
+        if truncated:
+            body["truncated"] = True
+        return jsonify(body)
+
+    cursor = params.get("cursor", 0)
+    if params.get("format") == "ndjson":
+        pages = app.results.iter_pages(key, cursor, params.get("page_size"))
+        lines = ("".join(dumps(record) + "\n" for record in page) for page in pages)
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    if params.get("format") == "array":
+        return _result_array(key, cursor, params.get("page_size"))
+
+    page_size = params.get("page_size", app.config["RESULT_PAGE_SIZE"])
+    page = app.results.read_page(key, cursor, page_size)
+    if page is None:
+        return error_response(404, message="Unknown transaction ID")
+    records, count, truncated = page
+    next_cursor = cursor + len(records)
+    body = {
+        "result": records,
+        "count": count,
+        "next_cursor": next_cursor if next_cursor < count else None,
+    }
+    if truncated:
+        body["truncated"] = True
+    return jsonify(body)
+
+
+def _result_array(key, cursor, page_size):
+    accepts = partial(accepts_encoding, request.headers.get("Accept-Encoding"))
+    stored = app.results.read_stored_page(key, cursor, page_size, accepts)
+    if stored is not None:
+        body, content_encoding, count, next_cursor, truncated = stored
+    else:
+        page = app.results.read_page(key, cursor, page_size or app.config["RESULT_PAGE_SIZE"])
+        if page is None:
+            return error_response(404, message="Unknown transaction ID")
+        records, count, truncated = page
+        body, content_encoding, next_cursor = dumps(records), None, cursor + len(records)
+
+    response = Response(body, mimetype="application/json")
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Result-Count"] = str(count)
+    response.headers["X-Next-Cursor"] = str(next_cursor) if next_cursor < count else ""
+    if truncated:
+        response.headers["X-Result-Truncated"] = "1"
+    return response
 
 
 @bp.route("/redis/<key>", methods=["PUT"])
 def set_redis_value(key):
+    """
+    Store a value, lists like search results, in pages with the result codec.
+
+    Returns:
+        tuple: JSON response, 413 if the value is larger than RESULT_MAX_BYTES
+        and RESULT_OVERSIZE is "reject".
+    """
     data = request.get_json()
-    app.redis.set(key, dumps(data))
+    try:
+        if isinstance(data, list):
+            app.results.write(key, data)
+        else:
+            app.results.write_value(key, data)
+    except ResultTooLarge as e:
+        return error_response(413, message=str(e))
     return jsonify({"message": "Data stored successfully"})
 
 
+@bp.route("/redis/results/stats", methods=["GET"])
+def result_stats():
+    """
+    Get the accounting of the stored results.
+
+    Returns:
+        tuple: JSON response with the number of results, their total bytes,
+        the memory budget, the results evicted and the ``top`` (at most 100)
+        largest results.
+    """
+    try:
+        top = int(request.args.get("top", 10))
+    except ValueError:
+        return error_response(400, message="top must be an integer.")
+    return jsonify(app.results.retention.stats(min(max(top, 1), 100)))
+
+
 @bp.route("/db/<hash>", methods=["PUT"])
 def set_hash(hash):
-    t = Table(hash=hash)
-    db.session.add(t)
+    return jsonify(result=app.hashes.insert(hash))
+
+
+@bp.route("/db/hashes", methods=["POST"])
+def set_hashes():
+    """
+    Store many hashes at once.
+
+    Expects ``{"hashes": [...]}`` with at most HASH_BULK_MAX_SIZE hashes.
 
+    Returns:
+        tuple: JSON response with, for each hash in order, True if it was
+        stored and False if it already was.
+    """
     try:
-        db.session.commit()
-        result = True
-    except IntegrityError as e:
-        app.logger.error(e)
-        result = False
+        hashes = HashBatchSerializer().load(request.get_json(silent=True) or {})["hashes"]
+    except marshmallow.exceptions.ValidationError as e:
+        return error_response(400, message=str(e))
 
-    return jsonify(result=result)
+    max_size = app.config["HASH_BULK_MAX_SIZE"]
+    if len(hashes) > max_size:
+        return error_response(400, message=f"At most {max_size} hashes can be sent at once.")
+
+    results = app.hashes.insert_many(hashes)
+    return jsonify(result=results, inserted=sum(results))
 
 
 @bp.route("/db/<int:id>", methods=["GET"])
 def get_hash(id):
-    t = Table.query.filter_by(id=id).scalar()
-    return jsonify(hash=t.hash if t else "")
+    row = app.hash_cache.get(id)
+    return jsonify(hash=row["hash"] if row else "")
+
+
+@bp.route("/db/cache/stats", methods=["GET"])
+def hash_cache_stats():
+    """
+    Get the lookup counters of the GET /db/<id> cache in this worker.
+
+    Returns:
+        tuple: JSON response with the lookups answered by the process LRU,
+        Redis, negative entries and the database, and the hit ratios.
+    """
+    return jsonify(app.hash_cache.stats())
+
+
+@bp.route("/db/slow-queries", methods=["GET"])
+def slow_queries():
+    """
+    Get the SQL statements slower than SLOW_QUERY_THRESHOLD_MS, the latest first.
+
+    Returns:
+        tuple: JSON response with the threshold and the ``limit`` (at most
+        SLOW_QUERY_LOG_SIZE) latest entries, each with its statement,
+        parameters, duration, rows, plan and request or transaction ID.
+    """
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return error_response(400, message="limit must be an integer.")
+    limit = min(max(limit, 1), app.config["SLOW_QUERY_LOG_SIZE"])
+    return jsonify(
+        threshold_ms=app.slow_queries.threshold * 1000,
+        entries=app.slow_queries.entries(limit),
+    )
+
+
+@bp.route("/db/slow-queries", methods=["DELETE"])
+def clear_slow_queries():
+    app.slow_queries.clear()
+    return jsonify({"message": "Slow queries cleared"})
 
 
 @bp.route("/error/<int:code>")
@@ -79,8 +241,9 @@ class SearchCSVView(MethodView):
 
     def get(self, *args, **kwargs):
         """
-        Search CSV data based on name and/or city.
-        Parses query parameters to initiate an asynchronous task for the search.
+        Search CSV data based on name and/or city, or ranked by words of any
+        text column with ``q``.
+        Parses query parameters and queues a background job for the search.
 
         Returns:
             tuple: JSON response and HTTP status code.
@@ -95,7 +258,23 @@ class SearchCSVView(MethodView):
             quantity = csv_data.get("quantity", "")
 
             transaction_id = str(uuid4())
-            asyncio.run(process_search_csv(name, city, quantity, transaction_id))
+            if "q" in csv_data:
+                app.jobs.enqueue(
+                    process_fulltext_search,
+                    transaction_id,
+                    q=csv_data["q"],
+                    quantity=quantity,
+                    transaction_id=transaction_id,
+                )
+            else:
+                app.jobs.enqueue(
+                    process_search_csv,
+                    transaction_id,
+                    name=name,
+                    city=city,
+                    quantity=quantity,
+                    transaction_id=transaction_id,
+                )
 
             app.logger.info(f"{self.log_prefix} Search request successfully initiated.")
 
@@ -114,3 +293,107 @@ class SearchCSVView(MethodView):
         except Exception as e:
             app.logger.error(f"{self.log_prefix} Error: {e}")
             return error_response(500, message=str(e))
+
+
+@bp.route("/search-csv/batch", methods=["POST"])
+def search_csv_batch():
+    """
+    Search CSV data for a list of name and/or city searches at once.
+
+    The searches are run by one background job, in one pass over the data,
+    and each gets its own transaction ID to fetch its results and status.
+
+    Returns:
+        tuple: JSON response with the transaction IDs, in the order of the
+        searches, and HTTP status code.
+    """
+    log_prefix = "[CSV Search][Batch]"
+    try:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, list) or not payload:
+            return error_response(400, message="Expected a non-empty list of searches.")
+        max_size = app.config["SEARCH_BATCH_MAX_SIZE"]
+        if len(payload) > max_size:
+            return error_response(400, message=f"A batch holds at most {max_size} searches.")
+
+        searches = [
+            {
+                "name": search.get("name", ""),
+                "city": search.get("city", ""),
+                "quantity": search.get("quantity", ""),
+                "transaction_id": str(uuid4()),
+            }
+            for search in SearchCSVBatchSerializer(many=True).load(payload)
+        ]
+        transaction_ids = [search["transaction_id"] for search in searches]
+
+        batch_id = str(uuid4())
+        app.jobs.enqueue(
+            process_search_csv_batch, batch_id, aliases=transaction_ids, searches=searches
+        )
+
+        app.logger.info(f"{log_prefix} {len(searches)} search requests successfully initiated.")
+
+        return (
+            jsonify(
+                {
+                    "message": "Search requests received",
+                    "transaction_ids": transaction_ids,
+                }
+            ),
+            202,
+        )
+    except marshmallow.exceptions.ValidationError as e:
+        app.logger.error(f"{log_prefix} Validation error: {e}")
+        return error_response(400, message=str(e))
+    except Exception as e:
+        app.logger.error(f"{log_prefix} Error: {e}")
+        return error_response(500, message=str(e))
+
+
+@bp.route("/search-csv/cache/stats", methods=["GET"])
+def search_csv_cache_stats():
+    """
+    Get the search cache counters, to size the cache.
+
+    Returns:
+        tuple: JSON response with hits, misses and the number of entries.
+    """
+    return jsonify(app.search_cache.stats())
+
+
+@bp.route("/search-csv/<transaction_id>/status", methods=["GET"])
+def search_csv_status(transaction_id):
+    """
+    Get the status of a search job: queued, running, done or failed.
+
+    Returns:
+        tuple: JSON response with the job status and timings.
+    """
+    status = app.jobs.status(transaction_id)
+    if status is None:
+        return error_response(404, message="Unknown transaction ID")
+    return jsonify(status)
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Get the request, database, Redis and job metrics of all the workers.
+
+    Returns:
+        Response: The metrics in Prometheus text format.
+    """
+    return Response(app.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/pools/stats", methods=["GET"])
+def pools_stats():
+    """
+    Get the live stats of the Redis and database pools of this worker.
+
+    Returns:
+        tuple: JSON response with the connections in use, the callers waiting
+        for one and the checkout latency of each pool.
+    """
+    return jsonify(app.resources.stats())
@@ -0,0 +1,273 @@
+import atexit
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+import redis
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ["Metrics", "InstrumentedRedis", "FAMILIES", "BUCKETS", "on_statement"]
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FAMILIES = {
+    "http_requests_total": ("counter", "HTTP requests by endpoint and status."),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by endpoint."),
+    "db_query_duration_seconds": ("histogram", "SQL statement execution time."),
+    "redis_command_duration_seconds": ("histogram", "Redis command and pipeline time."),
+    "serialization_duration_seconds": ("histogram", "Time spent encoding results."),
+    "job_duration_seconds": ("histogram", "Background job run time by task and status."),
+    "job_queue_wait_seconds": ("histogram", "Time jobs waited in the queue."),
+    "model_cache_lookups_total": ("counter", "Cached row lookups by the tier answering them."),
+}
+
+
+# set while the metrics talk to Redis, so they do not time themselves
+_local = threading.local()
+# the metrics of the live apps, flushed when the process exits
+_instances = weakref.WeakSet()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{pairs}}}"
+
+
+class Metrics(object):
+    """
+    Counters and latency histograms of a process, aggregated in Redis.
+
+    Observations are only added to a dict in memory. Every
+    ``METRICS_FLUSH_INTERVAL`` seconds the deltas are added to the
+    ``metrics`` Redis hash with HINCRBYFLOAT, so the values rendered by any
+    gunicorn worker sum up the observations of all of them.
+    """
+
+    key = "metrics"
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(float)
+        self._histograms = {}
+        self._flushed_at = time.monotonic()
+        _instances.add(self)
+
+    @property
+    def enabled(self):
+        return self.app.config["METRICS_ENABLED"]
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter."""
+        if not self.enabled:
+            return
+        series = _series(name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._deltas[series] += value
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        """Record a value, in seconds, in a histogram."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        series = self._histograms.get(key) or self._histogram_series(*key)
+        first = bisect_left(BUCKETS, value)
+        with self._lock:
+            deltas = self._deltas
+            # every bound is written so each series exposes all the buckets
+            for i, bucket in enumerate(series[0]):
+                deltas[bucket] += i >= first
+            deltas[series[1]] += value
+            deltas[series[2]] += 1
+        self._maybe_flush()
+
+    def _histogram_series(self, name, labels):
+        buckets = [_series(f"{name}_bucket", labels + (("le", b),)) for b in BUCKETS]
+        buckets.append(_series(f"{name}_bucket", labels + (("le", "+Inf"),)))
+        series = buckets, _series(f"{name}_sum", labels), _series(f"{name}_count", labels)
+        self._histograms[(name, labels)] = series
+        return series
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Record the time spent in a block in a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.app.config["METRICS_FLUSH_INTERVAL"]:
+            self.flush()
+
+    def flush(self):
+        """Add the observations of this process to the Redis aggregates."""
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(float)
+            self._flushed_at = time.monotonic()
+        if not deltas:
+            return
+        _local.muted = True
+        try:
+            pipe = self.app.redis.pipeline(transaction=False)
+            for series, value in deltas.items():
+                pipe.hincrbyfloat(self.key, series, value)
+            pipe.execute()
+        except Exception as e:
+            # keep the observations for the next flush
+            with self._lock:
+                for series, value in deltas.items():
+                    self._deltas[series] += value
+            self.app.logger.error(f"[Metrics] Error flushing metrics: {e}")
+        finally:
+            _local.muted = False
+
+    def render(self):
+        """
+        Render the metrics of all the workers in Prometheus text format.
+
+        Returns:
+            str: The exposition text.
+        """
+        self.flush()
+        _local.muted = True
+        try:
+            values = {
+                k.decode(): float(v) for k, v in self.app.redis.hgetall(self.key).items()
+            }
+        finally:
+            _local.muted = False
+        families = defaultdict(list)
+        for series in values:
+            name = series.partition("{")[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in FAMILIES:
+                    name = name[: -len(suffix)]
+            families[name].append(series)
+
+        lines = []
+        for name in sorted(families):
+            kind, help = FAMILIES.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for series in sorted(families[name], key=_sort_key):
+                value = values[series]
+                lines.append(f"{series} {int(value) if value.is_integer() else value}")
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(series):
+    # order histogram buckets by their bound, +Inf last
+    name, _, labels = series.partition("{")
+    head, sep, le = labels.rpartition('le="')
+    if sep:
+        bound = le.split('"')[0]
+        return name, head, float("inf") if bound == "+Inf" else float(bound)
+    return name, labels, 0.0
+
+
+def _current_metrics():
+    if has_app_context() and not getattr(_local, "muted", False):
+        return getattr(current_app, "metrics", None)
+    return None
+
+
+def on_statement(callback):
+    """
+    Call a function after every SQL statement, with its execution time.
+
+    Statements are timed once, by the engine events of this module, for the
+    metrics and for every function registered here.
+
+    Args:
+        callback (callable): Called with the connection, the cursor, the
+            statement, its parameters, whether it ran with executemany()
+            and its execution time in seconds.
+
+    Returns:
+        callable: The function, to use it as a decorator.
+    """
+    _statement_callbacks.append(callback)
+    return callback
+
+
+# functions registered with on_statement()
+_statement_callbacks = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append((context, time.perf_counter()))
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()[1]
+    metrics = _current_metrics()
+    if metrics is not None:
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        metrics.observe("db_query_duration_seconds", elapsed, operation=operation)
+    for callback in _statement_callbacks:
+        callback(conn, cursor, statement, parameters, executemany, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute, drop its start
+    # so the connection does not keep it when returned to the pool
+    conn = exception_context.connection
+    starts = conn.info.get("query_start") if conn is not None else None
+    if starts and starts[-1][0] is exception_context.execution_context:
+        starts.pop()
+
+
+def _flush_all():
+    for metrics in list(_instances):
+        metrics.flush()
+
+
+atexit.register(_flush_all)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            metrics = _current_metrics()
+            if metrics is not None:
+                elapsed = time.perf_counter() - start
+                metrics.observe("redis_command_duration_seconds", elapsed, command="PIPELINE")
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """Redis client recording the time of every command and pipeline."""
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            metrics = _current_metrics()
+            if metrics is not None:
+                elapsed = time.perf_counter() - start
+                metrics.observe("redis_command_duration_seconds", elapsed, command=args[0])
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
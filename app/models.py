@@ -14,13 +14,15 @@ class Table(Model):
 class CSVData(Model):
     __tablename__ = "csv_data"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, index=True)
     first_name = db.Column(db.String(100))
     last_name = db.Column(db.String(100))
     email = db.Column(db.String(100))
     gender = db.Column(db.String(10))
     company = db.Column(db.String(100))
     city = db.Column(db.String(100))
+    # digest of the CSV values, to find changed rows, see sync_csv_data()
+    row_hash = db.Column(db.String(16))
 
     def __repr__(self):
         return f"<CSVData id={self.id}, user_id={self.user_id}, first_name={self.first_name}, last_name={self.last_name}, email={self.email}, gender={self.gender}, company={self.company}, city={self.city}>"
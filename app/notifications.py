@@ -0,0 +1,270 @@
+import asyncio
+import json
+import time
+
+from .jobs import DONE, FAILED
+
+__all__ = [
+    "Notifications",
+    "AsyncNotifications",
+    "AsyncSubscription",
+    "FINISHED",
+    "status_notification",
+    "format_event",
+]
+
+# job statuses a notification is published for
+FINISHED = (DONE, FAILED)
+# seconds waited for the confirmation of the subscription
+SUBSCRIBE_TIMEOUT = 5
+# an SSE comment, sent to keep idle connections open
+KEEPALIVE = ": keep-alive\n\n"
+
+
+def status_notification(transaction_id, status):
+    """
+    Build the notification of a transaction from its job status.
+
+    Args:
+        transaction_id (str): The transaction ID.
+        status (dict): The job status, or None if the job is unknown.
+
+    Returns:
+        dict: The transaction ID, the status ("unknown" for unknown jobs)
+        and the error of failed jobs.
+    """
+    if status is None:
+        return {"transaction_id": transaction_id, "status": "unknown"}
+    notification = {"transaction_id": transaction_id, "status": status["status"]}
+    if "error" in status:
+        notification["error"] = status["error"]
+    return notification
+
+
+def format_event(notification, event=None):
+    """Format a notification as a Server-Sent Event, named after its status by default."""
+    return f"event: {event or notification['status']}\ndata: {json.dumps(notification)}\n\n"
+
+
+class Subscribers(object):
+    """
+    Callbacks waiting for the notifications of transactions, in the event
+    loop of one process.
+
+    A notification is dispatched with one dictionary lookup per transaction
+    it is about, however many clients are waiting for other transactions.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def add(self, transaction_id, callback):
+        self._callbacks.setdefault(transaction_id, set()).add(callback)
+
+    def discard(self, transaction_id, callback):
+        callbacks = self._callbacks.get(transaction_id)
+        if callbacks is not None:
+            callbacks.discard(callback)
+            if not callbacks:
+                del self._callbacks[transaction_id]
+
+    def dispatch(self, data):
+        """
+        Call the callbacks of the transactions of a published message.
+
+        Args:
+            data (bytes): The message, as published by Notifications.
+
+        Returns:
+            int: The number of callbacks called.
+        """
+        message = json.loads(data)
+        waiting = [
+            (transaction_id, list(self._callbacks[transaction_id]))
+            for transaction_id in message["transaction_ids"]
+            if transaction_id in self._callbacks
+        ]
+        called = 0
+        for transaction_id, callbacks in waiting:
+            notification = {"transaction_id": transaction_id, "status": message["status"]}
+            if message.get("error") is not None:
+                notification["error"] = message["error"]
+            for callback in callbacks:
+                callback(notification)
+                called += 1
+        return called
+
+
+class AsyncSubscription(object):
+    """
+    Notifications of some transactions, awaited from an asyncio queue.
+
+    Use it as a context manager, or close it, to stop receiving them.
+
+    Args:
+        subscribers (Subscribers): The subscribers of the process.
+        transaction_ids (iterable): The transactions to start with.
+    """
+
+    def __init__(self, subscribers, transaction_ids=()):
+        self._subscribers = subscribers
+        self.transaction_ids = set()
+        self.queue = asyncio.Queue()
+        for transaction_id in transaction_ids:
+            self.add(transaction_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def notify(self, notification):
+        self.queue.put_nowait(notification)
+
+    def add(self, transaction_id):
+        if transaction_id not in self.transaction_ids:
+            self.transaction_ids.add(transaction_id)
+            self._subscribers.add(transaction_id, self.notify)
+
+    def discard(self, transaction_id):
+        """
+        Stop waiting for a transaction.
+
+        Returns:
+            bool: Whether it was waited for.
+        """
+        if transaction_id not in self.transaction_ids:
+            return False
+        self.transaction_ids.discard(transaction_id)
+        self._subscribers.discard(transaction_id, self.notify)
+        return True
+
+    def close(self):
+        for transaction_id in list(self.transaction_ids):
+            self.discard(transaction_id)
+
+    async def get(self, timeout=None):
+        """
+        Wait for the next notification.
+
+        Args:
+            timeout (float): Seconds to wait, None to wait forever.
+
+        Returns:
+            dict: The notification, or None after the timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Notifications(object):
+    """
+    Completion notifications of the jobs, over Redis pub/sub.
+
+    When a job is done or failed, a message naming its transaction IDs is
+    published on one channel, in the same round trip as its status. The
+    aiohttp server subscribes to it with AsyncNotifications, and hands the
+    messages to its clients waiting on a stream or a WebSocket.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def channel(self):
+        return f"jobs:{self.app.config['JOB_QUEUE']}:finished"
+
+    def queue_publish(self, pipe, transaction_ids, status, error=None):
+        """
+        Queue the notification of a finished job.
+
+        Args:
+            pipe (Pipeline): The pipeline setting the status of the job.
+            transaction_ids (list): The job ID and its aliases.
+            status (str): DONE or FAILED.
+            error (str): The error of a failed job.
+        """
+        message = {"transaction_ids": transaction_ids, "status": status}
+        if error is not None:
+            message["error"] = error
+        pipe.publish(self.channel, json.dumps(message))
+
+
+class AsyncNotifications(object):
+    """
+    Completion notifications for the native aiohttp handlers.
+
+    Each process subscribes to the channel of Notifications once, with an
+    asyncio task of the app started and stopped with it, and hands the
+    messages to the subscriptions waiting in the process. Messages
+    published while it reconnects are lost: waiters read the job status
+    again every NOTIFY_KEEPALIVE seconds.
+
+    Args:
+        flask_app (Flask): The app publishing the notifications.
+        redis (redis.asyncio.Redis): The asyncio Redis client.
+    """
+
+    def __init__(self, flask_app, redis):
+        self.flask_app = flask_app
+        self.redis = redis
+        self.subscribers = Subscribers()
+        self._pubsub = None
+        self._task = None
+
+    def subscribe(self, *transaction_ids):
+        """Wait for the notifications of transactions, see Notifications.subscribe()."""
+        return AsyncSubscription(self.subscribers, transaction_ids)
+
+    async def start(self):
+        self._pubsub = await self._subscribe()
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._close()
+
+    async def _subscribe(self):
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.flask_app.notifications.channel)
+        deadline = time.monotonic() + SUBSCRIBE_TIMEOUT
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(timeout=deadline - time.monotonic())
+            if message is not None and message["type"] == "subscribe":
+                return pubsub
+        raise TimeoutError("The subscription to the notifications was not confirmed.")
+
+    async def _listen(self):
+        logger = self.flask_app.logger
+        while True:
+            try:
+                if self._pubsub is None:
+                    self._pubsub = await self._subscribe()
+                message = await self._pubsub.get_message(timeout=1)
+                if message is not None and message["type"] == "message":
+                    self.subscribers.dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Notifications] Error reading the notifications: {e}")
+                await self._close()
+                await asyncio.sleep(1)
+
+    async def _close(self):
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
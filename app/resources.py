@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+import weakref
+
+import redis
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from .metrics import InstrumentedRedis
+
+__all__ = ["Resources", "engine_options", "InstrumentedConnectionPool", "InstrumentedQueuePool"]
+
+# resources of every app of the process, reset in forked children
+_instances = weakref.WeakSet()
+
+
+class CheckoutStats(object):
+    """Checkout counters of a connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        with self._lock:
+            self.waiting += 1
+        return time.perf_counter()
+
+    def finish(self, started, success=True):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.waiting -= 1
+            if success:
+                self.checkouts += 1
+                self.wait_total += elapsed
+                self.wait_max = max(self.wait_max, elapsed)
+
+    def as_dict(self):
+        return {
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "checkout_avg_ms": (
+                round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else None
+            ),
+            "checkout_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """Bounded Redis pool, waiting for a free connection, with checkout stats."""
+
+    def __init__(self, *args, **kwargs):
+        self.checkout_stats = CheckoutStats()
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        started = self.checkout_stats.start()
+        success = False
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+            success = True
+            return connection
+        finally:
+            self.checkout_stats.finish(started, success)
+
+    def stats(self):
+        # slots not in the queue are held by callers
+        return {
+            "size": self.max_connections,
+            "in_use": self.max_connections - self.pool.qsize(),
+            "connections": len(self._connections),
+            **self.checkout_stats.as_dict(),
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """SQLAlchemy queue pool with checkout stats."""
+
+    def __init__(self, *args, **kwargs):
+        self.checkout_stats = CheckoutStats()
+        super().__init__(*args, **kwargs)
+
+    def _do_get(self):
+        started = self.checkout_stats.start()
+        success = False
+        try:
+            connection = super()._do_get()
+            success = True
+            return connection
+        finally:
+            self.checkout_stats.finish(started, success)
+
+    def stats(self):
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "overflow": self.overflow(),
+            **self.checkout_stats.as_dict(),
+        }
+
+
+def engine_options(config):
+    """
+    Build the SQLAlchemy engine options from the DB_POOL_* settings.
+
+    Sizes only apply to queue pools, SQLite uses a single or no pool.
+    Options set in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+
+    Args:
+        config (dict): The app config.
+
+    Returns:
+        dict: The engine options.
+    """
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+    if make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+        )
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+class Resources(object):
+    """
+    Connection pools of an app, created in the process that uses them.
+
+    The Redis pool is created on first use in each process, so a pool built
+    before a fork, e.g. by gunicorn --preload, is never shared with the
+    workers. In a forked child the database pools are also replaced,
+    without closing the connections the parent still uses.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._redis = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    @property
+    def redis(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._redis = self._create_redis()
+                    self._pid = os.getpid()
+        return self._redis
+
+    @redis.setter
+    def redis(self, client):
+        with self._lock:
+            self._redis = client
+            self._pid = os.getpid()
+
+    def _create_redis(self):
+        config = self.app.config
+        pool = InstrumentedConnectionPool.from_url(
+            config["REDIS_URL"],
+            max_connections=config["REDIS_MAX_CONNECTIONS"],
+            timeout=config["REDIS_POOL_TIMEOUT"],
+            health_check_interval=config["REDIS_HEALTH_CHECK_INTERVAL"],
+        )
+        return InstrumentedRedis(connection_pool=pool)
+
+    def after_fork(self):
+        from app import db
+
+        # the Redis client of the parent is replaced on first use
+        self._pid = None
+        if "sqlalchemy" in self.app.extensions:
+            with self.app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+
+    def stats(self):
+        """
+        Get the live stats of the pools of this process.
+
+        Returns:
+            dict: Size, connections in use, callers waiting for one and the
+            checkout latency of the Redis pool and of each database engine.
+        """
+        from app import db
+
+        pool = getattr(self.redis, "connection_pool", None)
+        stats = {
+            "pid": os.getpid(),
+            "redis": pool.stats() if hasattr(pool, "stats") else None,
+            "database": {},
+        }
+        for bind, engine in db.engines.items():
+            pool = engine.pool
+            if hasattr(pool, "stats"):
+                stats["database"][bind or "default"] = pool.stats()
+            else:
+                stats["database"][bind or "default"] = {
+                    "pool": type(pool).__name__,
+                    "in_use": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                }
+        return stats
+
+
+def _reset_after_fork():
+    for resources in list(_instances):
+        resources.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
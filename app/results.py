@@ -0,0 +1,554 @@
+import time
+from json import dumps, loads
+
+import redis
+
+from app.codecs import get_codec
+from app.encoders import CompatEncoder, get_encoder, load_records
+from app.retention import ResultRetention, ResultTooLarge
+
+__all__ = ["ResultStore", "AsyncResultReader"]
+
+
+def join_pages(pages):
+    """Join stored pages into the same JSON as dumps() of all the records."""
+    return "[" + ", ".join(page[1:-1] for page in pages if page != "[]") + "]"
+
+
+def page_span(cursor, page_size, count, stored_size):
+    """
+    Locate records in the stored pages.
+
+    Args:
+        cursor (int): The index of the first record.
+        page_size (int): The maximum number of records.
+        count (int): The number of stored records.
+        stored_size (int): The number of records per stored page.
+
+    Returns:
+        tuple: The first and last stored page, the offset of the cursor in
+        the first page and the number of records, or None if there are none.
+    """
+    end = min(cursor + page_size, count)
+    if cursor >= end:
+        return None
+    first = cursor // stored_size
+    return first, (end - 1) // stored_size, cursor - first * stored_size, end - cursor
+
+
+def _meta(meta):
+    return int(meta[b"count"]), int(meta[b"page_size"])
+
+
+def _format(meta):
+    # results stored before the format header are plain JSON pages
+    return meta.get(b"format", b"json").decode(), get_codec(meta.get(b"codec", b"identity").decode())
+
+
+def page_decoders(meta):
+    """
+    Get the decoders of the stored pages of a result, from its format header.
+
+    Args:
+        meta (dict): The meta hash of the result.
+
+    Returns:
+        tuple: The functions decoding a stored page into its records, and
+        into the JSON text of its records.
+    """
+    format, codec = _format(meta)
+
+    def records(page):
+        return load_records(codec.decompress(page), format)
+
+    if format == "json":
+        return records, lambda page: codec.decompress(page).decode()
+    return records, lambda page: dumps(records(page))
+
+
+def stored_page(meta, cursor, page_size, accepts):
+    """
+    Locate the stored page holding exactly the records asked for, if any.
+
+    Args:
+        meta (dict): The meta hash of the result.
+        cursor (int): The index of the first record.
+        page_size (int): The maximum number of records, None for a stored page.
+        accepts (callable): Tells whether the client accepts a content coding.
+
+    Returns:
+        tuple: The index of the stored page and its content coding, or None
+        if the records are not a whole stored JSON page the client can read.
+    """
+    count, stored_size = _meta(meta)
+    format, codec = _format(meta)
+    page_size = page_size or stored_size
+    if format != "json" or cursor % stored_size or cursor >= count:
+        return None
+    if min(cursor + page_size, count) != min(cursor + stored_size, count):
+        return None
+    if codec.content_encoding is None:
+        return (cursor // stored_size, None) if codec.name == "identity" else None
+    if not accepts(codec.content_encoding):
+        return None
+    return cursor // stored_size, codec.content_encoding
+
+
+def meta_key(transaction_id):
+    """Get the key of the meta hash of a result."""
+    return f"{transaction_id}:meta"
+
+
+def queue_read_meta(pipe, transaction_id):
+    """Queue the read of the meta hash of a result, which counts as a use of it."""
+    pipe.hgetall(meta_key(transaction_id))
+    ResultRetention.touch(pipe, transaction_id)
+
+
+def _truncated(meta):
+    return b"truncated" in meta
+
+
+def decode_all(meta, pages):
+    """Join all the stored pages of a result into the JSON of its records."""
+    text = page_decoders(meta)[1]
+    return join_pages([text(page) for page in pages])
+
+
+def decode_span(meta, pages, span):
+    """Decode the records located by page_span() in the pages it spans."""
+    _, _, offset, size = span
+    decode = page_decoders(meta)[0]
+    records = []
+    for page in pages:
+        records.extend(decode(page))
+    return records[offset : offset + size]
+
+
+def decode_next(decode, page, cursor, end, stored_size):
+    """Decode the records of a stored page from a cursor, up to the end one."""
+    records = decode(page) if page is not None else []
+    offset = cursor - (cursor // stored_size) * stored_size
+    return records[offset : offset + end - cursor]
+
+
+def value_result(payload):
+    """Like read_result() for a value stored by write_value(), None if missing."""
+    return (payload.decode(), False) if payload is not None else None
+
+
+def value_page(payload, cursor, page_size):
+    """Like read_page() for a value stored by write_value(), None if missing."""
+    if payload is None:
+        return None
+    results = loads(payload)
+    return results[cursor : cursor + page_size], len(results), False
+
+
+def value_records(payload, cursor, limit):
+    """Get the records of a value stored by write_value(), from a cursor."""
+    records = loads(payload)[cursor:] if payload is not None else []
+    return records[:limit] if limit is not None else records
+
+
+def stored_page_result(meta, cursor, payload, content_encoding):
+    """Build the answer of read_stored_page(), None if the page expired."""
+    if payload is None:
+        return None
+    count, stored_size = _meta(meta)
+    next_cursor = min(cursor + stored_size, count)
+    return payload, content_encoding, count, next_cursor, _truncated(meta)
+
+
+class ResultStore(object):
+    """
+    Search results storage on the shared Redis client.
+
+    Results are stored under their transaction ID as a Redis list of pages,
+    each page a JSON array of up to ``RESULT_PAGE_SIZE`` records, next to a
+    ``<transaction_id>:meta`` hash holding the record count and page size.
+    Readers can then fetch one page at a time, so their memory is bounded by
+    the page size rather than the result size.
+
+    Pages are encoded by the ``RESULT_ENCODER`` encoder and compressed by
+    the ``RESULT_CODEC`` codec, both named in the meta hash so results
+    written with other settings can still be read. Writes go through a
+    transaction, expire after ``RESULT_TTL`` seconds and are retried with an
+    exponential backoff on connection errors.
+
+    A result larger than ``RESULT_MAX_BYTES`` is truncated to its first
+    records that fit, which the meta hash records, or rejected, depending on
+    ``RESULT_OVERSIZE``. Stored results are accounted for by
+    ResultRetention, which keeps them within ``RESULT_MEMORY_BUDGET``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.encoder = get_encoder(app.config["RESULT_ENCODER"])
+        self.codec = get_codec(app.config["RESULT_CODEC"])
+        # for the consumers of JSON, e.g. the HTTP results backend
+        self.json_encoder = self.encoder if self.encoder.format == "json" else CompatEncoder()
+        self.retention = ResultRetention(app)
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    meta_key = staticmethod(meta_key)
+
+    def write(self, transaction_id, results):
+        """
+        Store the results of a search.
+
+        Args:
+            transaction_id (str): The transaction ID.
+            results (list): The search results, rows in RECORD_COLUMNS order
+                or dictionaries.
+        """
+        self.write_many({transaction_id: results})
+
+    def write_many(self, results_by_id):
+        """
+        Store the results of several searches in one round trip.
+
+        Args:
+            results_by_id (dict): Search results by transaction ID, rows in
+                RECORD_COLUMNS order or dictionaries.
+
+        Raises:
+            ResultTooLarge: A result is larger than RESULT_MAX_BYTES and
+                RESULT_OVERSIZE is "reject", nothing was stored.
+        """
+        entries = self.encode_many(results_by_id)
+        sizes = {transaction_id: sum(map(len, pages)) for transaction_id, pages, *_ in entries}
+
+        def write():
+            pipe = self.redis.pipeline()
+            self.queue_writes(pipe, entries)
+            self.retention.queue_track(pipe, sizes)
+            return pipe.execute()
+
+        self.retention.account(sizes, self._retry(write))
+
+    def write_value(self, key, value):
+        """
+        Store any JSON value under a key, like results stored over HTTP.
+
+        Raises:
+            ResultTooLarge: The value is larger than RESULT_MAX_BYTES.
+        """
+        payload = dumps(value)
+        max_bytes = self.app.config["RESULT_MAX_BYTES"]
+        if max_bytes and len(payload) > max_bytes:
+            raise ResultTooLarge(
+                f"The value of {key} takes {len(payload)} bytes, more than {max_bytes}."
+            )
+
+        sizes = {key: len(payload)}
+        pipe = self.redis.pipeline()
+        pipe.delete(self.meta_key(key))
+        pipe.set(key, payload, ex=self.app.config["RESULT_TTL"] or None)
+        self.retention.queue_track(pipe, sizes)
+        self.retention.account(sizes, pipe.execute())
+
+    def encode_many(self, results_by_id):
+        """
+        Encode and compress the pages of search results.
+
+        Args:
+            results_by_id (dict): Search results by transaction ID.
+
+        Returns:
+            list: The transaction ID, stored pages, number of records stored
+            and number of records of each search, for queue_writes().
+        """
+        page_size = self.app.config["RESULT_PAGE_SIZE"]
+        entries = []
+        with self.app.metrics.timer("serialization_duration_seconds", stage="results"):
+            for transaction_id, results in results_by_id.items():
+                pages = self._paginate(results, page_size)
+                pages, count = self._fit(transaction_id, results, pages, page_size)
+                entries.append((transaction_id, pages, count, len(results)))
+        return entries
+
+    def queue_writes(self, pipe, entries):
+        """
+        Queue the writes of encoded results, with their format header.
+
+        Args:
+            pipe (Pipeline): A pipeline of the sync or asyncio client.
+            entries (list): The output of encode_many().
+        """
+        ttl = self.app.config["RESULT_TTL"] or None
+        header = {
+            "page_size": self.app.config["RESULT_PAGE_SIZE"],
+            "format": self.encoder.format,
+            "codec": self.codec.name,
+        }
+        for transaction_id, pages, count, total in entries:
+            meta_key = self.meta_key(transaction_id)
+            meta = {"count": count, **header}
+            if count < total:
+                meta["truncated"] = total
+            pipe.delete(transaction_id, meta_key)
+            pipe.rpush(transaction_id, *pages)
+            pipe.hset(meta_key, mapping=meta)
+            if ttl:
+                pipe.expire(transaction_id, ttl)
+                pipe.expire(meta_key, ttl)
+
+    def _paginate(self, results, page_size):
+        encode, compress = self.encoder.dumps, self.codec.compress
+        pages = [
+            compress(encode(results[i : i + page_size]))
+            for i in range(0, len(results), page_size)
+        ]
+        # an empty list would not exist in Redis, keep one empty page
+        return pages or [compress(encode([]))]
+
+    def _fit(self, transaction_id, results, pages, page_size):
+        max_bytes = self.app.config["RESULT_MAX_BYTES"]
+        size = sum(map(len, pages))
+        if not max_bytes or size <= max_bytes:
+            return pages, len(results)
+        if self.app.config["RESULT_OVERSIZE"] == "reject":
+            raise ResultTooLarge(
+                f"The results of {transaction_id} take {size} bytes, more than {max_bytes}."
+            )
+
+        kept, size = [], 0
+        for page in pages:
+            if size + len(page) > max_bytes:
+                break
+            kept.append(page)
+            size += len(page)
+
+        # then as many records of the next page as fit, by bisection
+        start = len(kept) * page_size
+        low, high, last = 0, min(page_size, len(results) - start), None
+        while high - low > 1:
+            middle = (low + high) // 2
+            page = self.codec.compress(self.encoder.dumps(results[start : start + middle]))
+            if size + len(page) <= max_bytes:
+                low, last = middle, page
+            else:
+                high = middle
+        if last is not None:
+            kept.append(last)
+
+        self.app.logger.warning(
+            f"[Results] {transaction_id} truncated to {start + low} of {len(results)} records."
+        )
+        return kept or self._paginate([], page_size), start + low
+
+    def read(self, transaction_id):
+        """
+        Get all the serialized results of a search.
+
+        Args:
+            transaction_id (str): The transaction ID.
+
+        Returns:
+            str: The JSON encoded results, or None if there are none.
+        """
+        result = self.read_result(transaction_id)
+        return result[0] if result is not None else None
+
+    def read_result(self, transaction_id):
+        """
+        Get all the serialized results of a search, and whether they were truncated.
+
+        Args:
+            transaction_id (str): The transaction ID.
+
+        Returns:
+            tuple: The JSON encoded results and whether they were truncated,
+            or None if there are none.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.type(transaction_id)
+        queue_read_meta(pipe, transaction_id)
+        kind, meta, _ = pipe.execute()
+        if kind != b"list":
+            return value_result(self.redis.get(transaction_id))
+        return decode_all(meta, self.redis.lrange(transaction_id, 0, -1)), _truncated(meta)
+
+    def read_page(self, transaction_id, cursor, page_size):
+        """
+        Get a page of the results of a search.
+
+        Args:
+            transaction_id (str): The transaction ID.
+            cursor (int): The index of the first record.
+            page_size (int): The maximum number of records.
+
+        Returns:
+            tuple: The list of records, the total number of records and
+            whether the results were truncated, or None if there are no
+            results.
+        """
+        meta = self._load_meta(transaction_id)
+        if not meta:
+            return value_page(self.redis.get(transaction_id), cursor, page_size)
+
+        count, stored_size = _meta(meta)
+        span = page_span(cursor, page_size, count, stored_size)
+        if span is None:
+            return [], count, _truncated(meta)
+        pages = self.redis.lrange(transaction_id, span[0], span[1])
+        return decode_span(meta, pages, span), count, _truncated(meta)
+
+    def read_stored_page(self, transaction_id, cursor, page_size, accepts):
+        """
+        Get a page of results as stored, when it can be sent as it is.
+
+        Args:
+            transaction_id (str): The transaction ID.
+            cursor (int): The index of the first record.
+            page_size (int): The maximum number of records, None for the
+                stored page size.
+            accepts (callable): Tells whether the client accepts a content
+                coding.
+
+        Returns:
+            tuple: The JSON array of the records, compressed with its content
+            coding or None, the total number of records, the cursor after the
+            page and whether the results were truncated, or None if the page
+            has to be decoded with read_page().
+        """
+        meta = self._load_meta(transaction_id)
+        located = stored_page(meta, cursor, page_size, accepts) if meta else None
+        if located is None:
+            return None
+        index, content_encoding = located
+        payload = self.redis.lindex(transaction_id, index)
+        return stored_page_result(meta, cursor, payload, content_encoding)
+
+    def iter_pages(self, transaction_id, cursor=0, limit=None):
+        """
+        Iterate over the results of a search, one stored page at a time.
+
+        Args:
+            transaction_id (str): The transaction ID.
+            cursor (int): The index of the first record.
+            limit (int): The maximum number of records, None for all.
+
+        Yields:
+            list: Consecutive lists of records.
+        """
+        meta = self._load_meta(transaction_id)
+        if not meta:
+            records = value_records(self.redis.get(transaction_id), cursor, limit)
+            if records:
+                yield records
+            return
+
+        count, stored_size = _meta(meta)
+        decode = page_decoders(meta)[0]
+        end = count if limit is None else min(cursor + limit, count)
+        while cursor < end:
+            page = self.redis.lindex(transaction_id, cursor // stored_size)
+            records = decode_next(decode, page, cursor, end, stored_size)
+            if not records:
+                return
+            yield records
+            cursor += len(records)
+
+    def _load_meta(self, transaction_id):
+        pipe = self.redis.pipeline(transaction=False)
+        queue_read_meta(pipe, transaction_id)
+        return pipe.execute()[0]
+
+    def _retry(self, func):
+        retries = self.app.config["RESULT_WRITE_RETRIES"]
+        backoff = self.app.config["RESULT_WRITE_BACKOFF"]
+        for attempt in range(retries + 1):
+            try:
+                return func()
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                if attempt == retries:
+                    raise
+                delay = backoff * 2**attempt
+                self.app.logger.warning(
+                    f"[Results] Redis write failed ({e}), retrying in {delay:.2f}s."
+                )
+                time.sleep(delay)
+
+
+class AsyncResultReader(object):
+    """
+    Reads search results stored by ResultStore with an asyncio Redis client.
+
+    Only the Redis calls differ from ResultStore: the key layout and the
+    decoding of the pages are the helpers of this module.
+
+    Args:
+        redis (redis.asyncio.Redis): The client.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def read(self, transaction_id):
+        """Async version of ResultStore.read."""
+        result = await self.read_result(transaction_id)
+        return result[0] if result is not None else None
+
+    async def read_result(self, transaction_id):
+        """Async version of ResultStore.read_result."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.type(transaction_id)
+        queue_read_meta(pipe, transaction_id)
+        kind, meta, _ = await pipe.execute()
+        if kind != b"list":
+            return value_result(await self.redis.get(transaction_id))
+        pages = await self.redis.lrange(transaction_id, 0, -1)
+        return decode_all(meta, pages), _truncated(meta)
+
+    async def read_page(self, transaction_id, cursor, page_size):
+        """Async version of ResultStore.read_page."""
+        meta = await self._load_meta(transaction_id)
+        if not meta:
+            return value_page(await self.redis.get(transaction_id), cursor, page_size)
+
+        count, stored_size = _meta(meta)
+        span = page_span(cursor, page_size, count, stored_size)
+        if span is None:
+            return [], count, _truncated(meta)
+        pages = await self.redis.lrange(transaction_id, span[0], span[1])
+        return decode_span(meta, pages, span), count, _truncated(meta)
+
+    async def read_stored_page(self, transaction_id, cursor, page_size, accepts):
+        """Async version of ResultStore.read_stored_page."""
+        meta = await self._load_meta(transaction_id)
+        located = stored_page(meta, cursor, page_size, accepts) if meta else None
+        if located is None:
+            return None
+        index, content_encoding = located
+        payload = await self.redis.lindex(transaction_id, index)
+        return stored_page_result(meta, cursor, payload, content_encoding)
+
+    async def iter_pages(self, transaction_id, cursor=0, limit=None):
+        """Async version of ResultStore.iter_pages."""
+        meta = await self._load_meta(transaction_id)
+        if not meta:
+            records = value_records(await self.redis.get(transaction_id), cursor, limit)
+            if records:
+                yield records
+            return
+
+        count, stored_size = _meta(meta)
+        decode = page_decoders(meta)[0]
+        end = count if limit is None else min(cursor + limit, count)
+        while cursor < end:
+            page = await self.redis.lindex(transaction_id, cursor // stored_size)
+            records = decode_next(decode, page, cursor, end, stored_size)
+            if not records:
+                return
+            yield records
+            cursor += len(records)
+
+    async def _load_meta(self, transaction_id):
+        pipe = self.redis.pipeline(transaction=False)
+        queue_read_meta(pipe, transaction_id)
+        return (await pipe.execute())[0]
@@ -0,0 +1,186 @@
+import time
+
+__all__ = ["ResultRetention", "ResultTooLarge"]
+
+# results looked at per round trip while evicting or pruning
+EVICT_BATCH_SIZE = 100
+# share of the budget evicting frees up to, so that it runs once in a while
+# rather than on every write once the budget is reached
+EVICT_TARGET = 0.9
+# commands queued per result by queue_track()
+TRACK_COMMANDS = 4
+
+
+class ResultTooLarge(ValueError):
+    """A result is larger than ``RESULT_MAX_BYTES`` and RESULT_OVERSIZE is "reject"."""
+
+
+class ResultRetention(object):
+    """
+    Memory accounting of the stored results.
+
+    Every result is indexed, in the transaction writing it, in three sorted
+    sets: by last access, for the LRU eviction, by size, for the largest
+    offenders, and by expiry, to forget the results Redis expired. A counter holds their total bytes.
+    When it goes over ``RESULT_MEMORY_BUDGET``, the expired results are
+    pruned, then the least recently read ones are deleted until the total
+    is down to EVICT_TARGET of the budget.
+
+    Results stored before the index existed are not accounted for, they
+    expire with their TTL.
+    """
+
+    index_key = "results:lru"
+    sizes_key = "results:bytes"
+    expiry_key = "results:expiry"
+    total_key = "results:total-bytes"
+    evicted_key = "results:evicted"
+
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    @classmethod
+    def touch(cls, pipe, transaction_id):
+        """Queue the update of the last access of a result, if it is indexed."""
+        pipe.zadd(cls.index_key, {transaction_id: time.time()}, xx=True)
+
+    def queue_track(self, pipe, sizes):
+        """
+        Queue the indexing of results, in the pipeline writing them.
+
+        Args:
+            pipe (Pipeline): The pipeline.
+            sizes (dict): The bytes stored by transaction ID.
+        """
+        now = time.time()
+        ttl = self.app.config["RESULT_TTL"]
+        for transaction_id, size in sizes.items():
+            pipe.zscore(self.sizes_key, transaction_id)
+            pipe.zadd(self.sizes_key, {transaction_id: size})
+            pipe.zadd(self.index_key, {transaction_id: now})
+            if ttl:
+                pipe.zadd(self.expiry_key, {transaction_id: now + ttl})
+            else:
+                pipe.zrem(self.expiry_key, transaction_id)
+
+    def account(self, sizes, replies):
+        """
+        Add results written to the total, then enforce the budget.
+
+        Args:
+            sizes (dict): The bytes stored by transaction ID.
+            replies (list): The replies of the pipeline, ending with those
+                of queue_track().
+        """
+        replaced = replies[len(replies) - TRACK_COMMANDS * len(sizes) :: TRACK_COMMANDS]
+        delta = sum(sizes.values()) - sum(int(size or 0) for size in replaced)
+        total = self.redis.incrby(self.total_key, delta)
+
+        budget = self.app.config["RESULT_MEMORY_BUDGET"]
+        if budget and total > budget:
+            total -= self.prune_expired()
+            if total > budget:
+                self.evict(total - int(budget * EVICT_TARGET), exclude=sizes)
+
+    def evict(self, excess, exclude=()):
+        """
+        Delete the least recently read results.
+
+        Args:
+            excess (int): The bytes to free.
+            exclude (iterable): Transaction IDs to keep, e.g. just written.
+
+        Returns:
+            int: The bytes freed.
+        """
+        exclude = set(exclude)
+        freed = evicted = 0
+        while freed < excess:
+            ids = self.redis.zrange(self.index_key, 0, EVICT_BATCH_SIZE + len(exclude) - 1)
+            candidates = [id.decode() for id in ids if id.decode() not in exclude]
+            if not candidates:
+                break
+            pipe = self.redis.pipeline(transaction=False)
+            for transaction_id in candidates:
+                pipe.zscore(self.sizes_key, transaction_id)
+            victims, planned = [], freed
+            for transaction_id, size in zip(candidates, pipe.execute()):
+                victims.append(transaction_id)
+                planned += int(size or 0)
+                if planned >= excess:
+                    break
+            count, size = self._remove(victims)
+            evicted += count
+            freed += size
+
+        if evicted:
+            self.redis.incrby(self.evicted_key, evicted)
+            self.app.logger.info(
+                f"[Results] Evicted {evicted} result(s), {freed} bytes over the memory budget."
+            )
+        return freed
+
+    def prune_expired(self):
+        """
+        Forget the results Redis expired.
+
+        Returns:
+            int: The bytes they were accounted for.
+        """
+        freed = 0
+        while True:
+            ids = self.redis.zrangebyscore(
+                self.expiry_key, "-inf", time.time(), start=0, num=EVICT_BATCH_SIZE
+            )
+            if not ids:
+                return freed
+            freed += self._remove([id.decode() for id in ids])[1]
+
+    def _remove(self, ids):
+        # in one transaction, so a result removed by two workers is only
+        # subtracted from the total once
+        pipe = self.redis.pipeline()
+        for transaction_id in ids:
+            pipe.zscore(self.sizes_key, transaction_id)
+            pipe.zrem(self.sizes_key, transaction_id)
+            pipe.zrem(self.index_key, transaction_id)
+            pipe.zrem(self.expiry_key, transaction_id)
+            pipe.delete(transaction_id, f"{transaction_id}:meta")
+        sizes = [int(size) for size in pipe.execute()[::5] if size is not None]
+        if sizes:
+            self.redis.decrby(self.total_key, sum(sizes))
+        return len(sizes), sum(sizes)
+
+    def stats(self, top=10):
+        """
+        Get the accounting of the stored results.
+
+        Args:
+            top (int): The number of largest results listed.
+
+        Returns:
+            dict: The number of results and their total bytes, the budget,
+            the results evicted so far and the largest results.
+        """
+        self.prune_expired()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self.index_key)
+        pipe.get(self.total_key)
+        pipe.get(self.evicted_key)
+        pipe.zrevrange(self.sizes_key, 0, top - 1, withscores=True)
+        keys, total, evicted, largest = pipe.execute()
+        config = self.app.config
+        return {
+            "keys": keys,
+            "total_bytes": int(total or 0),
+            "budget_bytes": config["RESULT_MEMORY_BUDGET"] or None,
+            "max_result_bytes": config["RESULT_MAX_BYTES"] or None,
+            "evicted": int(evicted or 0),
+            "largest": [
+                {"transaction_id": id.decode(), "bytes": int(size)} for id, size in largest
+            ],
+        }
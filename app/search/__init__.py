@@ -0,0 +1,38 @@
+import importlib
+import threading
+
+__all__ = ("ENGINES", "engine_class", "get_engine")
+
+# engines by name, imported when first used
+ENGINES = {
+    "sql": "app.search.sql:SQLEngine",
+    "trigram": "app.search.trigram:TrigramEngine",
+    "columnar": "app.search.columnar:ColumnarEngine",
+}
+
+_lock = threading.Lock()
+
+
+def engine_class(name):
+    """Import the class of the engine called name."""
+    module, _, attr = ENGINES[name].partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def get_engine(app):
+    """
+    Get the search engine configured by SEARCH_ENGINE, one per worker.
+
+    Args:
+        app (Flask): The application.
+
+    Returns:
+        object: An engine with a search(name, city, quantity) method.
+    """
+    name = app.config["SEARCH_ENGINE"]
+    engines = app.extensions.setdefault("search_engines", {})
+    if name not in engines:
+        with _lock:
+            if name not in engines:
+                engines[name] = engine_class(name)()
+    return engines[name]
@@ -0,0 +1,336 @@
+import hashlib
+import itertools
+import json
+import time
+from uuid import uuid4
+
+import redis
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import CSVData
+
+from .patterns import folder
+
+__all__ = [
+    "SearchCache",
+    "get_generation",
+    "get_rewrite_generation",
+    "bump_generation",
+    "mark_csv_data_changed",
+]
+
+GENERATION_KEY = "csv_data:generation"
+# moves with the generation when rows were updated or deleted, not only inserted
+REWRITE_GENERATION_KEY = "csv_data:rewrite-generation"
+CHANGED_FLAG = "csv_data_changed"
+REWRITTEN_FLAG = "csv_data_rewritten"
+
+
+def get_generation(redis):
+    return int(redis.get(GENERATION_KEY) or 0)
+
+
+def get_rewrite_generation(redis):
+    return int(redis.get(REWRITE_GENERATION_KEY) or 0)
+
+
+def bump_generation(redis, rewrite=True):
+    """
+    Invalidate every cached search by moving to a new dataset generation.
+
+    Args:
+        redis (Redis): The Redis client.
+        rewrite (bool): Whether rows were updated or deleted, which also
+            moves the rewrite generation indexes built incrementally use.
+
+    Returns:
+        int: The new generation.
+    """
+    pipe = redis.pipeline(transaction=False)
+    pipe.incr(GENERATION_KEY)
+    if rewrite:
+        pipe.incr(REWRITE_GENERATION_KEY)
+    return pipe.execute()[0]
+
+
+def mark_csv_data_changed(session, rewrite=True):
+    """
+    Make the next commit of a session bump the dataset generation.
+
+    Args:
+        session (Session): The session.
+        rewrite (bool): Whether rows were updated or deleted, False when
+            they were only inserted.
+    """
+    session.info[CHANGED_FLAG] = True
+    if rewrite:
+        session.info[REWRITTEN_FLAG] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _track_orm_changes(session, flush_context):
+    if any(isinstance(obj, CSVData) for obj in itertools.chain(session.dirty, session.deleted)):
+        mark_csv_data_changed(session)
+    elif any(isinstance(obj, CSVData) for obj in session.new):
+        mark_csv_data_changed(session, rewrite=False)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    if getattr(orm_execute_state.statement, "table", None) is CSVData.__table__:
+        mark_csv_data_changed(
+            orm_execute_state.session, rewrite=not orm_execute_state.is_insert
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_generation_on_commit(session):
+    rewrite = session.info.pop(REWRITTEN_FLAG, False)
+    if session.info.pop(CHANGED_FLAG, False) and has_app_context():
+        try:
+            bump_generation(current_app.redis, rewrite)
+        except Exception as e:
+            current_app.logger.error(f"[Search Cache] Error invalidating the cache: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes_on_rollback(session):
+    session.info.pop(CHANGED_FLAG, None)
+    session.info.pop(REWRITTEN_FLAG, None)
+
+
+def _batch_rows(engine, queries):
+    if hasattr(engine, "batch_rows"):
+        return engine.batch_rows(queries)
+    return [engine.rows(*query) for query in queries]
+
+
+class SearchCache(object):
+    """
+    Redis cache of search results with single-flight de-duplication.
+
+    Entries are keyed on the normalized query and the dataset generation, so
+    any change to csv_data invalidates them all. Entries expire after
+    ``SEARCH_CACHE_TTL`` seconds and the least recently used ones are evicted
+    beyond ``SEARCH_CACHE_MAX_ENTRIES``. Results larger than
+    ``SEARCH_CACHE_MAX_ENTRY_BYTES`` are not cached: the result store
+    already keeps them, within its own limits. While a search runs,
+    identical searches from any worker wait for its result instead of
+    running again.
+    """
+
+    prefix = "search-cache"
+    # format of the entries, rows as JSON arrays since version 2
+    version = 2
+
+    def __init__(self, app):
+        self.app = app
+        self.lru_key = f"{self.prefix}:lru"
+        self.stats_key = f"{self.prefix}:stats"
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    @property
+    def enabled(self):
+        return self.app.config["SEARCH_CACHE_TTL"] > 0
+
+    def bucket(self, quantity):
+        """Round a quantity up to a power of two, so close quantities share an entry."""
+        if not quantity:
+            return None
+        minimum = self.app.config["SEARCH_CACHE_MIN_BUCKET"]
+        return max(minimum, 1 << (quantity - 1).bit_length())
+
+    def key(self, name, city, bucket, generation=None):
+        fold = folder(db.engine.dialect.name)
+        query = json.dumps([fold(name), fold(city), bucket])
+        digest = hashlib.sha1(query.encode()).hexdigest()
+        if generation is None:
+            generation = get_generation(self.redis)
+        return f"{self.prefix}:v{self.version}:{generation}:{digest}"
+
+    def search(self, engine, name, city, quantity):
+        """
+        Run a search through the cache.
+
+        The filters are searched as given: the key only folds their case,
+        like the case-insensitive match of the engines.
+
+        Args:
+            engine (object): The search engine to run the search on a miss.
+            name (str): The name to search for.
+            city (str): The city to search for.
+            quantity (int): The maximum number of results to return.
+
+        Returns:
+            list: The matching rows as tuples in RECORD_COLUMNS order.
+        """
+        if not self.enabled:
+            return engine.rows(name, city, quantity)
+
+        bucket = self.bucket(quantity)
+        key = self.key(name, city, bucket)
+        rows = self._get(key)
+        if rows is not None:
+            self.redis.hincrby(self.stats_key, "hits")
+            return rows[:quantity] if quantity else rows
+
+        rows = self._single_flight(key, lambda: engine.rows(name, city, bucket))
+        return rows[:quantity] if quantity else rows
+
+    def search_many(self, engine, queries):
+        """
+        Run several searches through the cache.
+
+        Cached searches are read in one round trip, the others are run
+        together by the engine's batch_rows() when it has one, identical
+        searches only once.
+
+        Args:
+            engine (object): The search engine to run the missing searches.
+            queries (list): (name, city, quantity) tuples.
+
+        Returns:
+            list: The matching rows of each search, as tuples in
+            RECORD_COLUMNS order.
+        """
+        if not self.enabled:
+            return _batch_rows(engine, queries)
+
+        generation = get_generation(self.redis)
+        keys = [
+            self.key(name, city, self.bucket(quantity), generation)
+            for name, city, quantity in queries
+        ]
+        pipe = self.redis.pipeline(transaction=False)
+        now = time.time()
+        for key in keys:
+            pipe.get(key)
+            pipe.zadd(self.lru_key, {key: now}, xx=True)
+        cached = dict(zip(keys, pipe.execute()[::2]))
+
+        missing = {}
+        for key, (name, city, quantity) in zip(keys, queries):
+            if cached[key] is None and key not in missing:
+                missing[key] = (name, city, self.bucket(quantity))
+        for key, rows in zip(missing, _batch_rows(engine, list(missing.values()))):
+            self._set(key, rows)
+            cached[key] = rows
+
+        hits = sum(1 for key in keys if key not in missing)
+        if hits:
+            self.redis.hincrby(self.stats_key, "hits", hits)
+        if missing:
+            self.redis.hincrby(self.stats_key, "misses", len(missing))
+
+        results = []
+        for key, (_, _, quantity) in zip(keys, queries):
+            rows = cached[key]
+            if isinstance(rows, bytes):
+                rows = cached[key] = list(map(tuple, json.loads(rows)))
+            results.append(rows[:quantity] if quantity else rows)
+        return results
+
+    def _single_flight(self, key, compute):
+        lock_key = f"{key}:lock"
+        timeout = self.app.config["SEARCH_CACHE_LOCK_TIMEOUT"]
+        deadline = time.monotonic() + timeout
+        token = uuid4().hex
+
+        while time.monotonic() < deadline:
+            if self.redis.set(lock_key, token, nx=True, px=int(timeout * 1000)):
+                self.redis.hincrby(self.stats_key, "misses")
+                try:
+                    rows = compute()
+                    self._set(key, rows)
+                finally:
+                    self._release(lock_key, token)
+                return rows
+
+            # another worker runs the same search, wait for its result
+            while self.redis.exists(lock_key) and time.monotonic() < deadline:
+                time.sleep(self.app.config["SEARCH_CACHE_POLL_INTERVAL"])
+            rows = self._get(key)
+            if rows is not None:
+                self.redis.hincrby(self.stats_key, "shared")
+                return rows
+
+        self.redis.hincrby(self.stats_key, "misses")
+        return compute()
+
+    def _release(self, lock_key, token):
+        # only delete the lock if it was not taken over after a timeout
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(lock_key)
+                if pipe.get(lock_key) == token.encode():
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+
+    def _get(self, key):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.zadd(self.lru_key, {key: time.time()}, xx=True)
+        payload, _ = pipe.execute()
+        return list(map(tuple, json.loads(payload))) if payload is not None else None
+
+    def _set(self, key, rows):
+        payload = json.dumps(rows)
+        max_bytes = self.app.config["SEARCH_CACHE_MAX_ENTRY_BYTES"]
+        if max_bytes and len(payload) > max_bytes:
+            self.redis.hincrby(self.stats_key, "oversized")
+            return
+
+        now = time.time()
+        ttl = self.app.config["SEARCH_CACHE_TTL"]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(key, payload, ex=ttl)
+        pipe.zadd(self.lru_key, {key: now})
+        pipe.zremrangebyscore(self.lru_key, "-inf", now - ttl)
+        pipe.zcard(self.lru_key)
+        size = pipe.execute()[-1]
+
+        excess = size - self.app.config["SEARCH_CACHE_MAX_ENTRIES"]
+        if excess > 0:
+            evicted = [k for k, _ in self.redis.zpopmin(self.lru_key, excess)]
+            self.redis.delete(*evicted)
+            self.redis.hincrby(self.stats_key, "evictions", len(evicted))
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: Hits, misses, searches that attached to a running one,
+            evictions, results too large to cache, the number of entries,
+            their bytes and the hit ratio.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.stats_key)
+        pipe.zrange(self.lru_key, 0, -1)
+        counters, keys = pipe.execute()
+        # at most SEARCH_CACHE_MAX_ENTRIES keys, expired ones count 0 bytes
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.strlen(key)
+        sizes = pipe.execute() if keys else []
+        stats = {
+            name: int(counters.get(name.encode(), 0))
+            for name in ("hits", "misses", "shared", "evictions", "oversized")
+        }
+        served = stats["hits"] + stats["shared"]
+        total = served + stats["misses"]
+        stats["entries"] = len(keys)
+        stats["bytes"] = sum(sizes)
+        stats["hit_ratio"] = round(served / total, 4) if total else None
+        return stats
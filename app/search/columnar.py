@@ -0,0 +1,265 @@
+import itertools
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db
+from app.encoders import RECORD_COLUMNS
+from app.models import CSVData
+
+from .cache import get_generation
+from .patterns import contains_pattern, folder, literal_runs
+
+__all__ = ["StringColumn", "IntegerColumn", "Snapshot", "ColumnarEngine"]
+
+SEPARATOR = "\x00"
+LOAD_BATCH_SIZE = 10000
+
+
+class StringColumn(object):
+    """
+    Strings of a column joined in a single buffer, addressed by offsets.
+
+    Substring searches run over the whole buffer with str.find or a regular
+    expression, so they scan the column at C speed without a Python object
+    per row.
+    """
+
+    def __init__(self, values):
+        self.nulls = set()
+        self.starts = array("q")
+        position = 0
+        for i, value in enumerate(values):
+            if value is None:
+                self.nulls.add(i)
+                values[i] = value = ""
+            self.starts.append(position)
+            position += len(value) + 1
+        self.buffer = SEPARATOR.join(values)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if i in self.nulls:
+            return None
+        start = self.starts[i]
+        end = self.starts[i + 1] - 1 if i + 1 < len(self.starts) else len(self.buffer)
+        return self.buffer[start:end]
+
+    def _row(self, position):
+        return bisect_right(self.starts, position) - 1
+
+    def _next_start(self, row):
+        return self.starts[row + 1] if row + 1 < len(self.starts) else len(self.buffer)
+
+    def find(self, pattern):
+        """
+        Find the rows matching a LIKE pattern, with the column case folded.
+
+        Args:
+            pattern (str): A case folded LIKE pattern.
+
+        Yields:
+            int: The matching row indexes, in ascending order.
+        """
+        runs = literal_runs(pattern)
+        if len(runs) == 1 and pattern == f"%{runs[0]}%":
+            yield from self._find_substring(runs[0])
+            return
+
+        body = "".join(
+            f"[^{SEPARATOR}]*" if c == "%" else f"[^{SEPARATOR}]" if c == "_" else re.escape(c)
+            for c in pattern
+        )
+        regex = re.compile(f"(?<![^{SEPARATOR}]){body}(?![^{SEPARATOR}])", re.DOTALL)
+        last = -1
+        for match in regex.finditer(self.buffer):
+            row = self._row(match.start())
+            if row != last and row not in self.nulls:
+                last = row
+                yield row
+
+    def _find_substring(self, needle):
+        buffer, position = self.buffer, 0
+        while True:
+            position = buffer.find(needle, position)
+            if position < 0:
+                return
+            row = self._row(position)
+            yield row
+            position = self._next_start(row)
+
+
+class IntegerColumn(object):
+    """Integers of a column in an array, with the rows holding NULL."""
+
+    def __init__(self, values):
+        self.nulls = {i for i, value in enumerate(values) if value is None}
+        self.values = array("q", (0 if value is None else value for value in values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return None if i in self.nulls else self.values[i]
+
+
+class Snapshot(object):
+    """
+    Columnar copy of csv_data, rows in id order.
+
+    Args:
+        rows (iterable): Tuples of the values of ``columns``.
+        fold (callable): The case folding of the database.
+        version (tuple): The stamp of the table the rows were read from.
+    """
+
+    columns = RECORD_COLUMNS
+    integer_columns = ("id", "user_id")
+    searchable_columns = ("first_name", "city")
+
+    def __init__(self, rows, fold, version):
+        values = {column: [] for column in self.columns}
+        for row in rows:
+            for column, value in zip(self.columns, row):
+                values[column].append(value)
+
+        self.version = version
+        self.fold = fold
+        self.data = {
+            column: (IntegerColumn if column in self.integer_columns else StringColumn)(
+                values[column]
+            )
+            for column in self.columns
+        }
+        self.folded = {
+            column: StringColumn(
+                [fold(v) if v is not None else None for v in self.data[column]]
+            )
+            for column in self.searchable_columns
+        }
+
+    def __len__(self):
+        return len(self.data["id"])
+
+    def row(self, i):
+        return {column: self.data[column][i] for column in self.columns}
+
+    def values(self, i):
+        return tuple(self.data[column][i] for column in self.columns)
+
+    def match(self, filters, quantity):
+        """
+        Get the indexes of the rows matching ILIKE filters.
+
+        Args:
+            filters (dict): LIKE patterns by column name.
+            quantity (int): The maximum number of rows, falsy for all.
+
+        Returns:
+            list: The matching row indexes, in id order.
+        """
+        if not filters:
+            rows = range(len(self))
+        else:
+            masks = [
+                self.folded[column].find(self.fold(pattern))
+                for column, pattern in filters.items()
+            ]
+            if len(masks) == 1:
+                rows = masks[0]
+            else:
+                first, *others = [list(mask) for mask in masks]
+                others = [set(other) for other in others]
+                rows = (i for i in first if all(i in other for other in others))
+        return list(itertools.islice(rows, quantity or None))
+
+
+class ColumnarEngine(object):
+    """
+    Searches a columnar snapshot of csv_data held by each worker.
+
+    The snapshot is stamped with the row count, the highest id and the
+    dataset generation of the table, and is reloaded lazily on the first
+    search after any of them changed. Searches run against the current
+    snapshot while a new one is loaded.
+    """
+
+    name = "columnar"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counted_at = 0
+        self.snapshot = None
+
+    def version(self):
+        """
+        Get the stamp of csv_data: row count, highest id and dataset generation.
+
+        Counting rows scans the table, so it is only redone every
+        COLUMNAR_COUNT_INTERVAL seconds. Changes made through the app move
+        the generation, the count catches deletes made outside of it.
+        """
+        max_id = db.session.query(func.max(CSVData.id)).scalar() or 0
+        generation = get_generation(current_app.redis)
+        snapshot = self.snapshot
+        interval = current_app.config["COLUMNAR_COUNT_INTERVAL"]
+        if snapshot is not None and time.monotonic() - self._counted_at < interval:
+            count = snapshot.version[0]
+        else:
+            count = db.session.query(func.count(CSVData.id)).scalar()
+            self._counted_at = time.monotonic()
+        return count, max_id, generation
+
+    def refresh(self):
+        """Reload the snapshot if the table changed since it was loaded."""
+        version = self.version()
+        if self.snapshot is not None and self.snapshot.version == version:
+            return self.snapshot
+
+        with self._lock:
+            if self.snapshot is None or self.snapshot.version != version:
+                columns = [getattr(CSVData, column) for column in Snapshot.columns]
+                rows = (
+                    db.session.query(*columns)
+                    .order_by(CSVData.id)
+                    .yield_per(LOAD_BATCH_SIZE)
+                )
+                self.snapshot = Snapshot(rows, folder(db.engine.dialect.name), version)
+        return self.snapshot
+
+    def rows(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Args:
+            name (str): The name to search for.
+            city (str): The city to search for.
+            quantity (int): The maximum number of results to return.
+
+        Returns:
+            list: The matching rows as tuples in RECORD_COLUMNS order.
+        """
+        snapshot = self.refresh()
+
+        filters = {}
+        if name:
+            filters["first_name"] = contains_pattern(name)
+        if city:
+            filters["city"] = contains_pattern(city)
+        return [snapshot.values(i) for i in snapshot.match(filters, quantity)]
+
+    def search(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Returns:
+            list: The matching rows as dictionaries.
+        """
+        return [dict(zip(RECORD_COLUMNS, row)) for row in self.rows(name, city, quantity)]
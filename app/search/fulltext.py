@@ -0,0 +1,150 @@
+import re
+
+from sqlalchemy import inspect, text
+
+from app import db
+from app.encoders import RECORD_COLUMNS
+
+__all__ = [
+    "FIELD_WEIGHTS",
+    "FullTextEngine",
+    "create_fulltext_index",
+    "drop_fulltext_index",
+    "fulltext_terms",
+]
+
+# weight class of each text column, as Postgres setweight() takes them
+FIELD_WEIGHTS = {
+    "first_name": "A",
+    "last_name": "A",
+    "company": "B",
+    "email": "B",
+    "city": "C",
+    "gender": "D",
+}
+# the default weights of ts_rank(), used for bm25() as well
+CLASS_WEIGHTS = {"A": 1.0, "B": 0.4, "C": 0.2, "D": 0.1}
+
+FTS_TABLE = "csv_data_search"
+PG_INDEX = "ix_csv_data_search"
+
+_COLUMNS = ", ".join(FIELD_WEIGHTS)
+_NEW = ", ".join(f"new.{column}" for column in FIELD_WEIGHTS)
+_OLD = ", ".join(f"old.{column}" for column in FIELD_WEIGHTS)
+_BM25_WEIGHTS = ", ".join(str(CLASS_WEIGHTS[c]) for c in FIELD_WEIGHTS.values())
+
+# unicode61 splits emails on "@" and ".", so domains can be searched
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({_COLUMNS}, "
+    f"content='csv_data', content_rowid='id', tokenize='unicode61')",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25({_BM25_WEIGHTS})')",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES (new.id, {_NEW});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD});
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES (new.id, {_NEW});
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+# the "simple" parser keeps emails whole, split them like unicode61 does
+_PG_DOCUMENT = " || ".join(
+    f"setweight(to_tsvector('simple', "
+    f"regexp_replace(coalesce({column}, ''), '[@.]', ' ', 'g')), '{weight}')"
+    for column, weight in FIELD_WEIGHTS.items()
+)
+POSTGRES_DDL = [f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON csv_data USING gin (({_PG_DOCUMENT}))"]
+
+_PG_WEIGHTS = "{" + ", ".join(str(CLASS_WEIGHTS[c]) for c in "DCBA") + "}"
+_SELECT = ", ".join(f"csv_data.{column}" for column in RECORD_COLUMNS)
+
+POSTGRES_QUERY = f"""
+    SELECT {_SELECT} FROM csv_data, to_tsquery('simple', :query) query
+    WHERE ({_PG_DOCUMENT}) @@ query
+    ORDER BY ts_rank('{_PG_WEIGHTS}', {_PG_DOCUMENT}, query) DESC, csv_data.id
+    LIMIT :limit
+"""
+SQLITE_QUERY = f"""
+    SELECT {_SELECT} FROM {FTS_TABLE} JOIN csv_data ON csv_data.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH :query
+    ORDER BY {FTS_TABLE}.rank, csv_data.id
+    LIMIT :limit
+"""
+
+
+def create_fulltext_index(bind):
+    """
+    Create the full-text index over the text columns of csv_data.
+
+    Postgres gets a GIN index on the weighted tsvector of the columns.
+    SQLite gets an FTS5 table ranked by bm25() with the same weights, kept in
+    sync with csv_data by triggers.
+
+    Args:
+        bind (Connection): The connection to run the DDL on.
+    """
+    ddl = {"postgresql": POSTGRES_DDL, "sqlite": SQLITE_DDL}.get(bind.dialect.name, [])
+    for statement in ddl:
+        bind.execute(text(statement))
+
+
+def drop_fulltext_index(bind):
+    """Drop the index created by create_fulltext_index."""
+    if bind.dialect.name == "postgresql":
+        bind.execute(text(f"DROP INDEX IF EXISTS {PG_INDEX}"))
+    elif bind.dialect.name == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            bind.execute(text(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}"))
+        bind.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+
+def fulltext_terms(q):
+    """Split a full-text query into lowercase words."""
+    return re.findall(r"\w+", q.lower())
+
+
+class FullTextEngine(object):
+    """
+    Ranked full-text search over the text columns of csv_data.
+
+    Every word of the query has to match the start of a word of a row, in
+    any column. Rows are ranked with ts_rank() on Postgres and bm25() on
+    SQLite, names weighing most, then company and email, city, gender. Only
+    the top rows are kept while sorting, so the cost of a search grows with
+    the number of matches but its memory with the limit.
+    """
+
+    name = "fulltext"
+
+    def rows(self, q, quantity):
+        """
+        Search CSV data by words of any of its text columns.
+
+        Args:
+            q (str): The words to search for.
+            quantity (int): The number of results to return.
+
+        Returns:
+            list: The best matching rows first, as tuples in RECORD_COLUMNS order.
+        """
+        terms = fulltext_terms(q)
+        if not terms:
+            return []
+
+        connection = db.session.connection()
+        dialect = connection.dialect.name
+        if dialect == "postgresql":
+            query = " & ".join(f"{term}:*" for term in terms)
+            statement = POSTGRES_QUERY
+        elif dialect == "sqlite" and inspect(connection).has_table(FTS_TABLE):
+            query = " ".join(f'"{term}"*' for term in terms)
+            statement = SQLITE_QUERY
+        else:
+            raise RuntimeError("The full-text index is missing, run flask db upgrade.")
+
+        result = db.session.execute(text(statement), {"query": query, "limit": quantity})
+        return [tuple(row) for row in result]
@@ -0,0 +1,141 @@
+from sqlalchemy import and_, func, inspect, literal_column, select, table, text
+
+from app.models import CSVData
+
+from . import fulltext
+from .patterns import literal_runs
+
+__all__ = [
+    "PG_TRGM",
+    "FTS5",
+    "create_search_indexes",
+    "drop_search_indexes",
+    "detect_search_index",
+    "is_search_index_object",
+    "index_clause",
+]
+
+PG_TRGM = "pg_trgm"
+FTS5 = "fts5"
+
+INDEXED_COLUMNS = ("first_name", "city")
+FTS_TABLE = "csv_data_fts"
+TRGM_INDEXES = {column: f"ix_csv_data_{column}_trgm" for column in INDEXED_COLUMNS}
+
+_FTS_COLUMNS = ", ".join(INDEXED_COLUMNS)
+_FTS_NEW = ", ".join(f"new.{column}" for column in INDEXED_COLUMNS)
+_FTS_OLD = ", ".join(f"old.{column}" for column in INDEXED_COLUMNS)
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({_FTS_COLUMNS}, "
+    f"content='csv_data', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_FTS_COLUMNS})
+        VALUES ('delete', old.id, {_FTS_OLD});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON csv_data BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_FTS_COLUMNS})
+        VALUES ('delete', old.id, {_FTS_OLD});
+        INSERT INTO {FTS_TABLE}(rowid, {_FTS_COLUMNS}) VALUES (new.id, {_FTS_NEW});
+    END""",
+    # index the rows already in csv_data
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRES_DDL = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f"CREATE INDEX IF NOT EXISTS {index} ON csv_data USING gin (lower({column}) gin_trgm_ops)"
+    for column, index in TRGM_INDEXES.items()
+]
+
+
+def create_search_indexes(bind):
+    """
+    Create the substring search index of the database backend, if it has one.
+
+    Postgres gets pg_trgm GIN indexes on lower(first_name) and lower(city).
+    SQLite gets an FTS5 trigram table over both columns, kept in sync with
+    csv_data by triggers.
+
+    Args:
+        bind (Connection): The connection to run the DDL on.
+    """
+    ddl = {"postgresql": POSTGRES_DDL, "sqlite": SQLITE_DDL}.get(bind.dialect.name, [])
+    for statement in ddl:
+        bind.execute(text(statement))
+
+
+def drop_search_indexes(bind):
+    """Drop the indexes created by create_search_indexes."""
+    if bind.dialect.name == "postgresql":
+        for index in TRGM_INDEXES.values():
+            bind.execute(text(f"DROP INDEX IF EXISTS {index}"))
+    elif bind.dialect.name == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            bind.execute(text(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}"))
+        bind.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+
+
+def detect_search_index(bind):
+    """
+    Find which substring search index the database has.
+
+    Args:
+        bind (Connection): A connection to the database.
+
+    Returns:
+        str: PG_TRGM, FTS5, or None if the indexes were not created.
+    """
+    inspector = inspect(bind)
+    if bind.dialect.name == "postgresql":
+        names = {index["name"] for index in inspector.get_indexes("csv_data")}
+        return PG_TRGM if set(TRGM_INDEXES.values()) <= names else None
+    if bind.dialect.name == "sqlite":
+        return FTS5 if inspector.has_table(FTS_TABLE) else None
+    return None
+
+
+def is_search_index_object(name, type_):
+    """Tell the objects autogenerate should leave alone, FTS5 shadow tables included."""
+    if type_ == "table":
+        return name.startswith((FTS_TABLE, fulltext.FTS_TABLE))
+    return type_ == "index" and name in (*TRGM_INDEXES.values(), fulltext.PG_INDEX)
+
+
+def _indexable(pattern):
+    # trigram indexes can only narrow a pattern holding three characters in a row
+    return any(len(run) >= 3 for run in literal_runs(pattern))
+
+
+def index_clause(kind, filters):
+    """
+    Build a condition narrowing ILIKE filters through a search index.
+
+    The condition selects a superset of the rows matching the filters, which
+    still have to be applied to get the exact results.
+
+    Args:
+        kind (str): PG_TRGM, FTS5 or None.
+        filters (dict): LIKE patterns by column name.
+
+    Returns:
+        ClauseElement: The condition, or None if the index cannot help.
+    """
+    filters = {c: p for c, p in filters.items() if c in INDEXED_COLUMNS and _indexable(p)}
+    if not kind or not filters:
+        return None
+
+    if kind == PG_TRGM:
+        # pg ILIKE lowers both sides, so this matches the same rows
+        conditions = [
+            func.lower(getattr(CSVData, column)).like(func.lower(pattern))
+            for column, pattern in filters.items()
+        ]
+        return and_(*conditions)
+
+    fts = table(FTS_TABLE, *[literal_column(c) for c in ("rowid",) + INDEXED_COLUMNS])
+    # the trigram tokenizer runs LIKE on the index, case-insensitively
+    matches = select(fts.c.rowid).where(*[fts.c[c].like(p) for c, p in filters.items()])
+    return CSVData.id.in_(matches)
@@ -0,0 +1,70 @@
+import re
+
+__all__ = ["contains_pattern", "compile_ilike", "literal_runs", "folder"]
+
+_ASCII_LOWER = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"
+)
+
+
+def _ascii_lower(value):
+    return value.translate(_ASCII_LOWER)
+
+
+def folder(dialect):
+    """
+    Get the case folding ILIKE applies on a database dialect.
+
+    SQLite only folds ASCII letters, Postgres folds all of them.
+
+    Args:
+        dialect (str): The SQLAlchemy dialect name.
+
+    Returns:
+        callable: A function lowering a string.
+    """
+    return _ascii_lower if dialect == "sqlite" else str.lower
+
+
+def contains_pattern(value):
+    """Build the ILIKE pattern matching a substring, as the search does."""
+    return f"%{value}%"
+
+
+def literal_runs(pattern):
+    """
+    Split a LIKE pattern into the literal strings between its wildcards.
+
+    Args:
+        pattern (str): A LIKE pattern, using % and _ wildcards.
+
+    Returns:
+        list: The non empty literal strings.
+    """
+    return [run for run in re.split(r"[%_]", pattern) if run]
+
+
+def compile_ilike(pattern, fold=str.lower):
+    """
+    Compile a LIKE pattern into a case-insensitive predicate.
+
+    Args:
+        pattern (str): A LIKE pattern, using % and _ wildcards.
+        fold (callable): The case folding of the database.
+
+    Returns:
+        callable: A function telling whether an already folded value matches.
+    """
+    pattern = fold(pattern)
+    runs = literal_runs(pattern)
+    # the search only builds %value% patterns, keep them a plain substring test
+    if pattern.startswith("%") and pattern.endswith("%") and len(runs) == 1:
+        needle = runs[0]
+        if pattern == f"%{needle}%":
+            return lambda value: value is not None and needle in value
+
+    regex = "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern
+    )
+    match = re.compile(regex, re.DOTALL).fullmatch
+    return lambda value: value is not None and match(value) is not None
@@ -0,0 +1,165 @@
+from sqlalchemy import and_, or_, select
+
+from app import db
+from app.encoders import RECORD_COLUMNS
+from app.models import CSVData
+
+from .indexes import FTS5, detect_search_index, index_clause
+from .patterns import compile_ilike, contains_pattern, folder
+
+__all__ = ["SQLEngine"]
+
+# rows fetched from the database cursor at a time
+YIELD_PER = 1000
+
+
+def _filters(name, city):
+    filters = {}
+    if name:
+        filters["first_name"] = contains_pattern(name)
+    if city:
+        filters["city"] = contains_pattern(city)
+    return filters
+
+
+class SQLEngine(object):
+    """
+    Searches with ILIKE filters run by the database.
+
+    When the search indexes of the database were created, the filters are
+    first narrowed through them: pg_trgm indexes on Postgres, the FTS5
+    trigram table on SQLite. The ILIKE filters are still applied to the
+    candidates, so the results are the same. The indexes are looked up on
+    the first search.
+    """
+
+    name = "sql"
+
+    def __init__(self):
+        self.index = None
+        self._detected = False
+
+    def detect_index(self):
+        if not self._detected:
+            self.index = detect_search_index(db.session.connection())
+            self._detected = True
+        return self.index
+
+    def _conditions(self, filters):
+        conditions = [getattr(CSVData, column).ilike(p) for column, p in filters.items()]
+        clause = index_clause(self.detect_index(), filters)
+        if clause is not None:
+            conditions.append(clause)
+        return conditions
+
+    def _select(self, conditions, use_index):
+        query = select(*[getattr(CSVData, column) for column in RECORD_COLUMNS])
+        if conditions is not None:
+            query = query.where(conditions)
+        if use_index and self.index == FTS5:
+            # keep the rowid order of a table scan
+            query = query.order_by(CSVData.id)
+        return query.execution_options(yield_per=YIELD_PER)
+
+    def rows(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Only the result columns are selected, and streamed from the cursor
+        YIELD_PER rows at a time, without building ORM instances.
+
+        Args:
+            name (str): The name to search for.
+            city (str): The city to search for.
+            quantity (int): The maximum number of results to return.
+
+        Returns:
+            list: The matching rows as tuples in RECORD_COLUMNS order.
+        """
+        filters = _filters(name, city)
+        conditions = self._conditions(filters)
+        query = self._select(
+            and_(*conditions) if conditions else None, len(conditions) > len(filters)
+        )
+        if quantity:
+            query = query.limit(quantity)
+
+        return [tuple(row) for row in db.session.execute(query)]
+
+    def batch_rows(self, queries):
+        """
+        Run several searches in one pass over csv_data.
+
+        The database returns the rows matching any of the searches, each row
+        is then added to the results of every search it matches, until they
+        all have their quantity.
+
+        Args:
+            queries (list): (name, city, quantity) tuples.
+
+        Returns:
+            list: The matching rows of each search, as tuples in
+            RECORD_COLUMNS order.
+        """
+        if not queries:
+            return []
+
+        fold = folder(db.engine.dialect.name)
+        searches, query = self._batch_select(queries, fold)
+        # searches still taking rows, until they have their quantity
+        pending = list(searches)
+        result = db.session.execute(query)
+        try:
+            for row in result:
+                if not pending:
+                    break
+                folded = {}
+                for search in list(pending):
+                    checks, quantity, rows = search
+                    for i, check in checks:
+                        if i not in folded:
+                            folded[i] = fold(row[i]) if row[i] is not None else None
+                        if not check(folded[i]):
+                            break
+                    else:
+                        rows.append(tuple(row))
+                        if quantity is not None and len(rows) >= quantity:
+                            pending.remove(search)
+        finally:
+            result.close()
+        return [rows for _, _, rows in searches]
+
+    def _batch_select(self, queries, fold):
+        """
+        Build the query of batch_rows() and the checks of each search.
+
+        Returns:
+            tuple: The (checks, quantity, rows) of each search, the checks
+            being (column index, pattern test) pairs and the quantity None
+            when not limited, like 0, and the query of the rows matching any
+            of the searches.
+        """
+        searches, conditions, use_index = [], [], False
+        for name, city, quantity in queries:
+            filters = _filters(name, city)
+            checks = [
+                (RECORD_COLUMNS.index(column), compile_ilike(pattern, fold))
+                for column, pattern in filters.items()
+            ]
+            searches.append((checks, quantity or None, []))
+            clauses = self._conditions(filters)
+            use_index = use_index or len(clauses) > len(filters)
+            conditions.append(and_(*clauses) if clauses else None)
+
+        if any(condition is None for condition in conditions):
+            return searches, self._select(None, False)
+        return searches, self._select(or_(*conditions), use_index)
+
+    def search(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Returns:
+            list: The matching rows as dictionaries.
+        """
+        return [dict(zip(RECORD_COLUMNS, row)) for row in self.rows(name, city, quantity)]
@@ -0,0 +1,207 @@
+import threading
+from array import array
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.encoders import RECORD_COLUMNS
+from app.models import CSVData
+
+from .cache import get_rewrite_generation
+from .patterns import compile_ilike, contains_pattern, folder, literal_runs
+
+__all__ = ["TrigramIndex", "TrigramEngine"]
+
+FETCH_CHUNK_SIZE = 500
+LOAD_BATCH_SIZE = 10000
+
+
+def trigrams(value):
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex(object):
+    """Inverted trigram index over the case folded values of one column."""
+
+    def __init__(self):
+        self.values = {}
+        self.postings = defaultdict(lambda: array("i"))
+
+    def add(self, row_id, value):
+        self.values[row_id] = value
+        if value is not None:
+            for gram in trigrams(value):
+                self.postings[gram].append(row_id)
+
+    def candidates(self, pattern):
+        """
+        Get the rows that may match a folded LIKE pattern.
+
+        Args:
+            pattern (str): A case folded LIKE pattern.
+
+        Returns:
+            set: The candidate row ids, or None if the pattern has no trigram
+            to narrow them down.
+        """
+        grams = set()
+        for run in literal_runs(pattern):
+            grams.update(trigrams(run))
+        if not grams:
+            return None
+
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(ids)
+        return result
+
+
+class TrigramEngine(object):
+    """
+    Searches an in-memory trigram index of first_name and city.
+
+    The index is built from CSVData on first use in each worker and narrows
+    the candidate rows, which are then checked with the exact ILIKE
+    semantics of the database. The index is stamped with the row count, the
+    highest id and the rewrite generation of the dataset: when rows were
+    updated or deleted, e.g. by sync_csv_data(), it is rebuilt, otherwise
+    rows added to the table are indexed incrementally before each search.
+    """
+
+    name = "trigram"
+    columns = ("first_name", "city")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fold = None
+        self._reset()
+
+    def _reset(self):
+        self.indexes = {column: TrigramIndex() for column in self.columns}
+        self.ids = array("i")
+        self.count = 0
+        self.max_id = 0
+        self.generation = None
+
+    def refresh(self):
+        """Index the rows added since the last refresh, or rebuild if needed."""
+        # read first, a change made while indexing moves it again
+        generation = get_rewrite_generation(current_app.redis)
+        count, max_id = db.session.query(
+            func.count(CSVData.id), func.max(CSVData.id)
+        ).one()
+        max_id = max_id or 0
+
+        with self._lock:
+            if (count, max_id, generation) == (self.count, self.max_id, self.generation):
+                return
+            if self._fold is None:
+                self._fold = folder(db.engine.dialect.name)
+            # rows may have been updated or deleted, start over
+            if max_id < self.max_id or generation != self.generation:
+                self._reset()
+            self._load(self.max_id)
+            # rows were deleted below the last indexed id, start over
+            if self.count != count:
+                self._reset()
+                self._load(0)
+            self.generation = generation
+
+    def _load(self, since_id):
+        query = (
+            db.session.query(CSVData.id, *(getattr(CSVData, c) for c in self.columns))
+            .filter(CSVData.id > since_id)
+            .order_by(CSVData.id)
+            .yield_per(LOAD_BATCH_SIZE)
+        )
+        fold = self._fold
+        for row_id, *values in query:
+            for column, value in zip(self.columns, values):
+                self.indexes[column].add(
+                    row_id, fold(value) if value is not None else None
+                )
+            self.ids.append(row_id)
+            self.max_id = row_id
+        self.count = len(self.ids)
+
+    def match(self, filters, quantity):
+        """
+        Get the ids of the rows matching ILIKE filters.
+
+        Args:
+            filters (dict): LIKE patterns by column name.
+            quantity (int): The maximum number of ids to return.
+
+        Returns:
+            list: The matching row ids, in id order.
+        """
+        with self._lock:
+            if not filters:
+                ids = self.ids
+            else:
+                candidates = None
+                checks = []
+                for column, pattern in filters.items():
+                    pattern = self._fold(pattern)
+                    index = self.indexes[column]
+                    found = index.candidates(pattern)
+                    if found is not None:
+                        candidates = found if candidates is None else candidates & found
+                    checks.append((index.values, compile_ilike(pattern, lambda v: v)))
+
+                ids = sorted(candidates) if candidates is not None else self.ids
+                ids = (
+                    row_id
+                    for row_id in ids
+                    if all(check(values[row_id]) for values, check in checks)
+                )
+
+            result = []
+            for row_id in ids:
+                if quantity and len(result) >= quantity:
+                    break
+                result.append(row_id)
+            return result
+
+    def rows(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Args:
+            name (str): The name to search for.
+            city (str): The city to search for.
+            quantity (int): The maximum number of results to return.
+
+        Returns:
+            list: The matching rows as tuples in RECORD_COLUMNS order.
+        """
+        self.refresh()
+
+        filters = {}
+        if name:
+            filters["first_name"] = contains_pattern(name)
+        if city:
+            filters["city"] = contains_pattern(city)
+        ids = self.match(filters, quantity)
+
+        columns = [getattr(CSVData, column) for column in RECORD_COLUMNS]
+        results = []
+        for i in range(0, len(ids), FETCH_CHUNK_SIZE):
+            chunk = ids[i : i + FETCH_CHUNK_SIZE]
+            query = select(*columns).where(CSVData.id.in_(chunk)).order_by(CSVData.id)
+            results.extend(tuple(row) for row in db.session.execute(query))
+        return results
+
+    def search(self, name, city, quantity):
+        """
+        Search CSV data by substrings of the first name and city.
+
+        Returns:
+            list: The matching rows as dictionaries.
+        """
+        return [dict(zip(RECORD_COLUMNS, row)) for row in self.rows(name, city, quantity)]
@@ -1,7 +1,36 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields, validate, validates_schema
 
 
 class SearchCSVSerializer(Schema):
     name = fields.String()
     city = fields.String()
     quantity = fields.Integer()
+    q = fields.String(validate=validate.Length(min=1))
+
+    @validates_schema
+    def validate_fulltext(self, data, **kwargs):
+        if "q" in data and ("name" in data or "city" in data):
+            raise ValidationError("q cannot be combined with name or city.", "q")
+
+
+class SearchCSVBatchSerializer(SearchCSVSerializer):
+    """A search of a batch, full-text searches (q) are ranked one at a time."""
+
+    @validates_schema
+    def validate_batch(self, data, **kwargs):
+        if "q" in data:
+            raise ValidationError("q cannot be used in a batch.", "q")
+
+
+class HashBatchSerializer(Schema):
+    hashes = fields.List(
+        fields.String(validate=validate.Length(min=1, max=64)),
+        required=True,
+        validate=validate.Length(min=1),
+    )
+
+
+class ResultPageSerializer(Schema):
+    cursor = fields.Integer(validate=validate.Range(min=0))
+    page_size = fields.Integer(validate=validate.Range(min=1, max=10000))
+    format = fields.String(validate=validate.OneOf(["json", "ndjson", "array"]))
@@ -0,0 +1,193 @@
+import json
+import time
+import weakref
+
+from flask import current_app, has_app_context
+
+from .logger import get_log_context
+from .metrics import on_statement
+
+__all__ = ["SlowQueryLog", "EXPLAIN_PREFIXES", "explain"]
+
+# statements explained, the others are only logged
+EXPLAINED = ("SELECT", "WITH")
+# how to get the plan of a statement, by dialect
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN ", "mysql": "EXPLAIN "}
+# characters of the statement written to the app log
+LOGGED_STATEMENT_LENGTH = 200
+
+# slow query logs of the process, and the lowest of their thresholds, in
+# seconds, so faster statements are let through with a single comparison
+_logs = weakref.WeakSet()
+_floor = float("inf")
+
+
+def _update_floor():
+    global _floor
+    _floor = min((log.threshold for log in _logs if log.threshold), default=float("inf"))
+
+
+def _current_log():
+    if has_app_context():
+        return getattr(current_app, "slow_queries", None)
+    return None
+
+
+def _json_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def _json_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: _json_value(value) for key, value in parameters.items()}
+    return [_json_value(value) for value in parameters]
+
+
+def _format_sqlite_plan(rows):
+    # rows of (id, parent, notused, detail), indented under their parent
+    depths = {0: -1}
+    lines = []
+    for id, parent, _, detail in rows:
+        depths[id] = depths.get(parent, -1) + 1
+        lines.append("  " * depths[id] + str(detail))
+    return lines
+
+
+def explain(connection, statement, parameters):
+    """
+    Get the plan of a statement with the EXPLAIN of its dialect.
+
+    The plan is read on a cursor of the DBAPI connection the statement ran
+    on, so it is not seen by the engine events, nor timed or logged itself.
+
+    Args:
+        connection (Connection): The connection the statement ran on.
+        statement (str): The statement, as sent to the DBAPI.
+        parameters (tuple or dict): Its DBAPI parameters.
+
+    Returns:
+        list: The lines of the plan.
+    """
+    dialect = connection.dialect.name
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(EXPLAIN_PREFIXES[dialect] + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if dialect == "sqlite":
+        return _format_sqlite_plan(rows)
+    return [" | ".join(str(value) for value in row) for row in rows]
+
+
+class SlowQueryLog(object):
+    """
+    Log of the SQL statements slower than ``SLOW_QUERY_THRESHOLD_MS``.
+
+    Statements are timed once for the metrics and this log, by engine
+    events around their execution on the cursor: with SQLite, a SELECT is
+    only timed up to its first row, drivers buffering the results, like
+    psycopg2, include fetching them. A slow statement is logged, and
+    recorded with its parameters, the rows it affected or returned when the
+    driver tells, its plan for SELECT statements and the request or
+    transaction it ran for, in a Redis list of the last
+    ``SLOW_QUERY_LOG_SIZE`` ones.
+    """
+
+    key = "slow-queries"
+
+    def __init__(self, app):
+        self.app = app
+        self._threshold = None
+        _logs.add(self)
+        self.threshold = app.config["SLOW_QUERY_THRESHOLD_MS"] / 1000
+
+    @property
+    def threshold(self):
+        """The duration, in seconds, a statement is logged from, 0 to log none."""
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, seconds):
+        self._threshold = seconds
+        _update_floor()
+
+    @property
+    def redis(self):
+        return self.app.redis
+
+    def record(self, connection, statement, parameters, elapsed, rowcount, executemany):
+        """
+        Log a slow statement and add it to the Redis list.
+
+        Args:
+            connection (Connection): The connection the statement ran on.
+            statement (str): The statement, as sent to the DBAPI.
+            parameters (tuple, dict or list): Its DBAPI parameters, a list of
+                them if it ran with executemany().
+            elapsed (float): Its execution time, in seconds.
+            rowcount (int): The rows of the cursor, -1 when unknown.
+            executemany (bool): Whether it ran with executemany().
+
+        Returns:
+            dict: The entry added.
+        """
+        entry = {
+            "at": time.time(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "dialect": connection.dialect.name,
+            "statement": statement,
+            "rows": rowcount if rowcount >= 0 else None,
+            **get_log_context(),
+        }
+        if executemany:
+            entry["executemany"] = len(parameters)
+        else:
+            entry["parameters"] = _json_parameters(parameters)
+            operation = statement.lstrip()[:6].upper()
+            if operation.startswith(EXPLAINED) and entry["dialect"] in EXPLAIN_PREFIXES:
+                try:
+                    entry["plan"] = explain(connection, statement, parameters)
+                except Exception as e:
+                    entry["plan_error"] = str(e)
+
+        self.app.logger.warning(
+            f"[Slow Query] {entry['duration_ms']:.1f} ms: "
+            f"{' '.join(statement.split())[:LOGGED_STATEMENT_LENGTH]}"
+        )
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lpush(self.key, json.dumps(entry))
+            pipe.ltrim(self.key, 0, self.app.config["SLOW_QUERY_LOG_SIZE"] - 1)
+            pipe.execute()
+        except Exception as e:
+            self.app.logger.error(f"[Slow Query] Error storing the entry: {e}")
+        return entry
+
+    def entries(self, limit=None):
+        """
+        Get the slow statements recorded, the latest first.
+
+        Args:
+            limit (int): The number of entries, all of them by default.
+
+        Returns:
+            list: The entries, as dictionaries.
+        """
+        end = -1 if limit is None else limit - 1
+        return [json.loads(entry) for entry in self.redis.lrange(self.key, 0, end)]
+
+    def clear(self):
+        """Forget the slow statements recorded."""
+        self.redis.delete(self.key)
+
+
+@on_statement
+def _check_statement(conn, cursor, statement, parameters, executemany, elapsed):
+    if elapsed < _floor:
+        return
+    log = _current_log()
+    if log is not None and log.threshold and elapsed >= log.threshold:
+        log.record(conn, statement, parameters, elapsed, cursor.rowcount, executemany)
@@ -1,25 +1,48 @@
 import urllib.parse
 import urllib.request
+
 from flask import current_app as app
-from json import dumps
 
-from app.models import CSVData
+from app.search import get_engine
+from app.search.fulltext import FullTextEngine
 
 
 def send_results_to_redis(results, transaction_id):
     """
     Sending CSV search results to Redis.
 
+    Results are written directly with the shared Redis client, unless
+    RESULTS_BACKEND is "http", in which case they are sent to the
+    REDIS_ENDPOINT of the app for compatibility.
+
     Args:
-        results (list): A list of dictionaries containing search results.
+        results (list): The search results, rows in RECORD_COLUMNS order or
+            dictionaries.
         transaction_id (str): The transaction ID.
     """
     try:
-        url = f"{app.config.get('REDIS_ENDPOINT')}{urllib.parse.quote_plus(transaction_id)}"
-        req = urllib.request.Request(url, data=dumps(results).encode('utf-8'), headers={'Content-Type': 'application/json'}, method='PUT')
-        urllib.request.urlopen(req)
+        if app.config.get("RESULTS_BACKEND") == "http":
+            payload = app.results.json_encoder.dumps(results)
+            send_results_over_http(payload, transaction_id)
+        else:
+            app.results.write(transaction_id, results)
     except Exception as e:
         app.logger.error(f"Error sending results to Redis: {e}")
+        raise
+
+
+def send_results_over_http(payload, transaction_id):
+    """
+    Sending serialized CSV search results to the REDIS_ENDPOINT.
+
+    Args:
+        payload (bytes): The JSON encoded search results.
+        transaction_id (str): The transaction ID.
+    """
+    url = f"{app.config.get('REDIS_ENDPOINT')}{urllib.parse.quote_plus(transaction_id)}"
+    req = urllib.request.Request(url, data=payload, headers={'Content-Type': 'application/json'}, method='PUT')
+    urllib.request.urlopen(req)
+
 
 async def process_search_csv(name, city, quantity, transaction_id):
     """
@@ -33,20 +56,65 @@ async def process_search_csv(name, city, quantity, transaction_id):
     """
     log_prefix = "[CSV Search][Async Task]"
     try:
-        query = CSVData.query
+        engine = get_engine(app)
+        rows = app.search_cache.search(engine, name, city, quantity)
+        send_results_to_redis(rows, transaction_id)
+
+        app.logger.info(f"{log_prefix} Listing {len(rows)} result(s).")
+
+    except Exception as e:
+        app.logger.error(f"Error: {e}")
+        raise
 
-        if name:
-            query = query.filter(CSVData.first_name.ilike(f"%{name}%"))
-        if city:
-            query = query.filter(CSVData.city.ilike(f"%{city}%"))
 
-        if quantity:
-            query = query.limit(quantity)
+async def process_search_csv_batch(searches):
+    """
+    Asynchronous processing of several CSV searches in one pass over the data.
 
-        results = [row.to_dict() for row in query.all()]
-        send_results_to_redis(results, transaction_id)
+    Args:
+        searches (list): Dictionaries with the name, city, quantity and
+            transaction_id of each search.
+    """
+    log_prefix = "[CSV Search][Async Task]"
+    try:
+        engine = get_engine(app)
+        queries = [(s["name"], s["city"], s["quantity"]) for s in searches]
+        results = app.search_cache.search_many(engine, queries)
+        results_by_id = {s["transaction_id"]: rows for s, rows in zip(searches, results)}
+
+        if app.config.get("RESULTS_BACKEND") == "http":
+            for transaction_id, rows in results_by_id.items():
+                send_results_to_redis(rows, transaction_id)
+        else:
+            app.results.write_many(results_by_id)
+
+        app.logger.info(
+            f"{log_prefix} Listing {sum(map(len, results))} result(s) "
+            f"for {len(searches)} searches."
+        )
+
+    except Exception as e:
+        app.logger.error(f"Error: {e}")
+        raise
+
+
+async def process_fulltext_search(q, quantity, transaction_id):
+    """
+    Asynchronous ranked full-text search processing.
+
+    Args:
+        q (str): The words to search for in any text column.
+        quantity (int): The number of results to return, the best first.
+        transaction_id (str): The transaction ID.
+    """
+    log_prefix = "[CSV Search][Async Task]"
+    try:
+        quantity = quantity or app.config["FULLTEXT_DEFAULT_QUANTITY"]
+        rows = FullTextEngine().rows(q, quantity)
+        send_results_to_redis(rows, transaction_id)
 
-        app.logger.info(f"{log_prefix} Listing {len(results)} result(s).")
+        app.logger.info(f"{log_prefix} Listing {len(rows)} ranked result(s).")
 
     except Exception as e:
         app.logger.error(f"Error: {e}")
+        raise
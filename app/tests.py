@@ -1,23 +1,84 @@
 import asyncio
+import csv
+import gc
+import importlib.util
+import io
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import weakref
+import zlib
 from json import dumps
 from unittest.mock import ANY, patch
 
+import fakeredis
+import redis
+import sqlalchemy
+from aiohttp.test_utils import AioHTTPTestCase
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from aioapp import make_aiohttp_app
 from app import create_app, db
+from app.aio import NATIVE_HANDLERS
+from app.codecs import accepts_encoding, get_codec
 from app.config import Config
-from app.helpers import load_csv_data
-from app.models import Table
+from app.encoders import RECORD_COLUMNS, CompatEncoder, get_encoder, load_records
+from app.hashes import HashStore
+from app.helpers import (
+    load_csv_data,
+    load_csv_data_parallel,
+    parse_csv_range,
+    read_csv_chunks,
+    split_csv_ranges,
+    sync_csv_data,
+)
+from app.logger import LogFormatter, QueueLogHandler, get_handler
+from app.lookups import LRUCache, ModelCache
+from app.metrics import InstrumentedRedis, Metrics
+from app.models import CSVData, Table
+from app.notifications import Subscribers
+from app.resources import (
+    InstrumentedConnectionPool,
+    InstrumentedQueuePool,
+    engine_options,
+)
+from app.results import ResultStore
+from app.retention import ResultTooLarge
+from app.search.cache import get_generation
+from app.search.columnar import ColumnarEngine
+from app.search.fulltext import FullTextEngine, create_fulltext_index
+from app.search.indexes import (
+    FTS5,
+    create_search_indexes,
+    drop_search_indexes,
+    index_clause,
+)
+from app.search.sql import SQLEngine
+from app.search.trigram import TrigramEngine
 from app.tasks import process_search_csv
+from benchmarks.startup import by_package, parse_importtime
+from benchmarks.stats import compare, summarize
 
 
 class BaseTestCase(unittest.TestCase):
     def setUp(self):
         self.app = create_app(TestConfig)
+        self.app.redis = fakeredis.FakeStrictRedis()
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
 
     def tearDown(self):
+        self.app.jobs.stop()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
@@ -26,6 +87,9 @@ class BaseTestCase(unittest.TestCase):
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
+    JOB_WORKERS = 0
+    # opted in, to cover the compressed pages
+    RESULT_CODEC = "gzip"
 
 
 class ModelsTest(BaseTestCase):
@@ -37,6 +101,159 @@ class ModelsTest(BaseTestCase):
         self.assertEqual(t.hash, "abc")
 
 
+class HashStoreTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["HASH_BATCH_SIZE"] = 3
+        self.client = self.app.test_client()
+
+    def test_insert_many_reports_each_hash(self):
+        db.session.add(Table(hash="old"))
+        db.session.commit()
+        hashes = ["a", "b", "old", "a", "c", "d", "e", "b"]
+        results = self.app.hashes.insert_many(hashes)
+        self.assertEqual(results, [True, True, False, False, True, True, True, False])
+        self.assertEqual(self.app.hashes.insert_many(["e", "f"]), [False, True])
+        stored = db.session.execute(select(Table.hash)).scalars().all()
+        self.assertEqual(sorted(stored), ["a", "b", "c", "d", "e", "f", "old"])
+
+    def test_filter_skips_known_hashes_and_rebuilds(self):
+        bloom = self.app.hashes.filter
+        self.app.hashes.insert_many(["a", "b"])
+        self.assertEqual(bloom.contains_many(["a", "b", "zz"]), [True, True, False])
+
+        self.app.redis.flushall()
+        db.session.add(Table(hash="c"))
+        db.session.commit()
+        self.assertEqual(self.app.hashes.rebuild_filter(), 3)
+        self.assertEqual(bloom.contains_many(["a", "b", "c", "zz"]), [True, True, True, False])
+
+        with patch.object(HashStore, "_insert", wraps=self.app.hashes._insert) as insert:
+            self.assertEqual(self.app.hashes.insert_many(["a", "c"]), [False, False])
+        insert.assert_not_called()
+
+    def test_hash_endpoints(self):
+        response = self.client.post("/db/hashes", json={"hashes": ["a", "b", "a"]})
+        self.assertEqual(response.get_json(), {"result": [True, True, False], "inserted": 2})
+        self.assertEqual(self.client.put("/db/a").get_json(), {"result": False})
+        self.assertEqual(self.client.put("/db/c").get_json(), {"result": True})
+
+        for payload in ({}, {"hashes": []}, {"hashes": ["x" * 65]}, ["a"]):
+            response = self.client.post("/db/hashes", json=payload)
+            self.assertEqual(response.status_code, 400)
+
+
+class ModelCacheTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all([Table(id=1, hash="abc"), Table(id=2, hash="def")])
+        db.session.commit()
+        self.cache = self.app.hash_cache
+        self.client = self.app.test_client()
+
+    def test_lookups_fill_each_tier(self):
+        with patch.object(ModelCache, "_load", wraps=self.cache._load) as load:
+            self.assertEqual(self.cache.get(1), {"hash": "abc"})
+            self.assertEqual(self.cache.get(1), {"hash": "abc"})
+            self.cache.local.clear()
+            self.assertEqual(
+                self.cache.get_many([1, 2, 3]), {1: {"hash": "abc"}, 2: {"hash": "def"}, 3: None}
+            )
+            self.assertIsNone(self.cache.get(3))
+        self.assertEqual([c.args[0] for c in load.call_args_list], [[1], [2, 3]])
+        self.assertGreater(self.app.redis.ttl(self.cache.key(3)), 0)
+        stats = self.cache.stats()
+        self.assertEqual(
+            {k: stats[k] for k in ("local", "redis", "negative", "database")},
+            {"local": 1, "redis": 1, "negative": 1, "database": 3},
+        )
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_writes_replace_negative_entries(self):
+        self.assertEqual(self.client.get("/db/3").get_json(), {"hash": ""})
+        self.client.put("/db/ghi")
+        self.assertEqual(self.client.get("/db/3").get_json(), {"hash": "ghi"})
+        self.client.post("/db/hashes", json={"hashes": ["jkl", "abc"]})
+        self.assertEqual(self.cache.local.get(4), {"hash": "jkl"})
+        self.assertEqual(self.client.get("/db/cache/stats").get_json()["negative"], 0)
+
+        self.cache.invalidate([4])
+        Table.query.filter_by(id=4).delete()
+        db.session.commit()
+        self.assertIsNone(self.cache.get(4))
+
+    def test_local_lru_evicts_least_recently_used(self):
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+
+class LoggingTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stream = io.StringIO()
+        self.handler = get_handler("json")
+        self.handler.setStream(self.stream)
+        self.app.logger.addHandler(self.handler)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.logger.removeHandler(self.handler)
+        super().tearDown()
+
+    def records(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_lines_carry_request_and_transaction_ids(self):
+        response = self.client.get("/", headers={"X-Request-ID": "req-1"})
+        self.assertEqual(response.headers["X-Request-ID"], "req-1")
+        access = self.records()[-1]
+        self.assertIn("===>", access["message"])
+        self.assertEqual(access["request_id"], "req-1")
+        self.assertEqual(access["level"], "INFO")
+
+        with patch("app.tasks.process_search_csv", side_effect=ValueError("boom")):
+            transaction_id = self.client.get("/search-csv?name=glen").get_json()["transaction_id"]
+            self.app.jobs.work(burst=True)
+        failure = self.records()[-1]
+        self.assertEqual(failure["transaction_id"], transaction_id)
+        self.assertNotIn("request_id", failure)
+
+    def test_access_lines_are_sampled(self):
+        self.app.config["LOG_ACCESS_SAMPLE_RATE"] = 0
+        self.client.get("/")
+        self.client.get("/error/500")
+        messages = [record["message"] for record in self.records()]
+        access = [m for m in messages if "===>" in m]
+        self.assertEqual(len(access), 1)
+        self.assertIn("500", access[0])
+
+    def test_queue_handler_drops_records_when_full(self):
+        records = queue.SimpleQueue()
+        target = logging.handlers.QueueHandler(records)
+        handler = QueueLogHandler(target, 2)
+        handler.listener.stop()
+        logger = logging.getLogger("app.tests.queue")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for i in range(5):
+                logger.warning("record %d", i)
+            self.assertEqual(handler.dropped, 3)
+            handler.listener.start()
+            logger.warning("after")
+            handler.close()
+        finally:
+            logger.removeHandler(handler)
+        messages = [records.get().getMessage() for _ in range(records.qsize())]
+        self.assertEqual(messages[:2], ["record 0", "record 1"])
+        self.assertIn("3 log record(s) dropped", messages[2])
+        self.assertEqual(messages[3], "after")
+
+
 class CSVSearchTest(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -81,87 +298,90 @@ class CSVSearchTest(BaseTestCase):
         city = ""
         quantity = ""
         results_json = dumps(self.expected_data_csv)
-        with patch("urllib.request.urlopen"), patch(
-            "urllib.request.Request"
-        ) as mock_request:
-            asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
-            mock_request.assert_called_once_with(
-                self.expected_url,
-                data=results_json.encode("utf-8"),
-                headers={"Content-Type": "application/json"},
-                method="PUT",
-            )
+        asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+        self.assertEqual(self.app.results.read("transaction_id"), results_json)
 
     def test_process_search_csv_filtering_by_city(self):
         name = ""
         city = "Lanthenay"
         quantity = ""
         results_json = dumps([self.expected_data_csv[0]])
-        with patch("urllib.request.urlopen"), patch(
-            "urllib.request.Request"
-        ) as mock_request:
-            asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
-            mock_request.assert_called_once_with(
-                self.expected_url,
-                data=results_json.encode("utf-8"),
-                headers={"Content-Type": "application/json"},
-                method="PUT",
-            )
+        asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+        self.assertEqual(self.app.results.read("transaction_id"), results_json)
 
     def test_process_search_csv_filtering_by_city_and_name(self):
         name = "glen"
         city = "he"
         quantity = ""
         results_json = dumps([self.expected_data_csv[0], self.expected_data_csv[1]])
-        with patch("urllib.request.urlopen"), patch(
-            "urllib.request.Request"
-        ) as mock_request:
-            asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
-            mock_request.assert_called_once_with(
-                self.expected_url,
-                data=results_json.encode("utf-8"),
-                headers={"Content-Type": "application/json"},
-                method="PUT",
-            )
+        asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+        self.assertEqual(self.app.results.read("transaction_id"), results_json)
 
     def test_process_search_csv_filtering_by_city_and_name_and_quantity(self):
         name = "glen"
         city = "he"
         quantity = 1
         results_json = dumps([self.expected_data_csv[0]])
-        with patch("urllib.request.urlopen"), patch(
-            "urllib.request.Request"
-        ) as mock_request:
-            asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
-            mock_request.assert_called_once_with(
-                self.expected_url,
-                data=results_json.encode("utf-8"),
-                headers={"Content-Type": "application/json"},
-                method="PUT",
-            )
+        asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+        self.assertEqual(self.app.results.read("transaction_id"), results_json)
 
     def test_process_search_csv_no_results_found(self):
         name = "glen"
         city = "not_exists"
         quantity = 1
         results_json = dumps([])
+        asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+        self.assertEqual(self.app.results.read("transaction_id"), results_json)
+
+    def test_process_search_csv_http_compatibility_mode(self):
+        self.app.config["RESULTS_BACKEND"] = "http"
+        results_json = dumps([self.expected_data_csv[0]])
         with patch("urllib.request.urlopen"), patch(
             "urllib.request.Request"
         ) as mock_request:
-            asyncio.run(process_search_csv(name, city, quantity, "transaction_id"))
+            asyncio.run(process_search_csv("", "Lanthenay", "", "transaction_id"))
             mock_request.assert_called_once_with(
                 self.expected_url,
                 data=results_json.encode("utf-8"),
                 headers={"Content-Type": "application/json"},
                 method="PUT",
             )
+        self.assertIsNone(self.app.results.read("transaction_id"))
 
-    @patch("app.main.routes.process_search_csv")
+    def test_process_search_csv_results_expire(self):
+        asyncio.run(process_search_csv("glen", "", "", "transaction_id"))
+        ttl = self.app.redis.ttl("transaction_id")
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, self.app.config["RESULT_TTL"])
+
+    def test_result_store_retries_redis_errors(self):
+        pipeline = self.app.redis.pipeline
+        calls = []
+
+        def flaky_pipeline(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise redis.ConnectionError("connection reset")
+            return pipeline(*args, **kwargs)
+
+        self.app.config["RESULT_WRITE_BACKOFF"] = 0
+        with patch.object(self.app.redis, "pipeline", flaky_pipeline):
+            self.app.results.write("transaction_id", self.expected_data_csv)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(
+            self.app.results.read("transaction_id"), dumps(self.expected_data_csv)
+        )
+
+    @patch("app.tasks.process_search_csv")
     def test_search_csv_should_return_202(self, mock_process_search_csv):
         response = self.app.test_client().get("/search-csv?name=glen")
         self.assertEqual(response.status_code, 202)
         self.assertEqual(response.get_json()["message"], "Search request received")
-        mock_process_search_csv.assert_called_once_with("glen", "", "", ANY)
+        mock_process_search_csv.assert_not_called()
+        self.app.jobs.work(burst=True)
+        mock_process_search_csv.assert_called_once_with(
+            name="glen", city="", quantity="", transaction_id=ANY
+        )
 
     @patch("app.main.routes.process_search_csv")
     def test_search_csv_should_return_400(self, mock_process_search_csv):
@@ -169,3 +389,1315 @@ class CSVSearchTest(BaseTestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.get_json()["message"], "{'not_exists': ['Unknown field.']}")
         mock_process_search_csv.assert_not_called()
+        self.assertEqual(self.app.jobs.work(burst=True), 0)
+
+
+class JobQueueTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+
+    def search(self, query):
+        response = self.client.get(f"/search-csv?{query}")
+        self.assertEqual(response.status_code, 202)
+        return response.get_json()["transaction_id"]
+
+    def status(self, transaction_id):
+        return self.client.get(f"/search-csv/{transaction_id}/status")
+
+    @patch("app.tasks.process_search_csv")
+    def test_status_goes_from_queued_to_done(self, mock_process_search_csv):
+        transaction_id = self.search("name=glen")
+        status = self.status(transaction_id).get_json()
+        self.assertEqual(status["status"], "queued")
+        self.assertIsNone(status["run_ms"])
+
+        self.assertEqual(self.app.jobs.work(burst=True), 1)
+        status = self.status(transaction_id).get_json()
+        self.assertEqual(status["status"], "done")
+        self.assertGreaterEqual(status["run_ms"], 0)
+        self.assertGreaterEqual(status["queued_ms"], 0)
+
+    @patch("app.tasks.process_search_csv", side_effect=ValueError("boom"))
+    def test_status_reports_failed_job(self, mock_process_search_csv):
+        transaction_id = self.search("city=paris")
+        self.app.jobs.work(burst=True)
+        status = self.status(transaction_id).get_json()
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["error"], "boom")
+
+    def test_status_unknown_transaction_should_return_404(self):
+        self.assertEqual(self.status("not_exists").status_code, 404)
+
+    @patch("app.tasks.process_search_csv")
+    def test_thread_pool_runs_queued_jobs(self, mock_process_search_csv):
+        self.app.config["JOB_WORKERS"] = 2
+        transaction_id = self.search("name=glen")
+        deadline = time.time() + 5
+        while self.app.jobs.status(transaction_id)["status"] != "done":
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        mock_process_search_csv.assert_called_once_with(
+            name="glen", city="", quantity="", transaction_id=transaction_id
+        )
+
+
+class NotificationsTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+
+    @patch("app.tasks.process_search_csv_batch")
+    def test_finished_job_is_published_for_its_aliases(self, mock_process_search_csv_batch):
+        pubsub = self.app.redis.pubsub()
+        pubsub.subscribe(self.app.notifications.channel)
+        self.assertEqual(pubsub.get_message(timeout=1)["type"], "subscribe")
+        transaction_ids = self.client.post(
+            "/search-csv/batch", json=[{"name": "glen"}, {"city": "paris"}]
+        ).get_json()["transaction_ids"]
+        self.app.jobs.work(burst=True)
+
+        data = pubsub.get_message(timeout=1)["data"]
+        message = json.loads(data)
+        self.assertEqual(message["status"], "done")
+        self.assertEqual(message["transaction_ids"][1:], transaction_ids)
+
+        subscribers, notifications = Subscribers(), []
+        for transaction_id in transaction_ids:
+            subscribers.add(transaction_id, notifications.append)
+        self.assertEqual(subscribers.dispatch(data), 2)
+        self.assertEqual(
+            sorted(notification["transaction_id"] for notification in notifications),
+            sorted(transaction_ids),
+        )
+        for transaction_id in transaction_ids:
+            subscribers.discard(transaction_id, notifications.append)
+        self.assertEqual(len(subscribers), 0)
+
+    def test_events_are_only_served_by_the_aiohttp_app(self):
+        transaction_id = self.client.get("/search-csv?name=glen").get_json()["transaction_id"]
+        self.assertEqual(self.client.get(f"/search-csv/{transaction_id}/events").status_code, 404)
+
+
+class TrigramEngineTest(BaseTestCase):
+    queries = [
+        ("glen", "", ""),
+        ("", "Lanthenay", ""),
+        ("glen", "he", ""),
+        ("glen", "he", 1),
+        ("GLEN", "", 2),
+        ("an", "", ""),
+        ("a", "o", 5),
+        ("e_n", "", ""),
+        ("gl%n", "", ""),
+        ("", "živ", ""),
+        ("", "Živ", ""),
+        ("", "not_exists", ""),
+        ("", "", 10),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.sql = SQLEngine()
+        self.trigram = TrigramEngine()
+
+    def test_results_match_sql_engine(self):
+        for name, city, quantity in self.queries:
+            with self.subTest(name=name, city=city, quantity=quantity):
+                self.assertEqual(
+                    self.trigram.search(name, city, quantity),
+                    self.sql.search(name, city, quantity),
+                )
+
+    def test_index_refreshes_incrementally(self):
+        self.assertEqual(len(self.trigram.search("glen", "", "")), 3)
+        indexed = self.trigram.indexes["first_name"]
+        db.session.add(CSVData(user_id=1001, first_name="Glenda", city="Oslo"))
+        db.session.commit()
+
+        results = self.trigram.search("glen", "", "")
+        self.assertIs(self.trigram.indexes["first_name"], indexed)
+        self.assertEqual([row["first_name"] for row in results][-1], "Glenda")
+        self.assertEqual(results, self.sql.search("glen", "", ""))
+
+    def test_index_rebuilds_after_delete(self):
+        self.trigram.search("glen", "", "")
+        CSVData.query.filter_by(id=363).delete()
+        db.session.commit()
+        self.assertEqual(
+            self.trigram.search("glen", "", ""), self.sql.search("glen", "", "")
+        )
+
+    def test_process_search_csv_with_trigram_engine(self):
+        self.app.config["SEARCH_ENGINE"] = "trigram"
+        asyncio.run(process_search_csv("glen", "he", 1, "transaction_id"))
+        self.assertEqual(
+            self.app.results.read("transaction_id"),
+            dumps(self.sql.search("glen", "he", 1)),
+        )
+
+
+class SearchIndexesTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        create_search_indexes(db.session.connection())
+        db.session.commit()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.indexed = SQLEngine()
+        self.plain = SQLEngine()
+        self.plain._detected = True
+
+    def test_results_match_a_table_scan(self):
+        self.assertEqual(self.indexed.detect_index(), FTS5)
+        for name, city, quantity in TrigramEngineTest.queries:
+            with self.subTest(name=name, city=city, quantity=quantity):
+                self.assertEqual(
+                    self.indexed.rows(name, city, quantity),
+                    self.plain.rows(name, city, quantity),
+                )
+
+    def test_triggers_keep_the_index_in_sync(self):
+        db.session.add(CSVData(user_id=1001, first_name="Glenda", city="Oslo"))
+        CSVData.query.filter_by(id=363).delete()
+        CSVData.query.filter_by(first_name="Glendon").update({"first_name": "Brenden"})
+        db.session.commit()
+        for query in (("glen", "", ""), ("bren", "", ""), ("", "oslo", "")):
+            self.assertEqual(self.indexed.rows(*query), self.plain.rows(*query))
+
+    def test_index_is_used_for_long_enough_patterns(self):
+        self.assertIsNone(index_clause(FTS5, {"first_name": "%gl%"}))
+        clause = index_clause(FTS5, {"first_name": "%glen%"})
+        query = select(CSVData.id).where(clause)
+        sql = query.compile(db.engine, compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        self.assertIn("VIRTUAL TABLE INDEX", str(plan))
+
+        drop_search_indexes(db.session.connection())
+        self.assertIsNone(SQLEngine().detect_index())
+
+
+class FullTextSearchTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        create_fulltext_index(db.session.connection())
+        db.session.commit()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.engine = FullTextEngine()
+
+    def test_matches_are_ranked_by_field_weight(self):
+        rows = self.engine.rows("ser", 10)
+        self.assertEqual([row[2] for row in rows[:1]], ["Sergeant"])
+        self.assertEqual({row[7] for row in rows[1:]}, {"Serhetabat", "Serednye"})
+        self.assertEqual(self.engine.rows("glen riche", 10)[0][0], 363)
+        self.assertEqual(len(self.engine.rows("genderfluid", 3)), 3)
+        self.assertEqual(self.engine.rows("not_exists", 3), [])
+
+    def test_email_domains_are_searchable(self):
+        rows = self.engine.rows("wordpress.org", 10)
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(all(row[4].endswith("@wordpress.org") for row in rows))
+
+    def test_search_csv_with_q_runs_a_ranked_search(self):
+        client = self.app.test_client()
+        response = client.get("/search-csv?q=glen riche")
+        self.assertEqual(response.status_code, 202)
+        transaction_id = response.get_json()["transaction_id"]
+        self.app.jobs.work(burst=True)
+        self.assertEqual(self.app.jobs.status(transaction_id)["status"], "done")
+        results = json.loads(self.app.results.read(transaction_id))
+        self.assertEqual([record["id"] for record in results], [363])
+
+        response = client.get("/search-csv?q=glen&name=glen")
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_index_fails_the_job(self):
+        db.session.execute(text("DROP TABLE csv_data_search"))
+        response = self.app.test_client().get("/search-csv?q=glen")
+        transaction_id = response.get_json()["transaction_id"]
+        self.app.jobs.work(burst=True)
+        status = self.app.jobs.status(transaction_id)
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("flask db upgrade", status["error"])
+
+
+class SearchBatchTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.engine = SQLEngine()
+        self.client = self.app.test_client()
+
+    def test_batch_rows_match_single_searches(self):
+        filtered = [query for query in TrigramEngineTest.queries if query[0] or query[1]]
+        for queries in (filtered, TrigramEngineTest.queries):
+            batches = self.engine.batch_rows(queries)
+            for query, rows in zip(queries, batches):
+                with self.subTest(query=query):
+                    self.assertEqual(rows, self.engine.rows(*query))
+
+        create_search_indexes(db.session.connection())
+        db.session.commit()
+        indexed = SQLEngine()
+        for query, rows in zip(filtered, indexed.batch_rows(filtered)):
+            self.assertEqual(rows, self.engine.rows(*query))
+
+    def test_post_batch_writes_each_search(self):
+        searches = [{"name": "glen"}, {"city": "Lanthenay"}, {"name": "glen", "quantity": 1}]
+        response = self.client.post("/search-csv/batch", json=searches)
+        self.assertEqual(response.status_code, 202)
+        transaction_ids = response.get_json()["transaction_ids"]
+        self.assertEqual(len(transaction_ids), 3)
+        self.assertEqual(self.app.jobs.status(transaction_ids[0])["status"], "queued")
+
+        self.assertEqual(self.app.jobs.work(burst=True), 1)
+        for transaction_id, search in zip(transaction_ids, searches):
+            status = self.app.jobs.status(transaction_id)
+            self.assertEqual(status["status"], "done")
+            self.assertEqual(status["transaction_id"], transaction_id)
+            expected = self.engine.search(
+                search.get("name", ""), search.get("city", ""), search.get("quantity", "")
+            )
+            self.assertEqual(json.loads(self.app.results.read(transaction_id)), expected)
+
+        self.client.post("/search-csv/batch", json=searches)
+        self.app.jobs.work(burst=True)
+        self.assertEqual(self.app.search_cache.stats()["hits"], 3)
+
+    def test_post_batch_should_return_400(self):
+        for payload in ([], {"name": "glen"}, [{"q": "glen"}], [{"quantity": "x"}]):
+            with self.subTest(payload=payload):
+                response = self.client.post("/search-csv/batch", json=payload)
+                self.assertEqual(response.status_code, 400)
+        self.app.config["SEARCH_BATCH_MAX_SIZE"] = 1
+        response = self.client.post("/search-csv/batch", json=[{}, {}])
+        self.assertEqual(response.status_code, 400)
+
+
+class ColumnarEngineTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.sql = SQLEngine()
+        self.columnar = ColumnarEngine()
+
+    def test_results_match_sql_engine(self):
+        for name, city, quantity in TrigramEngineTest.queries + [("", "", "")]:
+            with self.subTest(name=name, city=city, quantity=quantity):
+                self.assertEqual(
+                    self.columnar.search(name, city, quantity),
+                    self.sql.search(name, city, quantity),
+                )
+
+    def test_snapshot_reloads_when_stale(self):
+        self.columnar.search("glen", "", "")
+        snapshot = self.columnar.snapshot
+        self.columnar.search("glen", "", "")
+        self.assertIs(self.columnar.snapshot, snapshot)
+
+        row = CSVData.query.filter_by(id=352).scalar()
+        row.first_name = "Bob"
+        db.session.commit()
+        self.assertEqual(len(self.columnar.search("glen", "", "")), 2)
+        self.assertIsNot(self.columnar.snapshot, snapshot)
+
+    def test_null_values(self):
+        db.session.add(CSVData(user_id=None, first_name=None, city="Glenwood"))
+        db.session.commit()
+        results = self.columnar.search("", "glen", "")
+        self.assertEqual(results, self.sql.search("", "glen", ""))
+        self.assertIsNone(results[-1]["first_name"])
+        self.assertEqual(self.columnar.search("%", "glen", ""), self.sql.search("%", "glen", ""))
+
+
+class LoadCSVDataTest(BaseTestCase):
+    filename = "app/files/vibra_challenge.csv"
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmpdir.name, "load.checkpoint")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_commits_every_chunk(self):
+        progress = []
+        self.assertEqual(load_csv_data(self.filename, 300, progress.append), 1000)
+        self.assertEqual(progress, [300, 600, 900, 1000])
+        row = CSVData.query.filter_by(id=352).scalar()
+        self.assertEqual(row.user_id, 352)
+        self.assertEqual(row.city, "Romorantin-Lanthenay")
+
+    def test_resumes_from_last_committed_chunk(self):
+        def interrupt(rows):
+            if rows == 400:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            load_csv_data(self.filename, 200, interrupt, checkpoint=self.checkpoint)
+        self.assertEqual(CSVData.query.count(), 400)
+
+        progress = []
+        loaded = load_csv_data(self.filename, 200, progress.append, self.checkpoint)
+        self.assertEqual(loaded, 600)
+        self.assertEqual(progress, [600, 800, 1000])
+        self.assertEqual(CSVData.query.count(), 1000)
+        self.assertEqual(CSVData.query.filter(CSVData.id != CSVData.user_id).count(), 0)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_load_csv_command(self):
+        result = self.app.test_cli_runner().invoke(
+            args=["load-csv", self.filename, "--chunk-size", "500"]
+        )
+        self.assertEqual(result.output, "500 rows loaded\n1000 rows loaded\n")
+        self.assertEqual(CSVData.query.count(), 1000)
+
+
+class ParallelLoadTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "data.csv")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def write(self, rows):
+        with open(self.filename, "w", newline="") as f:
+            csv.writer(f).writerows(rows)
+        return self.filename
+
+    def test_ranges_end_on_records(self):
+        self.write(
+            [
+                [i, f"line\n{i}" if i % 3 == 0 else "a", 'say "hi"' if i % 5 == 0 else "b"]
+                + ["é", "", "c", "x\r\ny" if i % 7 == 0 else "d"]
+                for i in range(1, 501)
+            ]
+        )
+        with open(self.filename, newline="") as f:
+            expected = [row for chunk in read_csv_chunks(f, 1000) for row in chunk]
+        for range_size in (1, 100, 5000, 10**9):
+            with self.subTest(range_size=range_size):
+                ranges = split_csv_ranges(self.filename, range_size)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], os.path.getsize(self.filename))
+                self.assertTrue(all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])))
+                rows = []
+                for start, end in ranges:
+                    rows.extend(parse_csv_range(self.filename, start, end))
+                self.assertEqual(rows, expected)
+
+    def test_invalid_records_stop_the_load(self):
+        self.write([[1, "a", "b", "c", "d", "e", "f"], [2, "a", "b"]])
+        with self.assertRaisesRegex(ValueError, "has 3 fields, expected 7"):
+            parse_csv_range(self.filename, 0, os.path.getsize(self.filename))
+        self.write([["x", "a", "b", "c", "d", "e", "f"]])
+        with self.assertRaisesRegex(ValueError, "invalid user_id 'x'"):
+            load_csv_data_parallel(self.filename, 1)
+        self.assertEqual(split_csv_ranges(self.write([])), [])
+
+    def test_loads_in_file_order(self):
+        progress = []
+        loaded = load_csv_data_parallel(
+            "app/files/vibra_challenge.csv", 2, 300, range_size=10000, progress=progress.append
+        )
+        self.assertEqual(loaded, 1000)
+        self.assertEqual(progress[-1], 1000)
+        self.assertEqual(CSVData.query.filter(CSVData.id != CSVData.user_id).count(), 0)
+        self.assertEqual(CSVData.query.filter_by(id=352).scalar().city, "Romorantin-Lanthenay")
+
+        args = ["load-csv", "app/files/vibra_challenge.csv", "--workers", "2", "--checkpoint", "x"]
+        result = self.app.test_cli_runner().invoke(args=args)
+        self.assertIn("--checkpoint is not supported with --workers", result.output)
+
+
+class SyncCSVDataTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open("app/files/vibra_challenge.csv", newline="") as f:
+            self.rows = list(csv.reader(f))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def write(self, rows):
+        filename = os.path.join(self.tmpdir.name, "data.csv")
+        with open(filename, "w", newline="") as f:
+            csv.writer(f).writerows(rows)
+        return filename
+
+    def changed_rows(self):
+        rows = [list(row) for row in self.rows[:990]]
+        rows[10][6] = "Lyon"
+        rows[500][1] = "Glen"
+        rows.append(["1001", "New", "User", "new@user.com", "Male", "Acme", "Oslo"])
+        return rows
+
+    def test_applies_only_the_differences(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        summary = sync_csv_data(self.write(self.changed_rows()), chunk_size=100)
+        self.assertEqual(
+            summary,
+            {
+                "inserted": 1,
+                "updated": 2,
+                "deleted": 10,
+                "unchanged": 988,
+                "skipped": 0,
+                "duplicates": 0,
+            },
+        )
+        self.assertEqual(CSVData.query.count(), 991)
+        self.assertEqual(CSVData.query.filter_by(user_id=11).one().city, "Lyon")
+        self.assertEqual(CSVData.query.filter_by(user_id=501).one().first_name, "Glen")
+        self.assertIsNone(CSVData.query.filter_by(user_id=995).first())
+        self.assertEqual(CSVData.query.filter_by(user_id=1001).one().city, "Oslo")
+        # rows keep their id when updated
+        self.assertEqual(CSVData.query.filter_by(user_id=11).one().id, 11)
+
+        summary = sync_csv_data(self.write(self.changed_rows()))
+        self.assertEqual(summary["unchanged"], 991)
+        self.assertEqual(summary["inserted"] + summary["updated"] + summary["deleted"], 0)
+
+    def test_in_memory_engines_see_updated_rows(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        engines = [TrigramEngine(), ColumnarEngine()]
+        for engine in engines:
+            self.assertEqual(engine.rows("zedekiah", "", 0), [])
+        rows = [list(row) for row in self.rows]
+        rows[500][1] = "Zedekiah"
+        sync_csv_data(self.write(rows))
+
+        for engine in engines:
+            with self.subTest(engine=engine.name):
+                self.assertEqual([row[1] for row in engine.rows("zedekiah", "", 0)], [501])
+                self.assertNotIn(501, [row[1] for row in engine.rows(self.rows[500][1], "", 0)])
+
+    def test_dry_run_and_duplicates(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        load_csv_data("app/files/vibra_challenge.csv")
+        rows = self.changed_rows() + [self.rows[0], ["", "No", "Id", "", "", "", ""]]
+        filename = self.write(rows)
+
+        dry_run = sync_csv_data(filename, dry_run=True)
+        self.assertEqual(CSVData.query.count(), 2000)
+        self.assertIsNone(CSVData.query.first().row_hash)
+
+        summary = sync_csv_data(filename)
+        self.assertEqual(summary, dry_run)
+        self.assertEqual((summary["duplicates"], summary["skipped"]), (1000, 2))
+        self.assertEqual(CSVData.query.count(), 991)
+        self.assertEqual(CSVData.query.filter(CSVData.id > 1000).count(), 1)
+
+    def test_invalidates_cached_searches(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        sync_csv_data("app/files/vibra_challenge.csv")
+        generation = get_generation(self.app.redis)
+        sync_csv_data("app/files/vibra_challenge.csv")
+        self.assertEqual(get_generation(self.app.redis), generation)
+        sync_csv_data(self.write(self.changed_rows()))
+        self.assertGreater(get_generation(self.app.redis), generation)
+
+    def test_sync_csv_command(self):
+        result = self.app.test_cli_runner().invoke(
+            args=["sync-csv", "app/files/vibra_challenge.csv", "--dry-run"]
+        )
+        self.assertEqual(
+            result.output,
+            "1000 inserted, 0 updated, 0 deleted, 0 unchanged, 0 skipped, 0 duplicates\n",
+        )
+        self.assertEqual(CSVData.query.count(), 0)
+
+
+class SearchCacheTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.cache = self.app.search_cache
+        self.engine = SQLEngine()
+        self.calls = []
+        rows = self.engine.rows
+
+        def counting_rows(*args):
+            self.calls.append(args)
+            return rows(*args)
+
+        self.engine.rows = counting_rows
+
+    def test_identical_searches_hit_the_cache(self):
+        first = self.cache.search(self.engine, "glen", "he", 1)
+        second = self.cache.search(self.engine, "GLEN", "HE", 2)
+        self.assertEqual(first, self.engine.rows("glen", "he", 1)[:1])
+        self.assertEqual(second, SQLEngine().rows("glen", "he", 2))
+        self.assertEqual(self.calls[0], ("glen", "he", 16))
+        # whitespace is part of the substring searched
+        spaced = self.cache.search(self.engine, "glen ", "", "")
+        self.assertEqual(spaced, SQLEngine().rows("glen ", "", ""))
+        self.assertEqual(self.calls[-1], ("glen ", "", None))
+        stats = self.client_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["hit_ratio"], 0.3333)
+
+    def test_inserts_invalidate_the_cache(self):
+        self.assertEqual(len(self.cache.search(self.engine, "glen", "", "")), 3)
+        db.session.add(CSVData(user_id=1001, first_name="Glenda", city="Oslo"))
+        db.session.commit()
+        self.assertEqual(len(self.cache.search(self.engine, "glen", "", "")), 4)
+
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.assertEqual(len(self.cache.search(self.engine, "glen", "", "")), 7)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.app.config["SEARCH_CACHE_MAX_ENTRIES"] = 2
+        for name in ("glen", "an", "glen", "bo"):
+            self.cache.search(self.engine, name, "", "")
+        stats = self.client_stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.cache.search(self.engine, "glen", "", "")
+        self.assertEqual(self.client_stats()["hits"], 2)
+
+    def test_large_results_are_not_cached(self):
+        self.cache.search(self.engine, "glen", "", "")
+        stats = self.client_stats()
+        self.assertEqual(stats["bytes"], len(json.dumps(SQLEngine().rows("glen", "", ""))))
+
+        self.app.config["SEARCH_CACHE_MAX_ENTRY_BYTES"] = 1000
+        rows = self.cache.search(self.engine, "", "", "")
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(self.cache.search(self.engine, "", "", ""), rows)
+        self.assertEqual(len(self.calls), 3)
+        stats = self.client_stats()
+        self.assertEqual((stats["entries"], stats["oversized"]), (1, 2))
+
+    def test_concurrent_identical_searches_run_once(self):
+        rows = self.engine.rows
+
+        def slow_rows(*args):
+            time.sleep(0.2)
+            return rows(*args)
+
+        self.engine.rows = slow_rows
+        results = []
+
+        def run():
+            with self.app.app_context():
+                results.append(self.cache.search(self.engine, "glen", "", ""))
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(self.client_stats()["shared"], 2)
+
+    def client_stats(self):
+        return self.app.test_client().get("/search-csv/cache/stats").get_json()
+
+
+class ResultPagesTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.app.config["RESULT_PAGE_SIZE"] = 2
+        self.client = self.app.test_client()
+        self.records = SQLEngine().search("an", "", 7)
+        self.app.results.write("transaction_id", self.records)
+
+    def test_results_are_stored_in_pages(self):
+        self.assertEqual(self.app.redis.llen("transaction_id"), 4)
+        self.assertEqual(self.app.results.read("transaction_id"), dumps(self.records))
+
+    def test_legacy_response_is_unchanged(self):
+        response = self.client.get("/redis/transaction_id")
+        self.assertEqual(response.get_json(), {"result": dumps(self.records)})
+
+        self.app.results.write("empty", [])
+        response = self.client.get("/redis/empty")
+        self.assertEqual(response.get_json(), {"result": "[]"})
+
+        self.client.put("/redis/legacy", json=self.records[:1])
+        response = self.client.get("/redis/legacy")
+        self.assertEqual(json.loads(response.get_json()["result"]), self.records[:1])
+
+    def test_cursor_pagination(self):
+        records, cursor = [], 0
+        while cursor is not None:
+            response = self.client.get(f"/redis/transaction_id?cursor={cursor}&page_size=3")
+            page = response.get_json()
+            self.assertEqual(page["count"], 7)
+            self.assertLessEqual(len(page["result"]), 3)
+            records.extend(page["result"])
+            cursor = page["next_cursor"]
+        self.assertEqual(records, self.records)
+
+        response = self.client.get("/redis/not_exists?cursor=0")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/redis/transaction_id?page_size=0")
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_streaming(self):
+        response = self.client.get("/redis/transaction_id?format=ndjson&cursor=1")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.records[1:])
+
+        response = self.client.get("/redis/transaction_id?format=ndjson&page_size=3")
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 3)
+
+    def test_pages_are_stored_compressed_with_their_format(self):
+        meta = self.app.redis.hgetall("transaction_id:meta")
+        self.assertEqual((meta[b"format"], meta[b"codec"]), (b"json", b"gzip"))
+        page = self.app.redis.lindex("transaction_id", 0)
+        self.assertEqual(json.loads(zlib.decompress(page, 31)), self.records[:2])
+
+        self.app.config["RESULT_CODEC"] = "zlib-dict"
+        ResultStore(self.app).write("dictionary", self.records)
+        # read by the store of another codec from the header
+        self.assertEqual(self.app.results.read("dictionary"), dumps(self.records))
+        self.assertEqual(
+            self.app.results.read_page("dictionary", 1, 4), (self.records[1:5], 7, False)
+        )
+
+    def test_pages_without_format_header_are_json(self):
+        self.app.redis.rpush("old", dumps(self.records[:2]), dumps(self.records[2:3]))
+        self.app.redis.hset("old:meta", mapping={"count": 3, "page_size": 2})
+        self.assertEqual(self.app.results.read("old"), dumps(self.records[:3]))
+        self.assertEqual(self.app.results.read_page("old", 1, 2), (self.records[1:3], 3, False))
+
+    def test_array_format_sends_stored_pages(self):
+        url = "/redis/transaction_id?format=array&cursor=2"
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(json.loads(zlib.decompress(response.data, 31)), self.records[2:4])
+        self.assertEqual(response.headers["X-Result-Count"], "7")
+        self.assertEqual(response.headers["X-Next-Cursor"], "4")
+
+        # decoded when not accepted or not a whole stored page
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json(), self.records[2:4])
+        response = self.client.get(url + "&page_size=3", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json(), self.records[2:5])
+
+        response = self.client.get(
+            "/redis/transaction_id?format=array&cursor=6&page_size=10",
+            headers={"Accept-Encoding": "*"},
+        )
+        self.assertEqual(json.loads(zlib.decompress(response.data, 31)), self.records[6:])
+        self.assertEqual(response.headers["X-Next-Cursor"], "")
+        response = self.client.get("/redis/not_exists?format=array")
+        self.assertEqual(response.status_code, 404)
+
+    def test_put_lists_are_stored_as_results(self):
+        self.client.put("/redis/put", json=self.records)
+        self.assertEqual(self.app.redis.llen("put"), 4)
+        response = self.client.get("/redis/put?cursor=5")
+        self.assertEqual(response.get_json()["result"], self.records[5:])
+
+        self.client.put("/redis/put", json={"a": 1})
+        self.assertFalse(self.app.redis.exists("put:meta"))
+        self.assertEqual(self.client.get("/redis/put").get_json(), {"result": '{"a": 1}'})
+
+
+class ResultRetentionTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["RESULT_PAGE_SIZE"] = 10
+        self.client = self.app.test_client()
+        self.records = [{"id": i, "first_name": f"name {i}"} for i in range(50)]
+        self.retention = self.app.results.retention
+
+    def stored_bytes(self, transaction_id):
+        return sum(map(len, self.app.redis.lrange(transaction_id, 0, -1)))
+
+    def test_large_results_are_truncated(self):
+        self.app.config["RESULT_MAX_BYTES"] = 300
+        self.app.results.write("large", self.records)
+
+        self.assertLessEqual(self.stored_bytes("large"), 300)
+        self.assertEqual(self.app.redis.hget("large:meta", "truncated"), b"50")
+        records, count, truncated = self.app.results.read_page("large", 0, 100)
+        self.assertTrue(truncated)
+        self.assertGreater(count, 10)
+        self.assertLess(count, 50)
+        self.assertEqual(records, self.records[:count])
+
+        body = self.client.get("/redis/large?cursor=0").get_json()
+        self.assertTrue(body["truncated"])
+        body = self.client.get("/redis/large").get_json()
+        self.assertEqual(json.loads(body["result"]), self.records[:count])
+        self.assertTrue(body["truncated"])
+        response = self.client.get("/redis/large?format=array")
+        self.assertEqual(response.headers["X-Result-Truncated"], "1")
+        self.app.results.write("small", self.records[:5])
+        self.assertNotIn("truncated", self.client.get("/redis/small?cursor=0").get_json())
+        self.assertNotIn("truncated", self.client.get("/redis/small").get_json())
+
+    def test_large_results_can_be_rejected(self):
+        self.app.config["RESULT_MAX_BYTES"] = 300
+        self.app.config["RESULT_OVERSIZE"] = "reject"
+        with self.assertRaises(ResultTooLarge):
+            self.app.results.write("large", self.records)
+        self.assertFalse(self.app.redis.exists("large", "large:meta"))
+
+        response = self.client.put("/redis/large", json=self.records)
+        self.assertEqual(response.status_code, 413)
+        response = self.client.put("/redis/large", json={"value": "x" * 300})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.client.put("/redis/small", json={"a": 1}).status_code, 200)
+        self.assertGreater(self.app.redis.ttl("small"), 0)
+
+    def test_least_recently_read_results_are_evicted(self):
+        for transaction_id in ("a", "b", "c"):
+            self.app.results.write(transaction_id, self.records)
+            time.sleep(0.002)
+        size = self.stored_bytes("a")
+        self.app.results.read_page("a", 0, 10)
+
+        # over budget by half a result, evicting down to 90% of it frees one
+        self.app.config["RESULT_MEMORY_BUDGET"] = 3.5 * size
+        self.app.results.write("d", self.records)
+
+        self.assertFalse(self.app.redis.exists("b", "b:meta"))
+        self.assertEqual(self.app.redis.exists("a", "c", "d"), 3)
+        stats = self.client.get("/redis/results/stats?top=2").get_json()
+        self.assertEqual(stats["keys"], 3)
+        self.assertEqual(stats["total_bytes"], 3 * size)
+        self.assertEqual(stats["evicted"], 1)
+        self.assertEqual(stats["budget_bytes"], 3.5 * size)
+        self.assertEqual(len(stats["largest"]), 2)
+        self.assertEqual(stats["largest"][0]["bytes"], size)
+
+    def test_rewrites_and_expired_results_are_accounted_for(self):
+        self.app.results.write("a", self.records)
+        self.app.results.write("a", self.records[:10])
+        self.app.results.write("b", self.records)
+        total = self.stored_bytes("a") + self.stored_bytes("b")
+        self.assertEqual(self.retention.stats()["total_bytes"], total)
+
+        # as if Redis expired b
+        self.app.redis.delete("b", "b:meta")
+        self.app.redis.zadd(self.retention.expiry_key, {"b": 0})
+        stats = self.retention.stats()
+        self.assertEqual((stats["keys"], stats["total_bytes"]), (1, self.stored_bytes("a")))
+        self.assertEqual(stats["largest"], [{"transaction_id": "a", "bytes": self.stored_bytes("a")}])
+
+
+class EncodersTest(BaseTestCase):
+    rows = [
+        (1, 10, "Glén", 'O"Brien', "a\\b@c.d", "Male", None, "Paris\n"),
+        (2, None, "日本", "", "x@y.z", None, "Acme", "Oslo"),
+    ]
+
+    def test_compat_encoder_matches_json_dumps(self):
+        records = [dict(zip(RECORD_COLUMNS, row)) for row in self.rows]
+        encoder = CompatEncoder()
+        self.assertEqual(encoder.encode(self.rows), dumps(records).encode())
+        self.assertEqual(encoder.encode(self.rows[:1]), dumps(records[:1]).encode())
+        self.assertEqual(encoder.encode([]), b"[]")
+        self.assertEqual(encoder.dumps(records), dumps(records).encode())
+
+    def test_fast_encoder_is_equivalent(self):
+        encoder = get_encoder("auto")
+        records = [dict(zip(RECORD_COLUMNS, row)) for row in self.rows]
+        self.assertEqual(json.loads(encoder.encode(self.rows)), records)
+
+    def test_engines_return_rows_of_the_records(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        rows = SQLEngine().rows("glen", "", "")
+        self.assertEqual(
+            [dict(zip(RECORD_COLUMNS, row)) for row in rows],
+            [row.to_dict() for row in CSVData.query.filter(CSVData.first_name.ilike("%glen%"))],
+        )
+        self.assertEqual(ColumnarEngine().rows("glen", "", ""), rows)
+        self.assertEqual(TrigramEngine().rows("glen", "", ""), rows)
+
+
+class CodecsTest(unittest.TestCase):
+    page = dumps(
+        [
+            dict(zip(RECORD_COLUMNS, (i, i, "Glen", "Doe", "glen@doe.com", "Male", "", "Oslo")))
+            for i in range(3)
+        ]
+    ).encode()
+
+    def test_codecs_round_trip(self):
+        for name in ("identity", "gzip", "zlib-dict"):
+            with self.subTest(name):
+                codec = get_codec(name)
+                self.assertEqual(codec.decompress(codec.compress(self.page)), self.page)
+                self.assertEqual(codec.decompress(codec.compress(b"[]")), b"[]")
+
+    def test_dictionary_helps_small_pages(self):
+        compressed = get_codec("zlib-dict").compress(self.page)
+        self.assertLess(len(compressed), len(zlib.compress(self.page)))
+
+    def test_accepts_encoding(self):
+        self.assertTrue(accepts_encoding("deflate, gzip;q=0.5", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+        self.assertFalse(accepts_encoding("gzip;q=0, *", "gzip"))
+        self.assertFalse(accepts_encoding("br", "gzip"))
+        self.assertFalse(accepts_encoding(None, "gzip"))
+
+    @unittest.skipUnless(importlib.util.find_spec("msgpack"), "msgpack is not installed")
+    def test_msgpack_encoder(self):
+        encoder = get_encoder("msgpack")
+        rows = EncodersTest.rows
+        records = [dict(zip(RECORD_COLUMNS, row)) for row in rows]
+        self.assertEqual(load_records(encoder.encode(rows), "msgpack"), records)
+        self.assertEqual(load_records(encoder.dumps(records), "msgpack"), records)
+        self.assertEqual(load_records(encoder.dumps([]), "msgpack"), [])
+
+    @unittest.skipUnless(importlib.util.find_spec("lz4"), "lz4 is not installed")
+    def test_lz4_codec(self):
+        codec = get_codec("lz4")
+        self.assertEqual(codec.decompress(codec.compress(self.page)), self.page)
+
+
+class ResourcesTest(BaseTestCase):
+    def test_redis_client_is_created_once_per_process(self):
+        app = create_app(TestConfig)
+        client = app.redis
+        self.assertIsInstance(client, InstrumentedRedis)
+        self.assertIsInstance(client.connection_pool, InstrumentedConnectionPool)
+        self.assertIs(app.redis, client)
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(app.redis, client)
+
+    def test_forked_children_get_new_pools(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, b"1" if self.app.resources._pid is None else b"0")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(read, 1), b"1")
+        self.assertIsNotNone(self.app.resources._pid)
+
+    def test_redis_pool_stats(self):
+        pool = InstrumentedConnectionPool(
+            max_connections=2,
+            timeout=0.05,
+            connection_class=fakeredis.FakeRedisConnection,
+            server=fakeredis.FakeServer(),
+        )
+        client = InstrumentedRedis(connection_pool=pool)
+        client.set("key", "value")
+        held = [pool.get_connection("GET"), pool.get_connection("GET")]
+        with self.assertRaises(redis.ConnectionError):
+            pool.get_connection("GET")
+        stats = pool.stats()
+        self.assertEqual(stats["in_use"], 2)
+        self.assertEqual(stats["waiting"], 0)
+        self.assertEqual(stats["checkouts"], 3)
+        for connection in held:
+            pool.release(connection)
+        self.assertEqual(pool.stats()["in_use"], 0)
+
+    def test_database_pool_settings_and_stats(self):
+        config = {"DB_POOL_PRE_PING": True, "DB_POOL_RECYCLE": 60, "DB_POOL_SIZE": 3,
+                  "DB_MAX_OVERFLOW": 0, "DB_POOL_TIMEOUT": 0.05}
+        options = engine_options({**config, "SQLALCHEMY_DATABASE_URI": "postgresql://db/app"})
+        self.assertIs(options["poolclass"], InstrumentedQueuePool)
+        self.assertEqual(options["pool_size"], 3)
+        options = engine_options(
+            {**config, "SQLALCHEMY_DATABASE_URI": "sqlite://",
+             "SQLALCHEMY_ENGINE_OPTIONS": {"pool_recycle": 10}}
+        )
+        self.assertEqual(options, {"pool_pre_ping": True, "pool_recycle": 10})
+
+        engine = sqlalchemy.create_engine(
+            "sqlite://", poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0,
+            pool_timeout=0.05,
+        )
+        connection = engine.connect()
+        with self.assertRaises(sqlalchemy.exc.TimeoutError):
+            engine.connect()
+        stats = engine.pool.stats()
+        self.assertEqual((stats["in_use"], stats["waiting"], stats["checkouts"]), (1, 0, 1))
+        connection.close()
+
+        response = self.app.test_client().get("/pools/stats")
+        self.assertEqual(response.get_json()["pid"], os.getpid())
+        self.assertIn("default", response.get_json()["database"])
+
+
+class MetricsTest(BaseTestCase):
+    def metric(self, series):
+        for line in self.app.metrics.render().splitlines():
+            if line.startswith(series + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return None
+
+    def test_request_metrics(self):
+        client = self.app.test_client()
+        client.get("/")
+        client.get("/error/404")
+        client.get("/error/404")
+
+        response = client.get("/metrics")
+        self.assertEqual(response.mimetype, "text/plain")
+        text = response.get_data(as_text=True)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn(
+            'http_requests_total{endpoint="/error/<int:code>",method="GET",status="404"} 2',
+            text,
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{endpoint="/",method="GET",le="+Inf"} 1',
+            text,
+        )
+
+    def test_db_and_job_metrics(self):
+        load_csv_data("app/files/vibra_challenge.csv")
+        self.app.jobs.enqueue(
+            process_search_csv,
+            "transaction_id",
+            name="an",
+            city="",
+            quantity=5,
+            transaction_id="transaction_id",
+        )
+        self.app.jobs.work(burst=True)
+
+        task = 'task="app.tasks:process_search_csv"'
+        self.assertEqual(self.metric(f'job_duration_seconds_count{{status="done",{task}}}'), 1)
+        self.assertEqual(self.metric(f"job_queue_wait_seconds_count{{{task}}}"), 1)
+        self.assertGreater(
+            self.metric('db_query_duration_seconds_count{operation="INSERT"}'), 0
+        )
+        self.assertEqual(
+            self.metric('serialization_duration_seconds_count{stage="results"}'), 1
+        )
+
+    def test_redis_commands_are_timed(self):
+        class FakeInstrumentedRedis(InstrumentedRedis, fakeredis.FakeStrictRedis):
+            pass
+
+        self.app.redis = FakeInstrumentedRedis()
+        self.app.redis.set("key", "value")
+        pipe = self.app.redis.pipeline()
+        pipe.get("key")
+        self.assertEqual(pipe.execute(), [b"value"])
+
+        self.assertEqual(self.metric('redis_command_duration_seconds_count{command="SET"}'), 1)
+        self.assertEqual(
+            self.metric('redis_command_duration_seconds_count{command="PIPELINE"}'), 1
+        )
+
+    def test_workers_are_aggregated(self):
+        server = fakeredis.FakeServer()
+        self.app.redis = fakeredis.FakeStrictRedis(server=server)
+        other = Metrics(create_app(TestConfig))
+        other.app.redis = fakeredis.FakeStrictRedis(server=server)
+
+        self.app.metrics.inc("http_requests_total", endpoint="/", status=200)
+        other.inc("http_requests_total", endpoint="/", status=200)
+        other.observe("job_duration_seconds", 0.2, task="t", status="done")
+        other.flush()
+
+        self.assertEqual(self.metric('http_requests_total{endpoint="/",status="200"}'), 2)
+        self.assertEqual(
+            self.metric('job_duration_seconds_bucket{status="done",task="t",le="0.1"}'), 0
+        )
+        self.assertEqual(
+            self.metric('job_duration_seconds_bucket{status="done",task="t",le="0.25"}'), 1
+        )
+
+    def test_apps_are_not_kept_alive_for_the_exit_flush(self):
+        app = create_app(TestConfig)
+        metrics = weakref.ref(app.metrics)
+        del app
+        gc.collect()
+        self.assertIsNone(metrics())
+
+
+class SlowQueryLogTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+        self.log = self.app.slow_queries
+
+    def tearDown(self):
+        self.log.threshold = 0
+        super().tearDown()
+
+    def test_slow_queries_are_recorded_with_their_plan(self):
+        self.assertEqual(self.client.get("/db/slow-queries").get_json()["entries"], [])
+        self.log.threshold = 1e-9
+        self.client.get("/db/1", headers={"X-Request-ID": "slow-request"})
+        load_csv_data("app/files/vibra_challenge.csv")
+
+        entries = self.client.get("/db/slow-queries?limit=100").get_json()["entries"]
+        insert = entries[0]
+        self.assertTrue(insert["statement"].startswith("INSERT INTO csv_data"))
+        self.assertGreater(insert["executemany"], 1)
+        self.assertNotIn("plan", insert)
+
+        select = next(e for e in entries if e.get("request_id") == "slow-request")
+        self.assertIn('FROM "table"', select["statement"])
+        self.assertEqual(select["parameters"], [1])
+        self.assertEqual(select["dialect"], "sqlite")
+        self.assertGreater(select["duration_ms"], 0)
+        self.assertIn("USING INTEGER PRIMARY KEY", select["plan"][0])
+
+        self.assertEqual(self.client.delete("/db/slow-queries").status_code, 200)
+        self.assertEqual(self.log.entries(), [])
+
+    def test_log_is_bounded_and_skips_fast_queries(self):
+        self.log.threshold = 10
+        for id in range(5):
+            self.client.get(f"/db/{id}")
+        self.assertEqual(self.log.entries(), [])
+
+        self.app.config["SLOW_QUERY_LOG_SIZE"] = 3
+        self.log.threshold = 1e-9
+        for id in range(5):
+            db.session.execute(text("SELECT :id"), {"id": id})
+        self.assertEqual([e["parameters"] for e in self.log.entries()], [[4], [3], [2]])
+        response = self.client.get("/db/slow-queries?limit=x")
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_statements_are_not_left_timed(self):
+        self.log.threshold = 1e-9
+        connection = db.session.connection()
+        with self.assertRaises(OperationalError):
+            connection.execute(text("SELECT * FROM not_exists"))
+        self.assertEqual(connection.info["query_start"], [])
+        db.session.rollback()
+        db.session.execute(text("SELECT 1"))
+        self.assertEqual(self.log.entries()[0]["statement"], "SELECT 1")
+
+
+class NativeHandlersTest(AioHTTPTestCase):
+    async def get_application(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        database = os.path.join(self.tmpdir.name, "test.db")
+        config = type("Config", (TestConfig,), {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + database})
+        self.flask_app = create_app(config)
+        server = fakeredis.FakeServer()
+        self.flask_app.redis = fakeredis.FakeStrictRedis(server=server)
+        with self.flask_app.app_context():
+            db.create_all()
+
+        aioapp = make_aiohttp_app(self.flask_app)
+        aioapp[NATIVE_HANDLERS].redis = fakeredis.aioredis.FakeRedis(server=server)
+        return aioapp
+
+    async def work(self):
+        # the worker blocks, run it off the event loop
+        return await self.app[NATIVE_HANDLERS].run_sync(self.flask_app.jobs.work, True)
+
+    async def asyncTearDown(self):
+        await super().asyncTearDown()
+        self.tmpdir.cleanup()
+
+    async def test_search_csv_is_queued(self):
+        response = await self.client.get("/search-csv?name=glen&quantity=2")
+        self.assertEqual(response.status, 202)
+        body = await response.json()
+        self.assertEqual(body["message"], "Search request received")
+        with patch("app.tasks.process_search_csv") as mock_process_search_csv:
+            self.assertEqual(await self.work(), 1)
+            status = self.flask_app.jobs.status(body["transaction_id"])
+            self.assertEqual(status["status"], "done")
+        mock_process_search_csv.assert_called_once_with(
+            name="glen", city="", quantity=2, transaction_id=body["transaction_id"]
+        )
+
+        response = await self.client.get("/search-csv?not_exists=glen")
+        self.assertEqual(response.status, 400)
+        body = await response.json()
+        self.assertEqual(body["message"], "{'not_exists': ['Unknown field.']}")
+
+    async def test_redis_values(self):
+        records = [{"id": i, "first_name": f"name {i}"} for i in range(5)]
+        self.flask_app.config["RESULT_PAGE_SIZE"] = 2
+        with self.flask_app.app_context():
+            self.flask_app.results.write("transaction_id", records)
+
+        response = await self.client.get("/redis/transaction_id")
+        self.assertEqual(await response.json(), {"result": dumps(records)})
+        response = await self.client.get("/redis/transaction_id?cursor=1&page_size=3")
+        self.assertEqual(
+            await response.json(), {"result": records[1:4], "count": 5, "next_cursor": 4}
+        )
+        response = await self.client.get("/redis/transaction_id?format=ndjson&cursor=3")
+        lines = (await response.text()).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], records[3:])
+
+        response = await self.client.put("/redis/key", json={"a": 1})
+        self.assertEqual(await response.json(), {"message": "Data stored successfully"})
+        response = await self.client.get("/redis/key")
+        self.assertEqual(await response.json(), {"result": '{"a": 1}'})
+
+        response = await self.client.get(
+            "/redis/transaction_id?format=array&cursor=2", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["X-Next-Cursor"], "4")
+        self.assertEqual(await response.json(), records[2:4])
+        response = await self.client.get("/redis/transaction_id?format=array&cursor=1")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(await response.json(), records[1:3])
+
+        await self.client.put("/redis/key", json=records)
+        response = await self.client.get("/redis/key?cursor=3")
+        self.assertEqual(
+            await response.json(), {"result": records[3:], "count": 5, "next_cursor": None}
+        )
+
+    async def test_truncated_results_are_marked(self):
+        records = [{"id": i, "first_name": f"name {i}"} for i in range(50)]
+        self.flask_app.config.update(RESULT_MAX_BYTES=300, RESULT_PAGE_SIZE=10)
+        with self.flask_app.app_context():
+            self.flask_app.results.write("large", records)
+            self.flask_app.results.write("small", records[:2])
+
+        body = await (await self.client.get("/redis/large")).json()
+        self.assertTrue(body["truncated"])
+        self.assertLess(len(json.loads(body["result"])), 50)
+        body = await (await self.client.get("/redis/small")).json()
+        self.assertEqual(body, {"result": dumps(records[:2])})
+
+    async def test_search_events(self):
+        body = await (await self.client.get("/search-csv?name=glen")).json()
+        transaction_id = body["transaction_id"]
+        response = await self.client.get("/search-csv/not_exists/events")
+        self.assertEqual(response.status, 404)
+
+        async with self.client.ws_connect("/search-csv/ws?transaction_id=not_exists") as ws:
+            self.assertEqual(
+                await ws.receive_json(timeout=1),
+                {"transaction_id": "not_exists", "status": "unknown"},
+            )
+            await ws.send_str("not json")
+            self.assertIn("error", await ws.receive_json(timeout=1))
+            await ws.send_json({"subscribe": [transaction_id]})
+
+            events = asyncio.ensure_future(
+                self.client.get(f"/search-csv/{transaction_id}/events")
+            )
+            await asyncio.sleep(0.2)
+            with patch("app.tasks.process_search_csv"):
+                await self.work()
+
+            notification = {"transaction_id": transaction_id, "status": "done"}
+            self.assertEqual(await ws.receive_json(timeout=1), notification)
+            text = await (await events).text()
+            self.assertEqual(text.split("\n\n")[-2], f"event: done\ndata: {dumps(notification)}")
+
+    async def test_search_events_of_failed_or_waiting_job(self):
+        self.flask_app.config.update(NOTIFY_KEEPALIVE=0.05, NOTIFY_TIMEOUT=0)
+        body = await (await self.client.get("/search-csv?name=glen")).json()
+        transaction_id = body["transaction_id"]
+        text = await (await self.client.get(f"/search-csv/{transaction_id}/events")).text()
+        self.assertTrue(text.startswith("event: timeout\ndata: "))
+
+        self.flask_app.config["NOTIFY_TIMEOUT"] = 60
+        events = asyncio.ensure_future(self.client.get(f"/search-csv/{transaction_id}/events"))
+        await asyncio.sleep(0.2)
+        with patch("app.tasks.process_search_csv", side_effect=ValueError("boom")):
+            await self.work()
+        text = await (await events).text()
+        self.assertIn(": keep-alive\n\n", text)
+        event = text.split("\n\n")[-2].split("\n")
+        self.assertEqual(event[0], "event: failed")
+        self.assertEqual(
+            json.loads(event[1][len("data: ") :]),
+            {"transaction_id": transaction_id, "status": "failed", "error": "boom"},
+        )
+
+    async def test_hashes(self):
+        response = await self.client.put("/db/abc")
+        self.assertEqual(await response.json(), {"result": True})
+        response = await self.client.put("/db/abc")
+        self.assertEqual(await response.json(), {"result": False})
+        with self.flask_app.app_context():
+            self.assertEqual(self.flask_app.hashes.filter.contains_many(["abc"]), [True])
+        response = await self.client.get("/db/1")
+        self.assertEqual(await response.json(), {"hash": "abc"})
+        response = await self.client.get("/db/2")
+        self.assertEqual(await response.json(), {"hash": ""})
+        # the row was cached when inserted, the missing one was looked up
+        stats = self.flask_app.hash_cache.stats()
+        self.assertEqual((stats["local"], stats["database"]), (1, 1))
+
+    async def test_other_routes_go_through_wsgi(self):
+        response = await self.client.get("/")
+        self.assertEqual(await response.json(), {"hello": "scaffold"})
+        response = await self.client.get("/search-csv/not_exists/status")
+        self.assertEqual(response.status, 404)
+
+
+class BenchmarkStatsTest(unittest.TestCase):
+    def test_summarize(self):
+        summary = summarize([i / 1000 for i in range(1, 101)])
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["p50_ms"], 50.5)
+        self.assertEqual(summary["p95_ms"], 95.05)
+        self.assertEqual(summary["p99_ms"], 99.01)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"a": {"p50_ms": 10, "p95_ms": 20}, "b": {"p50_ms": 10, "p95_ms": 20}}
+        results = {
+            "a": {"p50_ms": 10.5, "p95_ms": 30},
+            "b": {"p50_ms": 9, "p95_ms": 20},
+            "c": {"p50_ms": 100, "p95_ms": 200},
+        }
+        self.assertEqual(
+            compare(results, baseline, 0.1),
+            [{"benchmark": "a", "metric": "p95_ms", "baseline": 20, "current": 30, "change": 0.5}],
+        )
+
+    def test_startup_report_sums_import_time_by_package(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     sqlalchemy.sql\n"
+            "import time:        30 |        150 |   sqlalchemy\n"
+            "import time:        50 |        200 | app\n"
+        )
+        modules = parse_importtime(output)
+        self.assertEqual(modules, {"sqlalchemy.sql": 120, "sqlalchemy": 30, "app": 50})
+        self.assertEqual(by_package(modules), {"sqlalchemy": 150, "app": 50})
+
+
+class StartupTest(unittest.TestCase):
+    def test_create_app_defers_optional_imports(self):
+        script = (
+            "import sys\n"
+            "from app import create_app\n"
+            "app = create_app()\n"
+            "app.logger.info('started')\n"
+            "print(sorted(m for m in ('alembic', 'multiprocessing', 'app.search.columnar',"
+            " 'app.search.trigram') if m in sys.modules))\n"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(process.stdout.strip(), "[]")
+
+    def test_terminal_is_looked_up_on_first_record(self):
+        with patch("app.logger._stderr_supports_color", return_value=False) as supports_color:
+            formatter = LogFormatter()
+            supports_color.assert_not_called()
+            record = logging.LogRecord("app", logging.INFO, __file__, 1, "hello", None, None)
+            self.assertIn("hello", formatter.format(record))
+            formatter.format(record)
+        supports_color.assert_called_once()
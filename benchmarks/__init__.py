@@ -0,0 +1,12 @@
+"""
+Benchmarks of the application, run offline on SQLite and a local Redis
+stand-in (fakeredis).
+
+    python -m benchmarks --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks --sizes 1000 --compare results.json --threshold 0.2
+    python -m benchmarks.search_engines --sizes 1000 100000 1000000
+    python -m benchmarks.allocations --sizes 10000 100000
+    python -m benchmarks.codecs --records 100000 --page-sizes 50 500
+    python -m benchmarks.ingest --size-mb 2048 --workers 1 2 4 8 --load
+    python -m benchmarks.startup --repeat 5 --max-ms 1000
+"""
@@ -0,0 +1,61 @@
+"""
+Run the benchmark suite: ingestion, searches and result retrieval through
+Flask and aiohttp, on generated datasets.
+
+    python -m benchmarks --sizes 1000 100000 --output results.json
+    python -m benchmarks --sizes 1000 --compare baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .stats import compare
+from .suite import run_suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per benchmark.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Results of a previous run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated slowdown (default 0.1).")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.repeat, progress=lambda line: print(line, file=sys.stderr))
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    for name, summary in results.items():
+        print(f"{name:<50} p50 {summary['p50_ms']:>10.3f} ms  p95 {summary['p95_ms']:>10.3f} ms  p99 {summary['p99_ms']:>10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(
+                f"REGRESSION {r['benchmark']} {r['metric']}: "
+                f"{r['baseline']:.3f} -> {r['current']:.3f} ms (+{r['change']:.0%})"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
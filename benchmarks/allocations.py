@@ -0,0 +1,96 @@
+"""
+Measure the memory allocated and the time taken to serialize search results.
+
+Compares the ORM pipeline the search used to run (CSVData instances, to_dict()
+and json.dumps()) with column projection and each result encoder, on an
+unfiltered search of generated datasets.
+
+    python -m benchmarks.allocations --sizes 10000 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from app import db
+from app.encoders import ENCODERS, get_encoder
+from app.helpers import load_csv_data
+from app.models import CSVData
+from app.search.sql import SQLEngine
+
+from .datasets import write_csv
+from .environment import create_benchmark_app
+
+
+def orm_pipeline():
+    return json.dumps([row.to_dict() for row in CSVData.query.all()]).encode()
+
+
+def rows_pipeline(encoder):
+    return lambda: encoder.encode(SQLEngine().rows("", "", ""))
+
+
+def measure(pipeline):
+    db.session.expunge_all()
+    tracemalloc.start()
+    started = time.perf_counter()
+    payload = pipeline()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.expunge_all()
+    return len(payload), elapsed, peak
+
+
+def run(size):
+    pipelines = {"orm + json.dumps": orm_pipeline}
+    for name in ENCODERS:
+        try:
+            pipelines[f"rows + {name}"] = rows_pipeline(get_encoder(name))
+        except ImportError:
+            pass
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_benchmark_app(workdir)
+        with app.app_context():
+            load_csv_data(write_csv(os.path.join(workdir, "data.csv"), size))
+            for name, pipeline in pipelines.items():
+                payload_size, elapsed, peak = measure(pipeline)
+                results.append(
+                    {
+                        "size": size,
+                        "pipeline": name,
+                        "payload_bytes": payload_size,
+                        "seconds": round(elapsed, 4),
+                        "peak_mib": round(peak / 2**20, 2),
+                    }
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'size':>9} {'pipeline':<18} {'payload MiB':>12} {'seconds':>9} {'peak MiB':>9}")
+    for size in args.sizes:
+        for r in run(size):
+            results.append(r)
+            print(
+                f"{r['size']:>9} {r['pipeline']:<18} {r['payload_bytes'] / 2**20:>12.2f} "
+                f"{r['seconds']:>9.3f} {r['peak_mib']:>9.2f}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
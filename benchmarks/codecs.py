@@ -0,0 +1,104 @@
+"""
+Measure the bytes stored and the time taken to encode and decode result
+pages, for each result encoder and codec.
+
+Pages are built from generated records the way ResultStore stores them, so
+the numbers are those of RESULT_PAGE_SIZE records per Redis list item. The
+encoders and codecs whose optional package is not installed are skipped.
+
+    python -m benchmarks.codecs --records 100000 --page-sizes 50 500
+"""
+import argparse
+import json
+import time
+
+from app.codecs import CODECS, get_codec
+from app.encoders import ENCODERS, get_encoder, load_records
+
+from .datasets import generate_rows
+
+# "auto" is one of the other encoders
+SKIPPED_ENCODERS = {"auto"}
+
+
+def pages_of(rows, page_size):
+    return [rows[i : i + page_size] for i in range(0, len(rows), page_size)]
+
+
+def measure(encoder, codec, pages):
+    started = time.perf_counter()
+    stored = [codec.compress(encoder.dumps(page)) for page in pages]
+    encoded = time.perf_counter()
+    for payload in stored:
+        load_records(codec.decompress(payload), encoder.format)
+    decoded = time.perf_counter()
+    return sum(map(len, stored)), encoded - started, decoded - encoded
+
+
+def available(names, factory, skipped=()):
+    found = {}
+    for name in names:
+        if name in skipped:
+            continue
+        try:
+            found[name] = factory(name)
+        except ImportError:
+            pass
+    return found
+
+
+def run(records, page_size):
+    rows = [(i, *row) for i, row in enumerate(generate_rows(records), 1)]
+    pages = pages_of(rows, page_size)
+    encoders = available(ENCODERS, get_encoder, SKIPPED_ENCODERS)
+    codecs = available(CODECS, get_codec)
+
+    results, baseline = [], None
+    for encoder_name, encoder in encoders.items():
+        for codec_name, codec in codecs.items():
+            stored, encode_s, decode_s = measure(encoder, codec, pages)
+            if baseline is None:
+                baseline = stored
+            results.append(
+                {
+                    "records": records,
+                    "page_size": page_size,
+                    "encoder": encoder_name,
+                    "codec": codec_name,
+                    "stored_bytes": stored,
+                    "ratio": round(stored / baseline, 3),
+                    "encode_ms": round(encode_s * 1000, 2),
+                    "decode_ms": round(decode_s * 1000, 2),
+                }
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(
+        f"{'page':>6} {'encoder':<8} {'codec':<10} {'stored MiB':>11} {'ratio':>6} "
+        f"{'encode ms':>10} {'decode ms':>10}"
+    )
+    for page_size in args.page_sizes:
+        for r in run(args.records, page_size):
+            results.append(r)
+            print(
+                f"{r['page_size']:>6} {r['encoder']:<8} {r['codec']:<10} "
+                f"{r['stored_bytes'] / 2**20:>11.2f} {r['ratio']:>6.3f} "
+                f"{r['encode_ms']:>10.2f} {r['decode_ms']:>10.2f}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import csv
+import os
+import random
+
+__all__ = ["SAMPLE", "generate_rows", "write_csv"]
+
+# the sample of the repository, wherever the benchmarks are run from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, "app", "files", "vibra_challenge.csv")
+
+
+def _vocabulary(sample=SAMPLE):
+    with open(sample, newline="") as f:
+        rows = list(csv.reader(f))
+    columns = list(zip(*rows))
+    return {
+        "first_name": sorted(set(columns[1])),
+        "last_name": sorted(set(columns[2])),
+        "domain": sorted({email.rpartition("@")[2] for email in columns[3]}),
+        "gender": sorted(set(columns[4])),
+        "company": sorted(set(columns[5])),
+        "city": sorted(set(columns[6])),
+    }
+
+
+def generate_rows(count, seed=0):
+    """
+    Generate records shaped like vibra_challenge.csv, drawing the values
+    from the sample file so the selectivity of searches is realistic.
+
+    Args:
+        count (int): The number of records.
+        seed (int): The random seed, the same seed gives the same records.
+
+    Yields:
+        list: The fields of a record.
+    """
+    vocabulary = _vocabulary()
+    rand = random.Random(seed)
+    for user_id in range(1, count + 1):
+        first_name = rand.choice(vocabulary["first_name"])
+        last_name = rand.choice(vocabulary["last_name"])
+        email = f"{first_name[0]}{last_name}{user_id}@{rand.choice(vocabulary['domain'])}"
+        yield [
+            user_id,
+            first_name,
+            last_name,
+            email.lower(),
+            rand.choice(vocabulary["gender"]),
+            rand.choice(vocabulary["company"]),
+            rand.choice(vocabulary["city"]),
+        ]
+
+
+def write_csv(path, count, seed=0):
+    """Write a generated dataset of count records to a CSV file."""
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(generate_rows(count, seed))
+    return path
@@ -0,0 +1,38 @@
+import logging
+import os
+
+import fakeredis
+
+from app import create_app, db
+from app.config import Config
+
+__all__ = ["BenchmarkConfig", "create_benchmark_app"]
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    JOB_WORKERS = 0
+    SEARCH_CACHE_TTL = 0
+
+
+def create_benchmark_app(workdir, **config):
+    """
+    Create an app on a SQLite database in workdir and a fakeredis server.
+
+    Args:
+        workdir (str): The directory of the database file.
+        **config: Settings overriding BenchmarkConfig.
+
+    Returns:
+        Flask: The app, with its tables created.
+    """
+    settings = dict(
+        SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(workdir, "benchmark.db"),
+        **config,
+    )
+    app = create_app(type("Config", (BenchmarkConfig,), settings))
+    app.redis = fakeredis.FakeStrictRedis()
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        db.create_all()
+    return app
@@ -0,0 +1,114 @@
+"""
+Measure the CSV parsing throughput of load_csv_data() and of the process
+pool of load_csv_data_parallel(), by number of workers.
+
+A vibra_challenge.csv shaped file is generated, of about --size-mb (use
+several GB to see the scaling), or an existing one is given with --file.
+Parsing is measured without the database, which is usually the slower side
+on SQLite; --load also times the whole loads on SQLite.
+
+    python -m benchmarks.ingest --size-mb 2048 --workers 1 2 4 8 --load
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app.helpers import (
+    iter_csv_ranges,
+    load_csv_data,
+    load_csv_data_parallel,
+    read_csv_chunks,
+)
+
+from .datasets import write_csv
+from .environment import create_benchmark_app
+
+# bytes per generated record, to size the file
+RECORD_BYTES = 85
+
+
+def parse_sequential(filename):
+    with open(filename, newline="") as f:
+        return sum(len(chunk) for chunk in read_csv_chunks(f, 5000))
+
+
+def parse_parallel(filename, workers):
+    return sum(len(rows) for rows in iter_csv_ranges(filename, workers))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    rows = func(*args)
+    return rows, time.perf_counter() - started
+
+
+def measure_loads(filename, workers):
+    results = {}
+    for name, load in (
+        ("load_csv_data", lambda: load_csv_data(filename)),
+        (f"load_csv_data_parallel({workers})", lambda: load_csv_data_parallel(filename, workers)),
+    ):
+        with tempfile.TemporaryDirectory() as workdir:
+            app = create_benchmark_app(workdir)
+            with app.app_context():
+                results[name] = timed(load)
+    return results
+
+
+def run(filename, workers, load=False):
+    size_mb = os.path.getsize(filename) / 2**20
+    results = []
+
+    def record(name, rows, seconds):
+        results.append(
+            {
+                "pipeline": name,
+                "rows": rows,
+                "seconds": round(seconds, 3),
+                "mb_per_s": round(size_mb / seconds, 2),
+                "rows_per_s": round(rows / seconds),
+            }
+        )
+
+    record("csv.reader", *timed(parse_sequential, filename))
+    for count in workers:
+        record(f"{count} worker(s)", *timed(parse_parallel, filename, count))
+    if load:
+        for name, (rows, seconds) in measure_loads(filename, max(workers)).items():
+            record(name, rows, seconds)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", help="CSV file to parse instead of a generated one.")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the generated file.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--load", action="store_true", help="Also time the loads on SQLite.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        filename = args.file
+        if filename is None:
+            filename = os.path.join(workdir, "data.csv")
+            write_csv(filename, args.size_mb * 2**20 // RECORD_BYTES)
+        print(f"{filename}: {os.path.getsize(filename) / 2**20:.0f} MiB, {os.cpu_count()} CPU(s)")
+        results = run(filename, sorted(set(args.workers)), args.load)
+
+    print(f"{'pipeline':<30} {'rows':>10} {'seconds':>9} {'MiB/s':>8} {'rows/s':>10}")
+    for r in results:
+        print(
+            f"{r['pipeline']:<30} {r['rows']:>10} {r['seconds']:>9.3f} "
+            f"{r['mb_per_s']:>8.2f} {r['rows_per_s']:>10}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare the search engines on generated datasets.
+
+Reports the median time of each search and the csv_data rows filtered per
+second, with the time taken by in-memory engines to build their index.
+
+    python -m benchmarks.search_engines --sizes 1000 100000 1000000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from app.helpers import load_csv_data
+from app.search import ENGINES, engine_class
+
+from .datasets import write_csv
+from .environment import create_benchmark_app
+
+QUERIES = {
+    "selective name": ("glen", "", ""),
+    "non-selective name": ("a", "", ""),
+    "name and city": ("an", "o", ""),
+    "limited": ("a", "", 10),
+}
+
+
+def run(size, engines, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_benchmark_app(workdir)
+        with app.app_context():
+            load_csv_data(write_csv(os.path.join(workdir, "data.csv"), size))
+            for engine_name in engines:
+                engine = engine_class(engine_name)()
+                started = time.perf_counter()
+                engine.search("", "", 1)
+                warmup = time.perf_counter() - started
+
+                for query_name, query in QUERIES.items():
+                    timings = []
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        count = len(engine.search(*query))
+                        timings.append(time.perf_counter() - started)
+                    median = statistics.median(timings)
+                    results.append(
+                        {
+                            "size": size,
+                            "engine": engine_name,
+                            "query": query_name,
+                            "results": count,
+                            "warmup_s": round(warmup, 4),
+                            "median_s": round(median, 6),
+                            "rows_per_s": round(size / median),
+                        }
+                    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--engines", nargs="+", default=["sql", "columnar"], choices=ENGINES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'size':>9} {'engine':<9} {'query':<20} {'results':>8} {'warmup s':>9} {'median s':>10} {'rows/s':>13}")
+    for size in args.sizes:
+        for r in run(size, args.engines, args.repeat):
+            results.append(r)
+            print(
+                f"{r['size']:>9} {r['engine']:<9} {r['query']:<20} {r['results']:>8} "
+                f"{r['warmup_s']:>9.3f} {r['median_s']:>10.5f} {r['rows_per_s']:>13,}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Measure the startup time of the server: module imports, by top-level package,
+and create_app().
+
+Each run is a fresh interpreter started with -X importtime, so the numbers
+are those of a cold gunicorn worker. With --max-ms, exits with 1 when the
+median startup takes longer, to track it in CI.
+
+    python -m benchmarks.startup --repeat 5 --top 15 --json startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# run in the child interpreter, prints the create_app() time in seconds
+SCRIPT = """
+import time
+started = time.perf_counter()
+from {module} import {factory}
+imported = time.perf_counter()
+{factory}({args})
+print(time.perf_counter() - imported)
+"""
+
+
+def parse_importtime(output):
+    """
+    Parse the -X importtime report of an interpreter.
+
+    Args:
+        output (str): The stderr of the interpreter.
+
+    Returns:
+        dict: The self time of each imported module, in microseconds.
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules[fields[2].strip()] = int(fields[0])
+    return modules
+
+
+def by_package(modules):
+    """Sum the self time of modules by top-level package, in microseconds."""
+    packages = defaultdict(int)
+    for name, us in modules.items():
+        packages[name.partition(".")[0]] += us
+    return dict(packages)
+
+
+def measure(module="app", factory="create_app", args=""):
+    """
+    Start an interpreter importing a factory and calling it once.
+
+    Returns:
+        dict: The import time by package and the total import and factory
+        times, in milliseconds.
+    """
+    script = SCRIPT.format(module=module, factory=factory, args=args)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = parse_importtime(process.stderr)
+    return {
+        "import_ms": sum(modules.values()) / 1000,
+        "factory_ms": float(process.stdout.strip().splitlines()[-1]) * 1000,
+        "packages_ms": {name: us / 1000 for name, us in by_package(modules).items()},
+    }
+
+
+def run(repeat, module="app", factory="create_app"):
+    runs = [measure(module, factory) for _ in range(repeat)]
+    packages = defaultdict(list)
+    for r in runs:
+        for name, ms in r["packages_ms"].items():
+            packages[name].append(ms)
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    factory_ms = statistics.median(r["factory_ms"] for r in runs)
+    return {
+        "import_ms": round(import_ms, 2),
+        "factory_ms": round(factory_ms, 2),
+        "startup_ms": round(import_ms + factory_ms, 2),
+        "packages_ms": {
+            name: round(statistics.median(values), 2)
+            for name, values in sorted(packages.items(), key=lambda item: -statistics.median(item[1]))
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreters started (default 5).")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed (default 15).")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument("--max-ms", type=float, help="Fail when the median startup is slower.")
+    args = parser.parse_args(argv)
+
+    result = run(args.repeat)
+    print(f"{'package':<24} {'import ms':>10}")
+    for name, ms in list(result["packages_ms"].items())[: args.top]:
+        print(f"{name:<24} {ms:>10.2f}")
+    print(f"{'imports':<24} {result['import_ms']:>10.2f}")
+    print(f"{'create_app()':<24} {result['factory_ms']:>10.2f}")
+    print(f"{'startup':<24} {result['startup_ms']:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.max_ms is not None and result["startup_ms"] > args.max_ms:
+        print(f"Startup took {result['startup_ms']:.2f} ms, more than {args.max_ms:.2f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
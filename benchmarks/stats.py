@@ -0,0 +1,75 @@
+import math
+
+__all__ = ["percentile", "summarize", "compare"]
+
+
+def percentile(values, q):
+    """
+    Get a percentile of values, interpolating between the closest ranks.
+
+    Args:
+        values (list): The sorted values.
+        q (float): The percentile, between 0 and 100.
+    """
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(timings):
+    """
+    Summarize durations in seconds as milliseconds.
+
+    Returns:
+        dict: The count, mean, min, max and p50/p95/p99 of the durations.
+    """
+    values = sorted(t * 1000 for t in timings)
+    summary = {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values),
+        "min_ms": values[0],
+        "max_ms": values[-1],
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+    }
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in summary.items()}
+
+
+def compare(results, baseline, threshold, metrics=("p50_ms", "p95_ms")):
+    """
+    Find the benchmarks slower than in a baseline.
+
+    Args:
+        results (dict): Summaries by benchmark name.
+        baseline (dict): Summaries by benchmark name of a previous run.
+        threshold (float): The tolerated slowdown, 0.1 for 10%.
+        metrics (tuple): The summary values compared.
+
+    Returns:
+        list: A dict per regression, with the benchmark, the metric, both
+        values and the relative change.
+    """
+    regressions = []
+    for name, summary in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in metrics:
+            before, after = previous.get(metric), summary.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change > threshold:
+                regressions.append(
+                    {
+                        "benchmark": name,
+                        "metric": metric,
+                        "baseline": before,
+                        "current": after,
+                        "change": round(change, 4),
+                    }
+                )
+    return regressions
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import fakeredis
+from aiohttp.test_utils import TestClient, TestServer
+
+from aioapp import make_aiohttp_app
+from app import db
+from app.aio import NATIVE_HANDLERS
+from app.helpers import load_csv_data
+from app.models import CSVData
+from app.tasks import process_search_csv
+
+from .datasets import write_csv
+from .environment import create_benchmark_app
+from .stats import summarize
+
+__all__ = ["SEARCHES", "run_suite"]
+
+SEARCHES = {
+    "selective": ("glen", "", ""),
+    "selective-city": ("", "lanthenay", ""),
+    "name-and-city": ("an", "o", ""),
+    "non-selective-limited": ("a", "", 1000),
+}
+
+# stored results read back by the retrieval benchmarks
+RETRIEVALS = {
+    "small": ("glen", "", 20),
+    "large": ("", "", 10000),
+}
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_ingestion(workdir, csv_path, size):
+    app = create_benchmark_app(workdir)
+    with app.app_context():
+        started = time.perf_counter()
+        load_csv_data(csv_path)
+        elapsed = time.perf_counter() - started
+    summary = summarize([elapsed])
+    summary["rows_per_s"] = round(size / elapsed)
+    return app, summary
+
+
+def bench_search(app, repeat):
+    results = {}
+    with app.app_context():
+        for name, (first_name, city, quantity) in SEARCHES.items():
+            timings = timed(
+                lambda: asyncio.run(
+                    process_search_csv(first_name, city, quantity, "benchmark")
+                ),
+                repeat,
+            )
+            results[name] = summarize(timings)
+    return results
+
+
+def bench_flask_retrieval(app, repeat):
+    results = {}
+    client = app.test_client()
+    for name in RETRIEVALS:
+        for suffix, query in (("", ""), ("-page", "?cursor=0&page_size=100")):
+            url = f"/redis/{name}{query}"
+            results[f"{name}{suffix}"] = summarize(timed(lambda: client.get(url).data, repeat))
+    return results
+
+
+async def _aiohttp_retrieval(aioapp, repeat):
+    results = {}
+    async with TestClient(TestServer(aioapp)) as client:
+        for name in RETRIEVALS:
+            for suffix, query in (("", ""), ("-page", "?cursor=0&page_size=100")):
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    response = await client.get(f"/redis/{name}{query}")
+                    await response.read()
+                    timings.append(time.perf_counter() - started)
+                results[f"{name}{suffix}"] = summarize(timings)
+    return results
+
+
+def bench_aiohttp_retrieval(app, server, repeat):
+    aioapp = make_aiohttp_app(app)
+    aioapp[NATIVE_HANDLERS].redis = fakeredis.aioredis.FakeRedis(server=server)
+    return asyncio.run(_aiohttp_retrieval(aioapp, repeat))
+
+
+def run_suite(sizes, repeat, progress=print):
+    """
+    Run every benchmark on a generated dataset of each size.
+
+    Args:
+        sizes (list): The numbers of csv_data rows.
+        repeat (int): The number of timed runs of each benchmark.
+        progress (callable): Called with a line of text as benchmarks run.
+
+    Returns:
+        dict: Summaries by benchmark name, ``<group>/<size>/<benchmark>``.
+    """
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            progress(f"generating {size} rows")
+            csv_path = write_csv(os.path.join(workdir, "data.csv"), size)
+
+            progress(f"ingestion of {size} rows")
+            app, results[f"ingestion/{size}/load_csv_data"] = bench_ingestion(
+                workdir, csv_path, size
+            )
+            server = fakeredis.FakeServer()
+            app.redis = fakeredis.FakeStrictRedis(server=server)
+
+            progress(f"searches on {size} rows")
+            for name, summary in bench_search(app, repeat).items():
+                results[f"search/{size}/{name}"] = summary
+
+            with app.app_context():
+                for name, query in RETRIEVALS.items():
+                    asyncio.run(process_search_csv(*query, name))
+
+            progress(f"retrievals on {size} rows")
+            for name, summary in bench_flask_retrieval(app, repeat).items():
+                results[f"retrieval-flask/{size}/{name}"] = summary
+            for name, summary in bench_aiohttp_retrieval(app, server, repeat).items():
+                results[f"retrieval-aiohttp/{size}/{name}"] = summary
+
+            with app.app_context():
+                db.session.remove()
+                CSVData.__table__.drop(db.engine)
+    return results
@@ -1,2 +1,2 @@
 #!/bin/sh
-exec $HOME/.local/bin/poetry run gunicorn -b :5000 --access-logfile - --error-logfile - aioapp:aioapp -k aiohttp.worker.GunicornWebWorker
+exec $HOME/.local/bin/poetry run gunicorn -c gunicorn.conf.py aioapp:aioapp
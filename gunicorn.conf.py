@@ -0,0 +1,20 @@
+"""Gunicorn settings of the production server, run by boot.sh."""
+import gc
+import os
+
+bind = ":5000"
+worker_class = "aiohttp.worker.GunicornWebWorker"
+accesslog = "-"
+errorlog = "-"
+
+# build the app once in the master and fork the workers from it, sharing its
+# memory copy-on-write. Redis clients and database connections are opened in
+# each worker, the log listener thread is restarted there.
+preload_app = (os.environ.get("GUNICORN_PRELOAD") or "1") == "1"
+
+
+def when_ready(server):
+    # the objects of the preloaded app live as long as the workers, keep the
+    # garbage collector from writing to, and so copying, their pages
+    if preload_app:
+        gc.freeze()
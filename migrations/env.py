@@ -69,6 +69,12 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info("No changes in schema detected.")
 
+    # the search indexes are managed by hand, not by the models
+    def include_object(object, name, type_, reflected, compare_to):
+        from app.search.indexes import is_search_index_object
+
+        return not (reflected and is_search_index_object(name, type_))
+
     engine = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
@@ -80,6 +86,7 @@ def run_migrations_online():
         connection=connection,
         target_metadata=target_metadata,
         process_revision_directives=process_revision_directives,
+        include_object=include_object,
         **current_app.extensions["migrate"].configure_args
     )
 
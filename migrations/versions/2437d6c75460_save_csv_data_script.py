@@ -18,7 +18,9 @@ depends_on = None
 
 def upgrade():
     from app.helpers import load_csv_data
-    load_csv_data("app/files/vibra_challenge.csv")
+    # loaded again after a downgrade, which keeps the rows: use sync-csv to update them
+    if op.get_bind().execute(sa.text("SELECT 1 FROM csv_data LIMIT 1")).first() is None:
+        load_csv_data("app/files/vibra_challenge.csv")
 
 
 def downgrade():
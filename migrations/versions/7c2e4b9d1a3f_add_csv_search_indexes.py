@@ -0,0 +1,25 @@
+"""add csv search indexes
+
+Revision ID: 7c2e4b9d1a3f
+Revises: 2437d6c75460
+Create Date: 2026-10-18 09:12:41.218604
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e4b9d1a3f'
+down_revision = '2437d6c75460'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from app.search.indexes import create_search_indexes
+    create_search_indexes(op.get_bind())
+
+
+def downgrade():
+    from app.search.indexes import drop_search_indexes
+    drop_search_indexes(op.get_bind())
@@ -0,0 +1,25 @@
+"""add csv fulltext index
+
+Revision ID: b5d8e2f4c6a1
+Revises: 7c2e4b9d1a3f
+Create Date: 2026-10-18 10:02:17.553912
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d8e2f4c6a1'
+down_revision = '7c2e4b9d1a3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from app.search.fulltext import create_fulltext_index
+    create_fulltext_index(op.get_bind())
+
+
+def downgrade():
+    from app.search.fulltext import drop_fulltext_index
+    drop_fulltext_index(op.get_bind())
@@ -0,0 +1,29 @@
+"""add csv row hash
+
+Revision ID: d4e7a2c9b1f3
+Revises: b5d8e2f4c6a1
+Create Date: 2026-10-18 11:24:36.104872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e7a2c9b1f3'
+down_revision = 'b5d8e2f4c6a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the hashes of the existing rows are filled by the first sync-csv
+    with op.batch_alter_table('csv_data') as batch_op:
+        batch_op.add_column(sa.Column('row_hash', sa.String(length=16), nullable=True))
+        batch_op.create_index('ix_csv_data_user_id', ['user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('csv_data') as batch_op:
+        batch_op.drop_index('ix_csv_data_user_id')
+        batch_op.drop_column('row_hash')